@@ -12,11 +12,9 @@
 #
 ##############################################################################
 
-from pyramid.config import Configurator
-import pyramid_chameleon
-import pyramid_zcml
-from repoze.zodbconn.finder import PersistentApplicationFinder
-
+# Imports of the application stack are deferred to 'main':  importing a
+# submodule (e.g. 'cartouche.authcheck') should not pull in Pyramid, ZCML
+# and Chameleon.
 
 def appmaker(zodb_root):
     if not 'app_root' in zodb_root:
@@ -31,12 +29,23 @@ def appmaker(zodb_root):
 def main(global_config, **settings):
     """ This function returns a Pyramid WSGI application.
     """
+    from pyramid.config import Configurator
+    import pyramid_chameleon
+    from pyramid.settings import asbool
+    import pyramid_zcml
+    from cartouche.databases import SharedApplicationFinder
+    from cartouche.util import getURLResolver
+    from cartouche.warmup import CACHE_SETTING
+    from cartouche.warmup import WARMUP_SETTING
+    from cartouche.warmup import useTemplateCache
+    from cartouche.warmup import warmup
+
     zodb_uri = settings.get('zodb_uri')
     zcml_file = settings.get('configure_zcml', 'configure.zcml')
     if zodb_uri is None:
         raise ValueError("No 'zodb_uri' in application configuration.")
 
-    finder = PersistentApplicationFinder(zodb_uri, appmaker)
+    finder = SharedApplicationFinder(zodb_uri, appmaker)
     def get_root(request):
         return finder(request.environ)
     config = Configurator(root_factory=get_root,
@@ -45,5 +54,13 @@ def main(global_config, **settings):
                          )
     config.include(pyramid_chameleon)
     config.include(pyramid_zcml)
+
+    template_cache = settings.get(CACHE_SETTING)
+    if template_cache:
+        useTemplateCache(template_cache)
+
     config.load_zcml(zcml_file)
+    getURLResolver(config.registry)
+    if asbool(settings.get(WARMUP_SETTING, False)):
+        warmup(config.registry)
     return config.make_wsgi_app()
@@ -18,6 +18,7 @@ PY3 = sys.version_info[0] == 3
 
 
 if PY3: #pragma NO COVER
+    from html import escape
     from string import ascii_letters as letters
     from urllib.parse import parse_qs
     from urllib.parse import parse_qsl
@@ -27,6 +28,7 @@ if PY3: #pragma NO COVER
     from urllib.parse import quote as url_quote
     from urllib.parse import urlencode as url_encode
 else:
+    from cgi import escape
     from string import letters
     from urllib import quote as url_quote
     from urllib import urlencode as url_encode
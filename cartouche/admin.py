@@ -1,10 +1,58 @@
 
 from pyramid.exceptions import HTTPNotFound
-from pyramid.renderers import get_renderer
+from pyramid.httpexceptions import HTTPBadRequest
+from pyramid.response import Response
 
+from cartouche.export import PROFILE_FIELDS
+from cartouche.export import exportLines
 from cartouche.interfaces import IRegistrations
 from cartouche.persistence import ConfirmedRegistrations
 from cartouche.persistence import PendingRegistrations
+from cartouche.util import getMainTemplate
+
+PAGE_SIZE = 50
+SEARCH_LIMIT = 50
+# Secrets (and the profiles holding security answers) left out of exports
+# served over the web:  use the 'export_cartouche_users' script for a
+# complete export.
+EXPORT_EXCLUDE = ('password', 'token', 'token_expires') + PROFILE_FIELDS
+
+
+def _paginate(registrations, request, name, size):
+    # Cursor-based paging:  '<name>_after' is the last key of the previous
+    # page, '<name>_before' the first key of the next one.  Each link carries
+    # a single cursor, however deep the page.
+    params = request.params
+    after = params.get('%s_after' % name)
+    before = params.get('%s_before' % name)
+    if before is not None:
+        items = registrations.page(size=size + 1, before=before)
+        if len(items) > size:
+            items = items[1:]
+            return (items,
+                    [('%s_after' % name, items[-1][0])],
+                    [('%s_before' % name, items[0][0])])
+        after = None  # Reached the start:  show the first page.
+    items = registrations.page(after, size + 1)
+    more = len(items) > size
+    items = items[:size]
+    next_query = prev_query = None
+    if more:
+        next_query = [('%s_after' % name, items[-1][0])]
+    if after is not None and items:
+        prev_query = [('%s_before' % name, items[0][0])]
+    return items, next_query, prev_query
+
+
+def _pageURL(context, request, name, query):
+    if query is None:
+        return None
+    # Preserve the other listing's position.
+    keep = [(key, value) for key, value in request.params.items()
+                if not key.startswith('%s_' % name)]
+    return request.resource_url(context, request.view_name,
+                                query=keep + query)
+
 
 def admin_overview(context, request):
     pending = request.registry.queryAdapter(context, IRegistrations,
@@ -17,10 +65,30 @@ def admin_overview(context, request):
     if confirmed is None:
         confirmed = ConfirmedRegistrations(context)
 
-    main_template = get_renderer('templates/main.pt')
-    return {'main_template': main_template.implementation(),
-            'pending': sorted(pending),
-            'confirmed': sorted(confirmed),
+    search = request.params.get('q', '').strip()
+    if search:
+        p_items = pending.search(search, SEARCH_LIMIT)
+        c_items = confirmed.search(search, SEARCH_LIMIT)
+        p_next = p_prev = c_next = c_prev = None
+    else:
+        p_items, p_next, p_prev = _paginate(pending, request, 'pending',
+                                            PAGE_SIZE)
+        c_items, c_next, c_prev = _paginate(confirmed, request, 'confirmed',
+                                            PAGE_SIZE)
+    return {'main_template': getMainTemplate(request),
+            'search': search,
+            'pending_count': pending.count(),
+            'confirmed_count': confirmed.count(),
+            'pending': p_items,
+            'pending_next_url': _pageURL(context, request,
+                                         'pending', p_next),
+            'pending_prev_url': _pageURL(context, request,
+                                         'pending', p_prev),
+            'confirmed': c_items,
+            'confirmed_next_url': _pageURL(context, request,
+                                           'confirmed', c_next),
+            'confirmed_prev_url': _pageURL(context, request,
+                                           'confirmed', c_prev),
            }
 
 
@@ -34,8 +102,7 @@ def admin_pending(context, request):
     record = pending.get(email)
     if record is None:
         return HTTPNotFound()
-    main_template = get_renderer('templates/main.pt')
-    return {'main_template': main_template.implementation(),
+    return {'main_template': getMainTemplate(request),
             'page_title': 'Edit Pending Registration',
             'email': email,
             'token': record.token,
@@ -54,8 +121,7 @@ def admin_confirmed(context, request):
     if record is None:
         return HTTPNotFound()
 
-    main_template = get_renderer('templates/main.pt')
-    return {'main_template': main_template.implementation(),
+    return {'main_template': getMainTemplate(request),
             'page_title': 'Edit Confirmed Registration',
             'login': login,
             'uuid': record.uuid,
@@ -65,3 +131,36 @@ def admin_confirmed(context, request):
             'security_question': record.security_question,
             'security_answer': record.security_answer,
            }
+
+
+def admin_export(context, request):
+    # Stream pending / confirmed registrations as JSON lines.
+    which = request.params.get('registrations', 'confirmed')
+    if which not in ('pending', 'confirmed'):
+        return HTTPNotFound()
+    registrations = request.registry.queryAdapter(context, IRegistrations,
+                                                  name=which)
+    if registrations is None:
+        if which == 'pending':
+            registrations = PendingRegistrations(context)
+        else:
+            registrations = ConfirmedRegistrations(context)
+    after = request.params.get('after')
+    limit = request.params.get('limit')
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            limit = -1
+        if limit < 0:
+            return HTTPBadRequest('Invalid limit')
+    # Bound memory use:  evict the records of each exported batch.
+    jar = getattr(context, '_p_jar', None)
+    minimize = jar.cacheGC if jar is not None else None
+    lines = exportLines(registrations, after, limit, minimize=minimize,
+                        exclude=EXPORT_EXCLUDE)
+    response = Response(content_type='application/x-ndjson',
+                        charset='utf-8')
+    response.content_disposition = 'attachment; filename=%s.jsonl' % which
+    response.app_iter = (line.encode('utf-8') for key, line in lines)
+    return response
@@ -0,0 +1,87 @@
+##############################################################################
+#
+# Copyright (c) 2010 Agendaless Consulting and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+""" Minimal WSGI endpoint answering reverse-proxy authentication checks.
+
+Intended as the target of e.g. nginx's ``auth_request``:  it runs the
+identifiers and authenticators of a :mod:`repoze.who` configuration (such
+as ``auth_tkt`` and :class:`cartouche.whoplugin.WhoPlugin`) against the
+sub-request, answering '204 No Content' with the user's UUID and groups in
+response headers, or '401 Unauthorized'.  The WhoPlugin must also be
+configured as a metadata provider, checking that the authenticated user
+(e.g. from an 'auth_tkt' cookie) is still confirmed:  identities it has
+not marked so are refused.  It imports neither Pyramid's configuration
+machinery, nor ZCML, forms or templates.
+"""
+import os
+import sys
+
+from repoze.who.config import make_api_factory_with_config
+
+from cartouche._compat import PY3
+from cartouche.whoplugin import CONFIRMED_KEY
+
+USERID_HEADER = 'X-Cartouche-Userid'
+GROUPS_HEADER = 'X-Cartouche-Groups'
+
+
+class AuthCheckApp(object):
+    """ WSGI application authenticating each request via 'api_factory'.
+    """
+    def __init__(self, api_factory,
+                 userid_header=USERID_HEADER, groups_header=GROUPS_HEADER):
+        self.api_factory = api_factory
+        self.userid_header = userid_header
+        self.groups_header = groups_header
+
+    def __call__(self, environ, start_response):
+        try:
+            identity = self.api_factory(environ).authenticate()
+        finally:
+            # Close any connections the WhoPlugin opened:  if
+            # 'cartouche.databases' was never imported, there are none.
+            databases = sys.modules.get('cartouche.databases')
+            if databases is not None:
+                databases.closeConnections(environ)
+        if identity is None or not identity.get(CONFIRMED_KEY):
+            start_response('401 Unauthorized', [('Content-Length', '0')])
+            return []
+        headers = [(self.userid_header,
+                    _headerValue(identity['repoze.who.userid']))]
+        groups = identity.get('groups')
+        if groups is not None:
+            headers.append((self.groups_header,
+                            _headerValue(','.join(groups))))
+        start_response('204 No Content', headers)
+        return []
+
+
+def _headerValue(value):
+    # WSGI header values are native strings:  send UTF-8 bytes.
+    if not isinstance(value, bytes):
+        value = value.encode('utf-8')
+    if PY3: #pragma NO COVER
+        value = value.decode('latin-1')
+    return value
+
+
+def make_app(global_conf, who_config, userid_header=USERID_HEADER,
+             groups_header=GROUPS_HEADER):
+    """ Paste application factory:  'who_config' names a repoze.who file.
+    """
+    here = global_conf.get('here', os.getcwd())
+    config_file = os.path.abspath(os.path.join(here, who_config))
+    config_dir, _ = os.path.split(config_file)
+    api_factory = make_api_factory_with_config({'here': config_dir},
+                                               config_file)
+    return AuthCheckApp(api_factory, userid_header, groups_header)
@@ -0,0 +1,270 @@
+##############################################################################
+#
+# Copyright (c) 2010 Agendaless Consulting and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+""" Read-through caching of registration lookups.
+
+:class:`CachingRegistrationsFactory` wraps any :class:`IRegistrations`
+adapter factory, sharing one :class:`cartouche.lru.LRUCache` across every
+adapter it creates in the process.  Cached records are detached snapshots of
+the fields logging in needs, safe to share across threads and database
+connections;  other fields (e.g. the security question) are read from the
+underlying record, loaded on first access.  Writes made through
+the wrapper invalidate the affected entries at once, and again when the
+transaction commits or aborts;  until then, lookups of those entries bypass
+the cache, so uncommitted state is never cached.  Writes made by other
+processes are seen once the entries expire ('ttl').
+"""
+import transaction
+from zope.interface import Interface
+from zope.interface import directlyProvides
+from zope.interface import implementer
+from zope.interface import providedBy
+from zope.schema import Float
+from zope.schema import Int
+from zope.schema import TextLine
+from zope.configuration.fields import GlobalObject
+
+from cartouche.export import PROFILE_FIELDS
+from cartouche.export import recordToDict
+from cartouche.interfaces import IRegistrations
+from cartouche.lru import LRUCache
+from cartouche._compat import u
+
+DEFAULT_MAXSIZE = 1000
+DEFAULT_TTL = 60.0
+
+
+class RegistrationSnapshot(object):
+    """ Read-only copy of a registration record's schema fields.
+
+    The profile fields are not copied:  once bound, a snapshot reads them
+    from the record returned by its loader, called on first access.
+    """
+    _load = None
+    _record = None
+
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+    def bind(self, load):
+        """ Return a copy of this snapshot, loading records via 'load'.
+        """
+        result = RegistrationSnapshot(**self.__dict__)
+        result._load = load
+        return result
+
+    def __getattr__(self, name):
+        if name.startswith('_') or self._load is None:
+            raise AttributeError(name)
+        if self._record is None:
+            self._record = self._load()
+            if self._record is None:
+                raise AttributeError(name)
+        return getattr(self._record, name)
+
+
+def snapshot(record):
+    fields = recordToDict(None, record, PROFILE_FIELDS)
+    del fields['key']
+    result = RegistrationSnapshot(**fields)
+    directlyProvides(result, providedBy(record))
+    return result
+
+
+def _clear(cache, entries):
+    for entry in entries:
+        cache.remove(entry)
+
+
+def _clearAfterCommit(status, cache, entries):
+    _clear(cache, entries)
+
+
+@implementer(IRegistrations)
+class CachingRegistrations(object):
+    """ Wrap an IRegistrations adapter, caching 'get' / 'get_by_*' lookups.
+    """
+    def __init__(self, registrations, cache,
+                 transaction_manager=transaction.manager):
+        self.registrations = registrations
+        self.cache = cache
+        self.transaction_manager = transaction_manager
+
+    def __iter__(self):
+        """ See IRegistrations.
+        """
+        return iter(self.registrations)
+
+    def count(self):
+        """ See IRegistrations.
+        """
+        return self.registrations.count()
+
+    def page(self, after=None, size=20, before=None):
+        """ See IRegistrations.
+        """
+        return self.registrations.page(after, size, before)
+
+    def search(self, prefix, limit=20):
+        """ See IRegistrations.
+        """
+        return self.registrations.search(prefix, limit)
+
+    def set(self, key, **kw):
+        """ See IRegistrations.
+        """
+        self._invalidate(key)
+        self.registrations.set(key, **kw)
+
+    def set_many(self, items):
+        """ See IRegistrations.
+        """
+        items = list(items)
+        for key, kw in items:
+            self._invalidate(key)
+        return self.registrations.set_many(items)
+
+    def update(self, key, **changes):
+        """ See IRegistrations.
+        """
+        self._invalidate(key)
+        self.registrations.update(key, **changes)
+
+    def get(self, key, default=None):
+        """ See IRegistrations.
+        """
+        pending = self._pending()
+        cached = None
+        if pending is None or ('key', key) not in pending:
+            cached = self.cache.get(('key', key))
+        if cached is None:
+            record = self.registrations.get(key)
+            if record is None:
+                return default
+            cached = snapshot(record)
+            if pending is None or ('key', key) not in pending:
+                self.cache.set(('key', key), cached)
+            return cached.bind(lambda: record)
+        return cached.bind(lambda: self.registrations.get(key))
+
+    def get_by_email(self, email, default=None):
+        """ See IRegistrations.
+        """
+        return self._getByIndex('email', email, default)
+
+    def get_by_login(self, login, default=None):
+        """ See IRegistrations.
+        """
+        return self._getByIndex('login', login, default)
+
+    def get_by_token(self, token, default=None):
+        """ See IRegistrations.
+        """
+        # Not cached:  tokens are single-use, and expire.
+        return self.registrations.get_by_token(token, default)
+
+    def remove(self, key):
+        """ See IRegistrations.
+        """
+        self._invalidate(key)
+        self.registrations.remove(key)
+
+    def _getByIndex(self, name, value, default):
+        pending = self._pending()
+        if pending is None or (name, value) not in pending:
+            key = self.cache.get((name, value))
+            if key is not None:
+                cached = self.get(key)
+                # Guard against an entry made stale by another process.
+                if cached is not None and getattr(cached, name, None) == value:
+                    return cached
+                self.cache.remove((name, value))
+        lookup = getattr(self.registrations, 'get_by_%s' % name)
+        record = lookup(value)
+        if record is None:
+            return default
+        key = getattr(record, 'uuid', None) or record.email
+        cached = snapshot(record)
+        if pending is None or not (((name, value) in pending) or
+                                   (('key', key) in pending)):
+            self.cache.set((name, value), key)
+            self.cache.set(('key', key), cached)
+        return cached.bind(lambda: record)
+
+    def _pending(self, create=False):
+        # The entries written in the current transaction, shared by every
+        # adapter using our cache.
+        txn = self.transaction_manager.get()
+        try:
+            return txn.data(self.cache)
+        except KeyError:
+            if not create:
+                return None
+        entries = set()
+        txn.set_data(self.cache, entries)
+        # Other threads may re-cache the old state before we commit, and
+        # an abort leaves it current:  clear the entries again either way.
+        txn.addAfterCommitHook(_clearAfterCommit, (self.cache, entries))
+        txn.addAfterAbortHook(_clear, (self.cache, entries))
+        return entries
+
+    def _invalidate(self, key):
+        entries = [('key', key)]
+        record = self.registrations.get(key)
+        if record is not None:
+            for name in ('login', 'email'):
+                value = getattr(record, name, None)
+                if value is not None:
+                    entries.append((name, value))
+        _clear(self.cache, entries)
+        self._pending(True).update(entries)
+
+
+class CachingRegistrationsFactory(object):
+    """ Adapter factory wrapping 'factory''s adapters in a shared cache.
+    """
+    def __init__(self, factory, maxsize=DEFAULT_MAXSIZE, ttl=DEFAULT_TTL):
+        self.factory = factory
+        self.cache = LRUCache(maxsize, ttl)
+
+    def __call__(self, context):
+        return CachingRegistrations(self.factory(context), self.cache)
+
+    def stats(self):
+        """ Return a mapping of cache statistics.
+        """
+        return {'hits': self.cache.hits,
+                'misses': self.cache.misses,
+                'size': len(self.cache),
+                'maxsize': self.cache.maxsize,
+                'ttl': self.cache.ttl,
+               }
+
+
+class ICachedRegistrationsDirective(Interface):
+    name = TextLine(title=u('name'), required=True)
+    factory = GlobalObject(title=u('factory'), required=True)
+    maxsize = Int(title=u('maxsize'), required=False,
+                  default=DEFAULT_MAXSIZE)
+    ttl = Float(title=u('ttl'), required=False, default=DEFAULT_TTL)
+
+
+def cachedRegistrations(_context, name, factory,
+                        maxsize=DEFAULT_MAXSIZE, ttl=DEFAULT_TTL):
+    for_ = (None,)
+    _context.action(
+        discriminator=('adapter', for_, IRegistrations, name),
+        callable=_context.registry.registerAdapter,
+        args=(CachingRegistrationsFactory(factory, maxsize, ttl),
+              for_, IRegistrations, name, _context.info),
+        )
@@ -0,0 +1,144 @@
+##############################################################################
+#
+# Copyright (c) 2010 Agendaless Consulting and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+""" Process-wide registry of ZODB databases, keyed by URI.
+
+Both the application (via :func:`cartouche.main`) and the ``repoze.who``
+plugin open their databases here, so that a given storage is opened (and its
+object caches paid for) only once per process.  Connections are drawn from
+the database's own pool, sized by the ``connection_pool_size`` URI
+parameter;  ZODB treats that size as a soft limit (logging a warning when
+it is exceeded), so it does not bound the number of open connections.
+
+The connections opened for a request (to the application's database, and
+to any other) are closed together when the closer stored in the WSGI
+environment is removed, e.g. by the ``repoze.zodbconn`` closer middleware,
+or by :func:`closeConnections`.
+"""
+from threading import Lock
+
+from repoze.zodbconn.finder import CLOSER_KEY
+from repoze.zodbconn.finder import PersistentApplicationFinder
+from repoze.zodbconn.uri import db_from_uri
+
+CONNECTION_KEY = 'cartouche.connection'
+
+_databases = {}  # zodb_uri -> [db, references]
+_lock = Lock()
+
+
+def get_db(zodb_uri):
+    """ Return the shared database for 'zodb_uri', opening it if needed.
+
+    Each call takes a reference to the database, to be released via
+    :func:`close_db`.
+    """
+    with _lock:
+        entry = _databases.get(zodb_uri)
+        if entry is None:
+            entry = _databases[zodb_uri] = [db_from_uri(zodb_uri), 0]
+        entry[1] += 1
+        return entry[0]
+
+
+def close_db(zodb_uri):
+    """ Release a reference to the shared database for 'zodb_uri'.
+
+    The database is closed, and forgotten, once its last reference is
+    released.
+    """
+    with _lock:
+        entry = _databases.get(zodb_uri)
+        if entry is None:
+            return
+        entry[1] -= 1
+        if entry[1] > 0:
+            return
+        del _databases[zodb_uri]
+    entry[0].close()
+
+
+class RequestCleanup(object):
+    """ Close a request's connections once removed from the environment.
+    """
+    def __init__(self, conn, environ):
+        # N.B.:  do *not* create a cycle by holding on to 'environ'!
+        self.connections = [conn]
+
+    def close(self):
+        while self.connections:
+            self.connections.pop().close()
+
+    __del__ = close
+
+
+def closeConnections(environ):
+    """ Close the connections opened for 'environ' by shared finders.
+    """
+    for key in [x for x in environ if x.startswith(CONNECTION_KEY)]:
+        del environ[key]
+    closer = environ.pop(CLOSER_KEY, None)
+    if isinstance(closer, RequestCleanup):
+        closer.close()
+
+
+class SharedApplicationFinder(PersistentApplicationFinder):
+    """ Application finder using the process-wide database for its URI.
+
+    Reuses any connection already opened for the request, either by the
+    ``repoze.zodbconn`` connector or by another shared finder for the same
+    database.
+    """
+    def __init__(self, uri, appmaker, cleanup=RequestCleanup, **kw):
+        super(SharedApplicationFinder, self).__init__(uri, appmaker,
+                                                      cleanup, **kw)
+
+    def __call__(self, environ):
+        conn = None
+        if self.connection_key:
+            conn = environ.get(self.connection_key)
+        if conn is None:
+            conn = environ.get(CONNECTION_KEY)
+            if conn is None:
+                conn = environ[CONNECTION_KEY] = self.db.open()
+                # Closed when the closer is removed from the environment.
+                environ[CLOSER_KEY] = self.cleanup(conn, environ)
+            elif conn.db() is not self.db:
+                # Opened by a finder for another database.
+                key = '%s:%s' % (CONNECTION_KEY, self.uri)
+                conn = environ.get(key)
+                if conn is None:
+                    conn = environ[key] = self.db.open()
+                    # Closed along with the first connection.
+                    environ[CLOSER_KEY].connections.append(conn)
+        return self.appmaker(conn.root())
+
+    def _get_db(self):
+        with self._db_lock:
+            if self._db is None:
+                self._db = get_db(self.uri)
+            return self._db
+
+    def _set_db(self, db=None): #pragma NO COVER
+        pass
+
+    db = property(_get_db, _set_db, _set_db)
+
+    def close(self):
+        """ Release our reference to the shared database.
+        """
+        with self._db_lock:
+            if self._db is None:
+                return
+            self._db = None
+        close_db(self.uri)
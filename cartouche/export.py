@@ -0,0 +1,89 @@
+##############################################################################
+#
+# Copyright (c) 2010 Agendaless Consulting and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+""" Streaming JSONL export of registrations.
+
+Records are read one page at a time, in key order, via
+:meth:`cartouche.interfaces.IRegistrations.page`, and each persistent record
+(and its profile) is turned back into a ghost once serialized, so memory use
+stays bounded however many registrations are exported.  Excluding the
+'PROFILE_FIELDS' avoids loading the profiles at all.  Each line carries the
+record's key, which can be passed back as 'after' to resume an interrupted
+export.
+"""
+import json
+
+from cartouche.interfaces import IPendingRegistrationInfo
+from cartouche.interfaces import IRegistrationInfo
+
+DEFAULT_BATCH_SIZE = 500
+
+# Fields stored on a confirmed record's separately-loaded profile.
+PROFILE_FIELDS = ('security_question', 'security_answer')
+
+_FIELDS = {
+    IRegistrationInfo: sorted(IRegistrationInfo.names()),
+    IPendingRegistrationInfo: sorted(IPendingRegistrationInfo.names()),
+}
+
+
+def recordToDict(key, record, exclude=()):
+    """ Return a JSON-serializable mapping of 'record''s schema fields.
+
+    Omit the fields named in 'exclude'.
+    """
+    for iface, names in _FIELDS.items():
+        if iface.providedBy(record):
+            break
+    else:
+        names = sorted(set(_FIELDS[IRegistrationInfo]) |
+                       set(_FIELDS[IPendingRegistrationInfo]))
+    result = {'key': key}
+    for name in names:
+        if name not in exclude:
+            result[name] = getattr(record, name, None)
+    return result
+
+
+def exportLines(registrations, after=None, limit=None,
+                batch_size=DEFAULT_BATCH_SIZE, minimize=None, exclude=()):
+    """ Yield a '(key, line)' pair per registration, in key order.
+
+    'line' is the record as a JSON object (a native string, with newline),
+    without the fields named in 'exclude'.
+
+    Start after the key 'after', stop after 'limit' records, and call
+    'minimize' after each batch (e.g. the connection's 'cacheGC').
+    """
+    count = 0
+    while limit is None or count < limit:
+        size = batch_size
+        if limit is not None:
+            size = min(size, limit - count)
+        batch = registrations.page(after, size)
+        if not batch:
+            return
+        for key, record in batch:
+            line = json.dumps(recordToDict(key, record, exclude),
+                              sort_keys=True)
+            for ob in (getattr(record, 'profile', None), record):
+                deactivate = getattr(ob, '_p_deactivate', None)
+                if deactivate is not None:
+                    deactivate()
+            yield key, line + '\n'
+        count += len(batch)
+        after = batch[-1][0]
+        if minimize is not None:
+            minimize()
+        if len(batch) < size:
+            return
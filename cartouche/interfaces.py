@@ -25,11 +25,32 @@ class ICartouche(Interface):
     """ Data container, held as an attribute of the root.
     """
     pending = Attribute(u('Pending registrations, keyed by email'))
+    pending_by_created = Attribute(
+                    u('Index, set of (created, email) for pending '
+                      'registrations'))
+    pending_count = Attribute(u('Number of pending registrations'))
     by_uuid = Attribute(u('Confirmed registrations, keyed by UUID'))
+    confirmed_count = Attribute(u('Number of confirmed registrations'))
     by_email = Attribute(u('Index, email -> UUID'))
     by_login = Attribute(u('Index, login name -> UUID'))
-    group_users = Attribute(u('Index, group name -> [UUID]'))
-    user_groups = Attribute(u('Index, UUID -> [group_name]'))
+    by_token = Attribute(u('Index, password reset token -> UUID'))
+    tokens_by_expiry = Attribute(
+                    u('Index, set of (expires, token) for expiring tokens'))
+    auth_by_login = Attribute(u('Optional index, login name -> '
+                                '(UUID, password hash)'))
+    group_users = Attribute(u('Index, group name -> set of UUIDs'))
+    user_groups = Attribute(u('Index, UUID -> set of group names'))
+    ids_by_uuid = Attribute(u('Compact layout:  UUID -> integer id'))
+    uuids_by_id = Attribute(u('Compact layout:  integer id -> UUID'))
+    records_by_id = Attribute(u('Compact layout:  integer id -> registration '
+                                'info'))
+    ids_by_login = Attribute(u('Compact layout:  login name -> integer id'))
+    ids_by_email = Attribute(u('Compact layout:  email -> integer id'))
+    ids_by_token = Attribute(u('Compact layout:  reset token -> integer id'))
+    group_ids = Attribute(u('Compact layout:  group name -> set of integer '
+                            'ids'))
+    id_groups = Attribute(u('Compact layout:  integer id -> set of group '
+                            'names'))
 
 
 class ITokenGenerator(Interface):
@@ -40,6 +61,14 @@ class ITokenGenerator(Interface):
         """
 
 
+class IUserIdGenerator(Interface):
+    """ Utility interface:  generate ids for newly-confirmed users.
+    """
+    def __call__():
+        """ Return a unique id as an ASCII-only string.
+        """
+
+
 class IPasswordGenerator(Interface):
     """ Utility interface:  generate random passwords for users.
     """
@@ -67,6 +96,7 @@ class IPendingRegistrationInfo(Interface):
     """
     email = Attribute(u('Registered e-mail address'))
     token = Attribute(u('Token generated at registration'))
+    created = Attribute(u('Time of registration, in seconds since the epoch'))
 
 
 class IRegistrationInfo(Interface):
@@ -74,10 +104,13 @@ class IRegistrationInfo(Interface):
     """
     uuid = Attribute(u('Opaque identifier'))
     email = Attribute(u('Registered e-mail address'))
+    login = Attribute(u('Login name'))
     password = Attribute(u('Hashed password'))
     security_question = Attribute(u('Security question'))
     security_answer = Attribute(u('Answer to security question'))
     token = Attribute(u('Token generated for password reset'))
+    token_expires = Attribute(u('Expiration time of token, in seconds since '
+                                'the epoch (None for no expiration)'))
 
 
 class IRegistrations(Interface):
@@ -87,10 +120,43 @@ class IRegistrations(Interface):
         """ Return an iterator over our items, (key, info).
         """
 
+    def count():
+        """ Return the number of stored items.
+        """
+
+    def page(after=None, size=20, before=None):
+        """ Return a list of at most 'size' items, (key, info), in key order.
+
+        If 'after' is passed, include only items whose keys sort after it.
+        If 'before' is passed, return instead the (at most 'size') items
+        immediately preceding that key.
+        """
+
+    def search(prefix, limit=20):
+        """ Return a list of at most 'limit' items, (key, info).
+
+        Match items whose login name or e-mail starts with 'prefix',
+        ignoring case.
+        """
+
     def set(key, **kw):
         """ Store registration info for 'key'.
         """
 
+    def set_many(items):
+        """ Store registration info for each '(key, kw)' pair in 'items'.
+
+        Return the number of records stored.
+        """
+
+    def update(key, **changes):
+        """ Update only the named fields of the info for 'key'.
+
+        Index entries are rewritten only for fields whose value changes.
+
+        Raise KeyError if not found.
+        """
+
     def get(key, default=None):
         """ Return info for 'key'.
 
@@ -109,8 +175,36 @@ class IRegistrations(Interface):
         Return 'default' if not found
         """
 
+    def get_by_token(token, default=None):
+        """ Return info for an unexpired 'token'.
+
+        Return 'default' if not found, or if expired.
+        """
+
     def remove(key):
         """ Remove info for 'key'.
 
         Raise KeyError if not found.
         """
+
+
+class IGroups(Interface):
+    """ Adapter interface:  manage group memberships of confirmed users.
+    """
+    def add(uuid, group):
+        """ Make the user identified by 'uuid' a member of 'group'.
+        """
+
+    def remove(uuid, group):
+        """ Remove the user identified by 'uuid' from 'group'.
+
+        Raise KeyError if the user is not a member.
+        """
+
+    def members(group):
+        """ Return an iterable of the UUIDs of the members of 'group'.
+        """
+
+    def groups_of(uuid):
+        """ Return an iterable of the names of the groups of 'uuid'.
+        """
@@ -12,19 +12,17 @@
 #
 ##############################################################################
 from email.message import Message
+from time import time
 
 from colander import Email
 from colander import Schema
 from colander import SchemaNode
 from colander import String
-from colander import null
 from deform import Form
 from deform import ValidationFailure
 from deform.widget import HiddenWidget
 from deform.widget import PasswordWidget
-from pyramid.renderers import get_renderer
 from pyramid.url import resource_url
-from repoze.sendmail.interfaces import IMailDelivery
 from repoze.who.api import get_api
 from webob.exc import HTTPFound
 
@@ -32,8 +30,10 @@ from cartouche.interfaces import IAutoLogin
 from cartouche.interfaces import ICameFromURL
 from cartouche.interfaces import IRegistrations
 from cartouche.persistence import ConfirmedRegistrations
+from cartouche.util import getMailDelivery
+from cartouche.util import getMainTemplate
 from cartouche.util import getRandomToken
-from cartouche.util import localhost_mta
+from cartouche.util import renderBlankForm
 from cartouche.util import sendGeneratedPassword
 from cartouche.util import view_url
 
@@ -43,17 +43,26 @@ class Login(Schema):
     came_from = SchemaNode(String(), missing=None, widget=HiddenWidget())
 
 
+# Schemas are stateless, so are built once;  forms record validation errors,
+# so are built per use.
+_LOGIN = Login()
+
+
+def _loginForm():
+    return Form(_LOGIN, buttons=('login',))
+
+
 def login_view(context, request):
     whence = request.registry.queryUtility(ICameFromURL)
     if whence is not None:
         came_from = whence(request)
     else:
         came_from = resource_url(context, request)
-    form = Form(Login(), buttons=('login',))
-    rendered_form = form.render({'came_from': came_from})
+    rendered_form = None
     message = request.GET.get('message')
 
     if 'login' in request.POST:
+        form = _loginForm()
         try:
             appstruct = form.validate(request.POST.items())
         except ValidationFailure as e:
@@ -72,8 +81,10 @@ def login_view(context, request):
                 return HTTPFound(location=came_from, headers=headers)
             message = 'Login failed'
 
-    main_template = get_renderer('templates/main.pt')
-    return {'main_template': main_template.implementation(),
+    if rendered_form is None:
+        rendered_form = renderBlankForm(request, 'login', _loginForm,
+                                        came_from=came_from)
+    return {'main_template': getMainTemplate(request),
             'came_from': came_from,
             'rendered_form': rendered_form,
             'message': message,
@@ -96,9 +107,8 @@ def logout_view(context, request):
         after_logout_url = view_url(context, request, 'after_logout_url', '')
         return HTTPFound(location=after_logout_url, headers=headers)
     identity = request.environ.get('repoze.who.identity', {})
-    main_template = get_renderer('templates/main.pt')
     return {'userid': identity.get('repoze.who.userid'),
-            'main_template': main_template.implementation(),
+            'main_template': getMainTemplate(request),
            }
 
 
@@ -119,9 +129,15 @@ class RecoverAccount(Schema):
     email = SchemaNode(String(), validator=Email())
 
 
+_RECOVER_ACCOUNT = RecoverAccount()
+
+
+def _recoverAccountForm():
+    return Form(_RECOVER_ACCOUNT, buttons=('recover',))
+
+
 def recover_account_view(context, request):
-    form = Form(RecoverAccount(), buttons=('recover',))
-    rendered_form = form.render(null)
+    rendered_form = None
     confirmed = request.registry.queryAdapter(context, IRegistrations,
                                               name='confirmed')
     if confirmed is None:  #pragma NO COVERAGE
@@ -131,6 +147,7 @@ def recover_account_view(context, request):
     message = request.GET.get('message')
 
     if 'recover' in request.POST:
+        form = _recoverAccountForm()
         try:
             appstruct = form.validate(request.POST.items())
         except ValidationFailure as e: #pragma NO COVER
@@ -143,8 +160,7 @@ def recover_account_view(context, request):
                 login = record.login
                 body = RECOVERY_EMAIL % {'login': login,
                                          'login_url': login_url}
-                delivery = registry.queryUtility(IMailDelivery,
-                                                 default=localhost_mta)
+                delivery = getMailDelivery(request)
                 email_message = Message()
                 email_message['Subject'] = 'Account recovery'
                 email_message.set_payload(body)
@@ -152,8 +168,10 @@ def recover_account_view(context, request):
             #else: # DO NOT report lookup errors
             return HTTPFound(location=login_url)
 
-    main_template = get_renderer('templates/main.pt')
-    return {'main_template': main_template.implementation(),
+    if rendered_form is None:
+        rendered_form = renderBlankForm(request, 'recover_account',
+                                        _recoverAccountForm)
+    return {'main_template': getMainTemplate(request),
             'rendered_form': rendered_form,
             'reset_password_url': view_url(context, request,
                                            'reset_password_url',
@@ -187,9 +205,26 @@ class ResetPassword(Schema):
     token = SchemaNode(String(), missing='')
 
 
+_RESET_PASSWORD = ResetPassword()
+
+
+def _resetPasswordForm():
+    return Form(_RESET_PASSWORD, buttons=('reset',))
+
+
+def _findByToken(confirmed, record, token):
+    found = confirmed.get_by_token(token)
+    if found is None and token and getattr(record, 'token', None) == token:
+        # BBB:  tokens issued before the token index existed are found only
+        # on their records.
+        expires = getattr(record, 'token_expires', None)
+        if expires is None or expires > time():
+            found = record
+    return found
+
+
 def reset_password_view(context, request):
-    form = Form(ResetPassword(), buttons=('reset',))
-    rendered_form = form.render(null)
+    rendered_form = None
     confirmed = request.registry.queryAdapter(context, IRegistrations,
                                               name='confirmed')
     if confirmed is None:  #pragma NO COVERAGE
@@ -200,6 +235,7 @@ def reset_password_view(context, request):
     message = request.GET.get('message')
 
     if 'reset' in request.POST:
+        form = _resetPasswordForm()
         try:
             appstruct = form.validate(request.POST.items())
         except ValidationFailure as e:
@@ -214,37 +250,33 @@ def reset_password_view(context, request):
             if token == '':
                 # send the e-mail
                 new_token = getRandomToken(request)
-                confirmed.set(record.uuid,
-                              email=record.email,
-                              login=login, 
-                              password=record.password,
-                              security_question=record.security_question,
-                              security_answer=record.security_answer,
-                              token=new_token,
-                             )
+                ttl = registry.settings.get('cartouche.token_ttl')
+                if ttl is not None:
+                    expires = time() + float(ttl)
+                else:
+                    expires = None
+                confirmed.update(record.uuid, token=new_token,
+                                 token_expires=expires)
                 from_addr = registry.settings['cartouche.from_addr']
                 body = RESET_EMAIL % {'token': new_token,
                                       'reset_url': reset_url}
-                delivery = registry.queryUtility(IMailDelivery,
-                                                 default=localhost_mta)
+                delivery = getMailDelivery(request)
                 message = Message()
                 message['Subject'] = 'Password reset confirmation'
                 message.set_payload(body)
                 delivery.send(from_addr, [record.email], message)
                 return HTTPFound(location=reset_url)
             else:
-                if token != record.token:
+                found = _findByToken(confirmed, record, token)
+                if found is None or found.uuid != record.uuid:
                     message = CHECK_TOKEN
                     # fall through to 'GET'
                 else:
-                    confirmed.set(record.uuid,
-                                  email=record.email,
-                                  login=record.login, 
-                                  password=None,  # clear it to allow update
-                                  security_question=record.security_question,
-                                  security_answer=record.security_answer,
-                                  token=None,     # clear it
-                                 )
+                    confirmed.update(record.uuid,
+                                     password=None,  # clear to allow update
+                                     token=None,     # clear it
+                                     token_expires=None,
+                                    )
                     after_reset_url = view_url(context, request,
                                                'after_reset_url',
                                                'edit_account.html',
@@ -259,8 +291,10 @@ def reset_password_view(context, request):
                         sendGeneratedPassword(request, record.uuid, confirmed)
                         return HTTPFound(location=after_reset_url)
 
-    main_template = get_renderer('templates/main.pt')
-    return {'main_template': main_template.implementation(),
+    if rendered_form is None:
+        rendered_form = renderBlankForm(request, 'reset_password',
+                                        _resetPasswordForm)
+    return {'main_template': getMainTemplate(request),
             'message': message,
             'rendered_form': rendered_form,
             'recover_account_url': view_url(context, request,
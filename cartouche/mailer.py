@@ -0,0 +1,202 @@
+##############################################################################
+#
+# Copyright (c) 2010 Agendaless Consulting and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+""" SMTP mailer reusing its connections across messages.
+
+:class:`repoze.sendmail.mailer.SMTPMailer` opens (and negotiates TLS and
+authentication on) a fresh connection for every message.
+:class:`PooledSMTPMailer` keeps idle connections open, sending each
+message over one checked out of its pool, so that a burst of messages
+shares a few connections.  Connections are opened lazily, replaced after
+'max_messages' messages or 'idle_timeout' seconds of disuse, and reopened
+once if the server has dropped them meanwhile.
+"""
+from email.message import Message
+import smtplib
+from threading import Lock
+from time import time
+
+from repoze.sendmail.delivery import NotAnEmailMessage
+from repoze.sendmail.encoding import encode_message
+from repoze.sendmail.mailer import EHLO_Error
+from repoze.sendmail.mailer import ESMTP_NotSupported
+from repoze.sendmail.mailer import HAVE_SSL
+from repoze.sendmail.mailer import SMTPMailer
+from repoze.sendmail.mailer import TLS_NotAvailable
+
+DEFAULT_MAX_IDLE = 4
+DEFAULT_MAX_MESSAGES = 100
+DEFAULT_IDLE_TIMEOUT = 30.0
+
+
+class _Connection(object):
+
+    def __init__(self, smtp, now):
+        self.smtp = smtp
+        self.sent = 0
+        self.last_used = now
+
+
+class PooledSMTPMailer(SMTPMailer):
+    """ SMTP mailer sending over a pool of keep-alive connections.
+
+    Keeps at most 'max_idle' connections open between messages.
+    """
+    def __init__(self, hostname='localhost', port=25, username=None,
+                 password=None, no_tls=False, force_tls=False, ssl=False,
+                 debug_smtp=False, max_idle=DEFAULT_MAX_IDLE,
+                 max_messages=DEFAULT_MAX_MESSAGES,
+                 idle_timeout=DEFAULT_IDLE_TIMEOUT, timer=time):
+        SMTPMailer.__init__(self, hostname, port, username, password,
+                            no_tls, force_tls, ssl, debug_smtp)
+        self.max_idle = max_idle
+        self.max_messages = max_messages
+        self.idle_timeout = idle_timeout
+        self._timer = timer
+        self._idle = []
+        self._lock = Lock()
+        self._started = timer()
+        self.sent = self.failed = 0
+        self.connections_opened = self.reconnects = 0
+
+    def send(self, fromaddr, toaddrs, message):
+        """ See IMailer.
+        """
+        if not isinstance(message, Message):
+            raise NotAnEmailMessage()
+        message = encode_message(message)
+        conn = self._checkout()
+        try:
+            try:
+                conn.smtp.sendmail(fromaddr, toaddrs, message)
+            except smtplib.SMTPServerDisconnected:
+                if conn.sent == 0:
+                    raise
+                # Dropped by the server while idle:  retry once, afresh.
+                self._close(conn)
+                with self._lock:
+                    self.reconnects += 1
+                conn = self._connect()
+                conn.smtp.sendmail(fromaddr, toaddrs, message)
+        except (smtplib.SMTPResponseException,
+                smtplib.SMTPRecipientsRefused):
+            # The connection is still usable, e.g. after a refused
+            # recipient, once the transaction is reset.
+            with self._lock:
+                self.failed += 1
+            self._reset(conn)
+            raise
+        except:
+            with self._lock:
+                self.failed += 1
+            self._close(conn)
+            raise
+        conn.sent += 1
+        with self._lock:
+            self.sent += 1
+        self._checkin(conn)
+
+    def close(self):
+        """ Close the idle connections.
+        """
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            self._quit(conn)
+
+    def stats(self):
+        """ Return a mapping of send-rate metrics.
+        """
+        with self._lock:
+            elapsed = self._timer() - self._started
+            return {'sent': self.sent,
+                    'failed': self.failed,
+                    'connections_opened': self.connections_opened,
+                    'reconnects': self.reconnects,
+                    'idle': len(self._idle),
+                    'elapsed': elapsed,
+                    'rate': elapsed and self.sent / elapsed or 0.0,
+                   }
+
+    def _checkout(self):
+        now = self._timer()
+        stale = []
+        found = None
+        with self._lock:
+            while self._idle:
+                conn = self._idle.pop()
+                if now - conn.last_used > self.idle_timeout:
+                    stale.append(conn)
+                else:
+                    found = conn
+                    break
+        for conn in stale:
+            self._quit(conn)
+        if found is None:
+            found = self._connect()
+        return found
+
+    def _checkin(self, conn):
+        conn.last_used = self._timer()
+        if conn.sent < self.max_messages:
+            with self._lock:
+                if len(self._idle) < self.max_idle:
+                    self._idle.append(conn)
+                    return
+        self._quit(conn)
+
+    def _connect(self):
+        # Negotiate as 'SMTPMailer.send' does.
+        smtp = self.smtp_factory()
+        code, response = smtp.ehlo()
+        if code < 200 or code >= 300:
+            code, response = smtp.helo()
+            if code < 200 or code >= 300:
+                smtp.close()
+                raise EHLO_Error(code, response)
+        have_tls = smtp.has_extn('starttls')
+        if not have_tls and self.force_tls:
+            smtp.close()
+            raise TLS_NotAvailable()
+        if have_tls and HAVE_SSL and not self.no_tls:
+            smtp.starttls()
+            smtp.ehlo()
+        if smtp.does_esmtp:
+            if self.username is not None and self.password is not None:
+                smtp.login(self.username, self.password)
+        elif self.username:
+            smtp.close()
+            raise ESMTP_NotSupported()
+        with self._lock:
+            self.connections_opened += 1
+        return _Connection(smtp, self._timer())
+
+    def _reset(self, conn):
+        try:
+            conn.smtp.rset()
+        except smtplib.SMTPException:
+            self._close(conn)
+        else:
+            self._checkin(conn)
+
+    def _quit(self, conn):
+        try:
+            conn.smtp.quit()
+        except Exception:
+            self._close(conn)
+
+    def _close(self, conn):
+        try:
+            conn.smtp.close()
+        except Exception:
+            pass
@@ -0,0 +1,253 @@
+##############################################################################
+#
+# Copyright (c) 2010 Agendaless Consulting and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+""" Deliver e-mail queued by :func:`cartouche.util.getMailDelivery`.
+
+With the ``cartouche.mail_queue`` setting, the views write outgoing e-mail
+to a maildir as their transaction commits, rather than waiting on the SMTP
+server.  :class:`MailQueueRunner` (run via the ``cartouche_mailq`` script)
+sends the queued messages using a pool of worker threads.  A message which
+fails with a transient error is retried after an exponentially growing
+delay, recorded as the file's modification time;  one which fails
+permanently, or too often, is moved to the dead-letter directory.
+
+Workers claim a message by renaming it, so several runners may drain the
+same queue.
+"""
+from email import header
+from email.parser import Parser
+import errno
+import logging
+from multiprocessing.pool import ThreadPool
+import os
+import smtplib
+from time import time
+
+from cartouche.mailer import DEFAULT_MAX_MESSAGES
+from cartouche.mailer import PooledSMTPMailer
+
+DEFAULT_WORKERS = 4
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_BACKOFF = 60.0
+DEAD_LETTER = '.dead'
+STALE_CLAIM = 3 * 60 * 60  # cf. 'repoze.sendmail.queue.MAX_SEND_TIME'
+
+_CLAIMED = '.sending-'
+_RETRY = '.retry'
+
+SENT = 'sent'
+RETRY = 'retry'
+DEAD = 'dead'
+
+log = logging.getLogger(__name__)
+
+
+def mailerFromSettings(settings, workers=DEFAULT_WORKERS):
+    """ Return an SMTP mailer configured by 'cartouche.smtp_*' settings.
+
+    The mailer keeps up to 'workers' connections open, so that each worker
+    sends many messages per connection.
+    """
+    def _get(name, default=None):
+        return settings.get('cartouche.smtp_%s' % name) or default
+    return PooledSMTPMailer(hostname=_get('host', 'localhost'),
+                            port=int(_get('port', 25)),
+                            username=_get('username'),
+                            password=_get('password'),
+                            no_tls=_asBool(_get('no_tls', False)),
+                            force_tls=_asBool(_get('force_tls', False)),
+                            max_idle=workers,
+                            max_messages=int(_get('max_messages',
+                                                  DEFAULT_MAX_MESSAGES)),
+                           )
+
+
+def _asBool(value):
+    if isinstance(value, bool):
+        return value
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def _parseMessage(stream):
+    # Undo the 'X-Actually-*' headers added by 'QueuedMailDelivery'.
+    message = Parser().parse(stream)
+    fromaddr = _decodeHeader(message['X-Actually-From'])
+    toaddrs = _decodeHeader(message['X-Actually-To'])
+    del message['X-Actually-From']
+    del message['X-Actually-To']
+    toaddrs = tuple([x.strip() for x in toaddrs.split(',') if x.strip()])
+    return fromaddr, toaddrs, message
+
+
+def _decodeHeader(value):
+    if value is None:
+        return ''
+    (value, charset), = header.decode_header(value)
+    if charset is not None:
+        value = value.decode(charset)
+    return value
+
+
+class MailQueueRunner(object):
+    """ Send the messages queued in the maildir at 'queue_path'.
+    """
+    def __init__(self, mailer, queue_path, dead_letter_path=None,
+                 workers=DEFAULT_WORKERS, max_attempts=DEFAULT_MAX_ATTEMPTS,
+                 backoff=DEFAULT_BACKOFF, timer=time):
+        self.mailer = mailer
+        self.queue_path = queue_path
+        if dead_letter_path is None:
+            dead_letter_path = os.path.join(queue_path, DEAD_LETTER)
+        self.dead_letter_path = dead_letter_path
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self._timer = timer
+        for path in (os.path.join(queue_path, 'new'),
+                     os.path.join(queue_path, 'cur'),
+                     os.path.join(queue_path, 'tmp'),
+                     dead_letter_path):
+            if not os.path.isdir(path):
+                os.makedirs(path)
+
+    def due(self):
+        """ Return the paths of messages due to be sent, oldest first.
+        """
+        now = self._timer()
+        found = []
+        for subdir in ('new', 'cur'):
+            directory = os.path.join(self.queue_path, subdir)
+            for name in os.listdir(directory):
+                if name.startswith('.'):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    mtime = os.stat(path).st_mtime
+                except OSError:
+                    continue  # sent meanwhile by another runner
+                if mtime <= now:
+                    found.append((mtime, path))
+        found.sort()
+        return [path for mtime, path in found]
+
+    def run(self):
+        """ Send every message now due;  return counts of the outcomes.
+        """
+        self.recoverStaleClaims()
+        counts = {SENT: 0, RETRY: 0, DEAD: 0}
+        paths = self.due()
+        if not paths:
+            return counts
+        if self.workers > 1 and len(paths) > 1:
+            pool = ThreadPool(min(self.workers, len(paths)))
+            try:
+                outcomes = pool.map(self.process, paths)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            outcomes = [self.process(path) for path in paths]
+        for outcome in outcomes:
+            if outcome is not None:
+                counts[outcome] += 1
+        return counts
+
+    def process(self, path):
+        """ Send the message at 'path'.
+
+        Return SENT, RETRY or DEAD, or None if another worker claimed it.
+        """
+        directory, name = os.path.split(path)
+        claimed = os.path.join(directory, _CLAIMED + name)
+        try:
+            os.rename(path, claimed)
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                return None
+            raise
+        # The rename keeps the queued file's mtime:  record the claim time,
+        # so that 'recoverStaleClaims' doesn't requeue a message queued long
+        # ago while we are still sending it.
+        now = self._timer()
+        os.utime(claimed, (now, now))
+        fromaddr = toaddrs = None
+        try:
+            with open(claimed) as stream:
+                fromaddr, toaddrs, message = _parseMessage(stream)
+            self.mailer.send(fromaddr, toaddrs, message)
+        except smtplib.SMTPResponseException as e:
+            if 500 <= e.smtp_code <= 599:
+                log.error('Permanent failure sending %s from %s to %s: %s',
+                          name, fromaddr, toaddrs, e)
+                return self._bury(claimed, name)
+            return self._retry(claimed, name, e)
+        except (smtplib.SMTPRecipientsRefused, ValueError) as e:
+            log.error('Cannot send %s: %s', name, e)
+            return self._bury(claimed, name)
+        except Exception as e:
+            return self._retry(claimed, name, e)
+        try:
+            os.remove(claimed)
+        except OSError as e:
+            # Requeued meanwhile, e.g. by a runner with a skewed clock:  the
+            # message is sent, whatever becomes of the requeued copy.
+            if e.errno != errno.ENOENT:
+                raise
+            log.warning('Claimed message %s vanished after sending', name)
+        log.info('Sent %s from %s to %s', name, fromaddr, ', '.join(toaddrs))
+        return SENT
+
+    def recoverStaleClaims(self, max_age=STALE_CLAIM):
+        """ Requeue messages claimed by a runner which died while sending.
+        """
+        cutoff = self._timer() - max_age
+        for subdir in ('new', 'cur'):
+            directory = os.path.join(self.queue_path, subdir)
+            for name in os.listdir(directory):
+                if not name.startswith(_CLAIMED):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    if os.stat(path).st_mtime < cutoff:
+                        os.rename(path, os.path.join(
+                                    directory, name[len(_CLAIMED):]))
+                except OSError:
+                    pass  # recovered meanwhile by another runner
+
+    def _retry(self, claimed, name, error):
+        base, attempts = _splitAttempts(name)
+        attempts += 1
+        if attempts >= self.max_attempts:
+            log.error('Giving up sending %s after %d attempts: %s',
+                      base, attempts, error)
+            return self._bury(claimed, base)
+        log.warning('Failed sending %s (attempt %d), will retry: %s',
+                    base, attempts, error)
+        target = os.path.join(self.queue_path, 'cur',
+                              '%s%s%d' % (base, _RETRY, attempts))
+        due = self._timer() + self.backoff * 2 ** (attempts - 1)
+        os.utime(claimed, (due, due))
+        os.rename(claimed, target)
+        return RETRY
+
+    def _bury(self, claimed, name):
+        base, attempts = _splitAttempts(name)
+        os.rename(claimed, os.path.join(self.dead_letter_path, base))
+        return DEAD
+
+
+def _splitAttempts(name):
+    base, sep, attempts = name.rpartition(_RETRY)
+    if sep and attempts.isdigit():
+        return base, int(attempts)
+    return name, 0
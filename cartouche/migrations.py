@@ -0,0 +1,119 @@
+##############################################################################
+#
+# Copyright (c) 2010 Agendaless Consulting and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+""" In-place migrations of the 'cartouche' container's storage layout.
+
+Each migration takes the traversal root and an optional 'commit' callable,
+called after every 'batch_size' records (e.g. 'transaction.savepoint'), so
+that large containers can be migrated without holding every change in
+memory.  Migrations return the number of records converted.
+"""
+from BTrees.OOBTree import OOBTree
+
+from cartouche.persistence import CompactConfirmedRegistrations
+from cartouche.persistence import CompactGroups
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+def _batched(items, batch_size, commit):
+    count = 0
+    for item in items:
+        yield item
+        count += 1
+        if commit is not None and count % batch_size == 0:
+            commit()
+
+
+def compact_ids(root, commit=None, batch_size=DEFAULT_BATCH_SIZE):
+    """ Move confirmed registrations and groups to the compact id layout.
+
+    Afterwards, register 'CompactConfirmedRegistrations' and 'CompactGroups'
+    in place of the default adapters.  The UUID-keyed mappings are emptied.
+    """
+    confirmed = CompactConfirmedRegistrations(root)
+    cartouche = confirmed._getCartouche()
+    if cartouche is None:
+        return 0
+    count = 0
+    for uuid, record in _batched(cartouche.by_uuid.items(),
+                                 batch_size, commit):
+        # Bypass '_setRecord':  the count of registrations is unchanged.
+        ref = confirmed._storeRecord(uuid, record)
+        confirmed._indexRecord(ref, record)
+        count += 1
+    groups = CompactGroups(root)
+    for uuid, names in _batched(cartouche.user_groups.items(),
+                                batch_size, commit):
+        for name in names:
+            try:
+                groups.add(uuid, name)
+            except KeyError:
+                pass  # membership of a since-removed user
+    for attr in ('by_uuid', 'by_login', 'by_email', 'by_token',
+                 'group_users', 'user_groups'):
+        setattr(cartouche, attr, OOBTree())
+    return count
+
+
+def split_profiles(root, commit=None, batch_size=DEFAULT_BATCH_SIZE):
+    """ Move confirmed users' profile fields out of their auth records.
+
+    Converts records stored before 'RegistrationInfo.profile' existed, in
+    either the default or the compact id layout.
+    """
+    cartouche = getattr(root, 'cartouche', None)
+    if cartouche is None:
+        return 0
+    count = 0
+    for record in _batched(_confirmedRecords(cartouche), batch_size, commit):
+        if record.profile is None:
+            record._getProfile()
+            count += 1
+    return count
+
+
+def auth_index(root, commit=None, batch_size=DEFAULT_BATCH_SIZE):
+    """ Build the optional 'auth_by_login' index of confirmed users.
+
+    The index maps each login onto '(uuid, password hash)', so that
+    checking a password loads a single bucket rather than the login index
+    bucket, the record's bucket and the record itself.  Once built, the
+    registrations adapters keep it up to date.  Rebuilds it if present.
+    """
+    cartouche = getattr(root, 'cartouche', None)
+    if cartouche is None:
+        return 0
+    index = OOBTree()
+    count = 0
+    for record in _batched(_confirmedRecords(cartouche), batch_size, commit):
+        index[record.login] = (record.uuid, record.password)
+        count += 1
+    cartouche.auth_by_login = index
+    return count
+
+
+def _confirmedRecords(cartouche):
+    # Records of either the default or the compact id layout.
+    for attr in ('by_uuid', 'records_by_id'):
+        mapping = getattr(cartouche, attr, None)
+        if mapping is not None:
+            for record in mapping.values():
+                yield record
+
+
+MIGRATIONS = {
+    'compact_ids': compact_ids,
+    'split_profiles': split_profiles,
+    'auth_index': auth_index,
+}
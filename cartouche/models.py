@@ -11,8 +11,11 @@
 # FITNESS FOR A PARTICULAR PURPOSE
 #
 ##############################################################################
+from time import time
 
+from BTrees.Length import Length
 from BTrees.OOBTree import OOBTree
+from BTrees.OOBTree import OOTreeSet
 from persistent import Persistent
 from persistent.mapping import PersistentMapping
 from pyramid.security import Allow
@@ -37,26 +40,77 @@ class Root(PersistentMapping):
 
 @implementer(ICartouche)
 class Cartouche(Persistent):
+    # BBB:  created lazily for existing instances
+    pending_by_created = pending_count = confirmed_count = None
+    by_token = tokens_by_expiry = None
+    # Optional;  see 'cartouche.migrations.auth_index'.
+    auth_by_login = None
+    # Used only by the compact layout (see 'CompactConfirmedRegistrations').
+    ids_by_uuid = uuids_by_id = records_by_id = None
+    ids_by_login = ids_by_email = ids_by_token = None
+    group_ids = id_groups = None
 
     def __init__(self):
         self.pending = OOBTree()
+        self.pending_by_created = OOTreeSet()
+        self.pending_count = Length()
+        self.confirmed_count = Length()
         self.by_uuid = OOBTree()
         self.by_email = OOBTree()
         self.by_login = OOBTree()
+        self.by_token = OOBTree()
+        self.tokens_by_expiry = OOTreeSet()
         self.group_users = OOBTree()
         self.user_groups = OOBTree()
 
 
 @implementer(IPendingRegistrationInfo)
 class PendingRegistrationInfo(Persistent):
+    created = None  # BBB:  records stored by earlier versions
 
-    def __init__(self, email, token):
+    def __init__(self, email, token, created=None):
+        if created is None:
+            created = time()
         self.email = email
         self.token = token
+        self.created = created
+
+
+class RegistrationProfile(Persistent):
+    """ Profile data of a confirmed user, not needed to authenticate.
+
+    Stored as a separate persistent object, so that it is loaded only when
+    one of its fields is used.
+    """
+    def __init__(self, security_question=None, security_answer=None):
+        self.security_question = security_question
+        self.security_answer = security_answer
+
+
+def _profileField(name):
+    def _get(self):
+        profile = self.profile
+        if profile is None:
+            # BBB:  records stored before the profile was split out.
+            return self.__dict__.get(name)
+        return getattr(profile, name)
+    def _set(self, value):
+        setattr(self._getProfile(), name, value)
+    return property(_get, _set)
 
 
 @implementer(IRegistrationInfo)
 class RegistrationInfo(Persistent):
+    """ Authentication record of a confirmed user.
+
+    Holds only what logging in needs;  the remaining fields are delegated
+    to the lazily-loaded 'profile'.
+    """
+    token_expires = None  # BBB:  records stored by earlier versions
+    profile = None  # BBB:  records stored by earlier versions
+
+    security_question = _profileField('security_question')
+    security_answer = _profileField('security_answer')
 
     def __init__(self,
                  uuid,
@@ -66,11 +120,24 @@ class RegistrationInfo(Persistent):
                  security_question,
                  security_answer,
                  token=None,
+                 token_expires=None,
                 ):
         self.uuid = uuid
         self.email = email
         self.login = login
         self.password = password
-        self.security_question = security_question
-        self.security_answer = security_answer
+        self.profile = RegistrationProfile(security_question, security_answer)
         self.token = token
+        self.token_expires = token_expires
+
+    def _getProfile(self):
+        """ Return our profile, splitting it out of old records if needed.
+        """
+        profile = self.profile
+        if profile is None:
+            legacy = self.__dict__
+            profile = RegistrationProfile(
+                        legacy.pop('security_question', None),
+                        legacy.pop('security_answer', None))
+            self.profile = profile
+        return profile
@@ -12,33 +12,124 @@
 #
 ##############################################################################
 
+from itertools import islice
+from random import randrange
+from time import time
+
+from BTrees.IIBTree import IITreeSet
+from BTrees.IOBTree import IOBTree
+from BTrees.Length import Length
+from BTrees.OOBTree import OOBTree
+from BTrees.OOBTree import OOTreeSet
+from BTrees.OIBTree import OIBTree
 from pyramid.traversal import find_root
 from zope.interface import implementer
 
+from cartouche.interfaces import IGroups
 from cartouche.interfaces import IRegistrations
 from cartouche.models import Cartouche
 from cartouche.models import PendingRegistrationInfo
 from cartouche.models import RegistrationInfo
 
 
-class _RegistrationsBase(object):
-    """ Default implementation for ZODB-based storage.
+def _startsWith(mapping, prefix):
+    # Does any key of BTree 'mapping' start with 'prefix'?
+    try:
+        key = mapping.minKey(prefix)
+    except ValueError:
+        return False
+    return key.startswith(prefix)
 
-    Finds / creates a 'cartouche' attribute of the traversal root.
 
-    Stores registration info in mapping attributes of the 'cartouche' object.
+def _prefixVariants(mapping, prefix):
+    # BTree keys compare case-sensitively:  enumerate the case variants of
+    # 'prefix' one character at a time, extending only those which some
+    # key starts with.  Each variant found bounds one range query.
+    variants = ['']
+    for ch in prefix:
+        variants = [v + c for v in variants
+                          for c in sorted(set([ch.lower(), ch.upper()]))
+                          if _startsWith(mapping, v + c)]
+        if not variants:
+            break
+    return variants
+
+
+def prefixSearch(mapping, prefix, limit):
+    """ Return up to 'limit' (key, value) pairs from BTree 'mapping'.
+
+    Match keys starting with 'prefix', ignoring case, in key order.
+    """
+    found = []
+    for variant in _prefixVariants(mapping, prefix):
+        # Every key in the variant's range matches:  stop after 'limit'.
+        count = 0
+        for key, value in mapping.items(min=variant):
+            if not key.startswith(variant) or count >= limit:
+                break
+            found.append((key, value))
+            count += 1
+    found.sort()
+    return found[:limit]
+
+
+class _CartoucheAdapterBase(object):
+    """ Finds / creates a 'cartouche' attribute of the traversal root.
     """
     cartouche = None
 
     def __init__(self, context):
         self.context = context
 
+    def _getCartouche(self, create=False):
+        if self.cartouche is not None:
+            return self.cartouche
+        root = find_root(self.context)
+        cartouche = getattr(root, 'cartouche', None)
+        if cartouche is None:
+            if create:
+                cartouche = self.cartouche = root.cartouche = Cartouche()
+        else:
+            self.cartouche = cartouche
+        return cartouche
+
+    def _getMapping(self, attr=None):
+        if self.cartouche is None: #pragma NO COVER
+            raise ValueError('Call _getCartouche first!')
+        if attr is None:
+            attr = self.ATTR
+        return getattr(self.cartouche, attr)
+
+
+class _RegistrationsBase(_CartoucheAdapterBase):
+    """ Default implementation for ZODB-based storage.
+
+    Stores registration info in mapping attributes of the 'cartouche' object.
+    """
     def set(self, key, **kw):
         """ See IRegistrations.
         """
         info = self._makeInfo(key, **kw)
         self._setRecord(key, info)
 
+    def set_many(self, items):
+        """ See IRegistrations.
+        """
+        count = 0
+        for key, kw in items:
+            self._setRecord(key, self._makeInfo(key, **kw))
+            count += 1
+        return count
+
+    def update(self, key, **changes):
+        """ See IRegistrations.
+        """
+        cartouche = self._getCartouche()
+        if cartouche is None:
+            raise KeyError(key)
+        record = self._getRecord(key)
+        self._updateRecord(key, record, changes)
+
     def get(self, key, default=None):
         """ See IRegistrations.
         """
@@ -54,47 +145,165 @@ class _RegistrationsBase(object):
         if cartouche is None:
             raise KeyError(key)
         del self._getMapping()[key]
+        self._changeCount(-1)
 
-    def __iter__(self):
+    def count(self):
+        """ See IRegistrations.
+        """
         cartouche = self._getCartouche()
         if cartouche is None:
-            return iter(())
-        return iter(self._getMapping().items())
+            return 0
+        counter = getattr(cartouche, self.COUNTER, None)
+        if counter is None:
+            # BBB:  container created before the counters were added.
+            return len(self._getMapping())
+        return counter()
 
-    def _getCartouche(self, create=False):
-        if self.cartouche is not None:
-            return self.cartouche
-        root = find_root(self.context)
-        cartouche = getattr(root, 'cartouche', None)
+    def page(self, after=None, size=20, before=None):
+        """ See IRegistrations.
+        """
+        cartouche = self._getCartouche()
         if cartouche is None:
-            if create:
-                cartouche = self.cartouche = root.cartouche = Cartouche()
+            return []
+        mapping = self._getMapping()
+        if before is not None:
+            items = mapping.items(max=before, excludemax=True)
+            # Seeks from the end of the range, without walking it.
+            return list(items[-size:]) if size else []
+        if after is None:
+            items = mapping.items()
         else:
-            self.cartouche = cartouche
-        return cartouche
+            items = mapping.items(min=after, excludemin=True)
+        # Loads only the buckets / records for the requested page.
+        return list(islice(items, size))
 
-    def _getMapping(self, attr=None):
-        if self.cartouche is None: #pragma NO COVER
-            raise ValueError('Call _getCartouche first!')
-        if attr is None:
-            attr = self.ATTR
-        return getattr(self.cartouche, attr)
+    def search(self, prefix, limit=20):
+        """ See IRegistrations.
+        """
+        cartouche = self._getCartouche()
+        if cartouche is None:
+            return []
+        return prefixSearch(self._getMapping(), prefix, limit)
+
+    def __iter__(self):
+        cartouche = self._getCartouche()
+        if cartouche is None:
+            return iter(())
+        return iter(self._getMapping().items())
+
+    def _getRecord(self, key):
+        # Raise KeyError if not found.
+        return self._getMapping()[key]
 
     def _setRecord(self, key, record):
         cartouche = self._getCartouche(True)
+        if key not in self._getMapping():
+            self._changeCount(1)
         self._getMapping()[key] = record
 
+    def _changeCount(self, delta):
+        # Call before adding / after removing the record.
+        counter = getattr(self.cartouche, self.COUNTER, None)
+        if counter is None:
+            # BBB:  container created before the counters were added.  Its
+            # length already reflects a removal, but not yet an addition.
+            counter = Length(len(self._getMapping()))
+            setattr(self.cartouche, self.COUNTER, counter)
+            if delta < 0:
+                return
+        counter.change(delta)
+
+    def _updateRecord(self, key, record, changes):
+        # Mutate the persistent record in place:  the mapping's bucket
+        # holding it need not be rewritten.
+        for name, value in changes.items():
+            setattr(record, name, value)
+
 
 @implementer(IRegistrations)
 class PendingRegistrations(_RegistrationsBase):
     """ Adapter for looking up pending registrations, keyed by email.
     """
     ATTR = 'pending'
+    COUNTER = 'pending_count'
+
+    def remove(self, key):
+        """ See IRegistrations.
+        """
+        cartouche = self._getCartouche()
+        if cartouche is None:
+            raise KeyError(key)
+        record = self._getMapping()[key]
+        del self._getMapping()[key]
+        self._changeCount(-1)
+        self._unindexCreated(key, record)
+
+    def expired(self, cutoff, limit=None):
+        """ Return emails of registrations created before 'cutoff'.
+
+        Return at most 'limit' emails, oldest first.
+        """
+        cartouche = self._getCartouche()
+        if cartouche is None:
+            return []
+        index = getattr(cartouche, 'pending_by_created', None)
+        if not index:
+            return []
+        result = []
+        stale = []
+        mapping = self._getMapping()
+        # (cutoff,) sorts before any (cutoff, email) key.
+        for created, email in index.keys(max=(cutoff,)):
+            if limit is not None and len(result) >= limit:
+                break
+            record = mapping.get(email)
+            if record is None or getattr(record, 'created', None) != created:
+                # Left behind by earlier versions' 'update(created=...)'.
+                stale.append((created, email))
+                continue
+            result.append(email)
+        for entry in stale:
+            index.remove(entry)
+        return result
 
     def _makeInfo(self, key, **kw):
         # Import here to allow reuse of views without stock models.
         token = kw['token']
-        return PendingRegistrationInfo(email=key, token=token)
+        return PendingRegistrationInfo(email=key, token=token,
+                                       created=kw.get('created'))
+
+    def _setRecord(self, key, record):
+        self._getCartouche(True)
+        old_record = self._getMapping().get(key)
+        if old_record is not None:
+            self._unindexCreated(key, old_record)
+        else:
+            self._changeCount(1)
+        self._getMapping()[key] = record
+        self._indexCreated(key, record)
+
+    def _updateRecord(self, key, record, changes):
+        reindex = 'created' in changes
+        if reindex:
+            self._unindexCreated(key, record)
+        super(PendingRegistrations, self)._updateRecord(key, record, changes)
+        if reindex:
+            self._indexCreated(key, record)
+
+    def _indexCreated(self, key, record):
+        created = getattr(record, 'created', None)
+        if created is not None:
+            index = getattr(self.cartouche, 'pending_by_created', None)
+            if index is None:
+                index = self.cartouche.pending_by_created = OOTreeSet()
+            index.add((created, key))
+
+    def _unindexCreated(self, key, record):
+        created = getattr(record, 'created', None)
+        index = getattr(self.cartouche, 'pending_by_created', None)
+        if created is not None and index is not None:
+            if (created, key) in index:
+                index.remove((created, key))
 
     def get_by_email(self, email, default=None):
         """ See IRegistrations.
@@ -106,34 +315,98 @@ class PendingRegistrations(_RegistrationsBase):
         """
         raise NotImplementedError
 
+    def get_by_token(self, token, default=None):
+        """ See IRegistrations.
+        """
+        raise NotImplementedError
+
 
 @implementer(IRegistrations)
 class ConfirmedRegistrations(_RegistrationsBase):
     """ Adapter for looking up confirmed registrations, keyed by UUID.
     """
     ATTR = 'by_uuid'
+    COUNTER = 'confirmed_count'
+    LOGIN_INDEX = 'by_login'
+    EMAIL_INDEX = 'by_email'
+    TOKEN_INDEX = 'by_token'
+    AUTH_INDEX = 'auth_by_login'
+    TREES = {}
 
     def get_by_email(self, email, default=None):
         """ See IRegistrations.
         """
+        return self._lookup(self.EMAIL_INDEX, email, default)
+
+    def get_by_login(self, login, default=None):
+        """ See IRegistrations.
+        """
+        return self._lookup(self.LOGIN_INDEX, login, default)
+
+    def get_by_token(self, token, default=None):
+        """ See IRegistrations.
+        """
+        record = self._lookup(self.TOKEN_INDEX, token)
+        if record is None or record.token != token:
+            return default
+        expires = getattr(record, 'token_expires', None)
+        if expires is not None and expires <= time():
+            return default
+        return record
+
+    def get_credentials(self, login, default=None):
+        """ Return '(uuid, password)' for the user with the given login.
+
+        If the optional auth index has been built (see
+        :func:`cartouche.migrations.auth_index`), read it, touching a single
+        bucket;  otherwise, load the record via 'get_by_login'.
+        """
         cartouche = self._getCartouche()
-        if cartouche is None:
+        if cartouche is None or login is None:
             return default
-        uuid = self._getMapping('by_email').get(email)
-        if uuid is None:
+        index = getattr(cartouche, self.AUTH_INDEX, None)
+        if index is not None:
+            return index.get(login, default)
+        record = self.get_by_login(login)
+        if record is None:
             return default
-        return self.get(uuid)
+        return record.uuid, record.password
 
-    def get_by_login(self, login, default=None):
+    def purge_expired_tokens(self, cutoff, limit=None):
+        """ Clear tokens expiring before 'cutoff'.
+
+        Clear at most 'limit' tokens, oldest first;  return the number
+        cleared.
+        """
+        cartouche = self._getCartouche()
+        if cartouche is None:
+            return 0
+        expiring = getattr(cartouche, 'tokens_by_expiry', None)
+        if not expiring:
+            return 0
+        # (cutoff,) sorts before any (cutoff, token) key.
+        expired = list(islice(expiring.keys(max=(cutoff,)), limit))
+        for expires, token in expired:
+            expiring.remove((expires, token))
+            record = self._lookup(self.TOKEN_INDEX, token)
+            if record is not None:
+                self.update(record.uuid, token=None, token_expires=None)
+        return len(expired)
+
+    def search(self, prefix, limit=20):
         """ See IRegistrations.
         """
         cartouche = self._getCartouche()
         if cartouche is None:
-            return default
-        uuid = self._getMapping('by_login').get(login)
-        if uuid is None:
-            return default
-        return self.get(uuid)
+            return []
+        found = {}
+        for attr in (self.LOGIN_INDEX, self.EMAIL_INDEX):
+            for key, ref in prefixSearch(self._getIndex(attr),
+                                         prefix, limit):
+                if ref not in found:
+                    found[ref] = key
+        matched = sorted([(key, ref) for ref, key in found.items()])
+        return [self._item(ref) for key, ref in matched[:limit]]
 
     def remove(self, key):
         """ See IRegistrations.
@@ -141,10 +414,13 @@ class ConfirmedRegistrations(_RegistrationsBase):
         cartouche = self._getCartouche()
         if cartouche is None:
             raise KeyError(key)
-        record = self._getMapping()[key]
-        del self._getMapping()[key]
-        del self._getMapping('by_login')[record.login]
-        del self._getMapping('by_email')[record.email]
+        record = self._getRecord(key)
+        self._deleteRecord(key)
+        self._changeCount(-1)
+        del self._getIndex(self.LOGIN_INDEX)[record.login]
+        del self._getIndex(self.EMAIL_INDEX)[record.email]
+        self._unindexToken(record)
+        self._unindexCredentials(record)
 
     def _makeInfo(self, key, **kw):
         email = kw['email']
@@ -153,6 +429,7 @@ class ConfirmedRegistrations(_RegistrationsBase):
         security_question = kw.get('security_question')
         security_answer = kw.get('security_answer')
         token = kw.get('token')
+        token_expires = kw.get('token_expires')
         return RegistrationInfo(uuid=key,
                                 email=email,
                                 login=login,
@@ -160,14 +437,343 @@ class ConfirmedRegistrations(_RegistrationsBase):
                                 security_question=security_question,
                                 security_answer=security_answer,
                                 token=token,
+                                token_expires=token_expires,
                                )
 
+    def _updateRecord(self, key, record, changes):
+        for name in ('login', 'email'):
+            if name in changes:
+                self._checkUnique(key, name, changes[name])
+        # Only rewrite index entries whose key actually changes.
+        ref = None
+        for name, attr in (('login', self.LOGIN_INDEX),
+                           ('email', self.EMAIL_INDEX)):
+            if name in changes and changes[name] != getattr(record, name):
+                if ref is None:
+                    ref = self._refOf(key)
+                index = self._getIndex(attr)
+                del index[getattr(record, name)]
+                index[changes[name]] = ref
+        reindex_token = 'token' in changes or 'token_expires' in changes
+        if reindex_token:
+            self._unindexToken(record)
+        reindex_credentials = 'login' in changes or 'password' in changes
+        if reindex_credentials:
+            self._unindexCredentials(record)
+        super(ConfirmedRegistrations, self)._updateRecord(key, record, changes)
+        if reindex_token:
+            self._indexToken(self._refOf(key), record)
+        if reindex_credentials:
+            self._indexCredentials(record)
+
     def _setRecord(self, key, record):
         self._getCartouche(True)
-        old_record = self._getMapping().get(key)
+        self._checkUnique(key, 'login', record.login)
+        self._checkUnique(key, 'email', record.email)
+        old_record = self.get(key)
         if old_record is not None:
-            del self._getMapping('by_login')[old_record.login]
-            del self._getMapping('by_email')[old_record.email]
+            del self._getIndex(self.LOGIN_INDEX)[old_record.login]
+            del self._getIndex(self.EMAIL_INDEX)[old_record.email]
+            self._unindexToken(old_record)
+            self._unindexCredentials(old_record)
+        else:
+            self._changeCount(1)
+        ref = self._storeRecord(key, record)
+        self._indexRecord(ref, record)
+
+    def _checkUnique(self, key, name, value):
+        # Never let one user's login / e-mail take over another's index
+        # entry, leaving the other user unreachable.
+        attr = name == 'login' and self.LOGIN_INDEX or self.EMAIL_INDEX
+        other = self._lookup(attr, value)
+        if other is not None and other.uuid != key:
+            raise ValueError('%s already registered: %s' % (name, value))
+
+    def _indexRecord(self, ref, record):
+        self._getIndex(self.LOGIN_INDEX, True)[record.login] = ref
+        self._getIndex(self.EMAIL_INDEX, True)[record.email] = ref
+        self._indexToken(ref, record)
+        self._indexCredentials(record)
+
+    def _indexToken(self, ref, record):
+        token = getattr(record, 'token', None)
+        if token is None:
+            return
+        self._getIndex(self.TOKEN_INDEX, True)[token] = ref
+        expires = getattr(record, 'token_expires', None)
+        if expires is not None:
+            cartouche = self.cartouche
+            if getattr(cartouche, 'tokens_by_expiry', None) is None:
+                cartouche.tokens_by_expiry = OOTreeSet()
+            cartouche.tokens_by_expiry.add((expires, token))
+
+    def _unindexToken(self, record):
+        token = getattr(record, 'token', None)
+        if token is None:
+            return
+        index = self._getIndex(self.TOKEN_INDEX)
+        if token in index:
+            del index[token]
+        expiring = getattr(self.cartouche, 'tokens_by_expiry', None)
+        expires = getattr(record, 'token_expires', None)
+        if expiring is not None and (expires, token) in expiring:
+            expiring.remove((expires, token))
+
+    def _indexCredentials(self, record):
+        # The auth index is optional:  maintained only once built.
+        index = getattr(self.cartouche, self.AUTH_INDEX, None)
+        if index is not None:
+            index[record.login] = (record.uuid, record.password)
+
+    def _unindexCredentials(self, record):
+        index = getattr(self.cartouche, self.AUTH_INDEX, None)
+        if index is not None and record.login in index:
+            del index[record.login]
+
+    # Storage hooks:  index values ("refs") are the UUIDs themselves.
+
+    def _getIndex(self, attr, create=False):
+        index = getattr(self.cartouche, attr, None)
+        if index is None:
+            # BBB:  created lazily for existing containers.
+            index = self.TREES.get(attr, OOBTree)()
+            if create:
+                setattr(self.cartouche, attr, index)
+        return index
+
+    def _lookup(self, attr, value, default=None):
+        cartouche = self._getCartouche()
+        if cartouche is None or value is None:
+            return default
+        ref = self._getIndex(attr).get(value)
+        if ref is None:
+            return default
+        return self._deref(ref, default)
+
+    def _deref(self, ref, default=None):
+        return self._getMapping().get(ref, default)
+
+    def _item(self, ref):
+        return ref, self._getMapping()[ref]
+
+    def _refOf(self, key):
+        return key
+
+    def _storeRecord(self, key, record):
         self._getMapping()[key] = record
-        self._getMapping('by_login')[record.login] = key
-        self._getMapping('by_email')[record.email] = key
+        return key
+
+    def _deleteRecord(self, key):
+        del self._getMapping()[key]
+
+
+_MAXID = 2 ** 31 - 1  # keys of 32-bit integer BTrees
+
+
+@implementer(IRegistrations)
+class CompactConfirmedRegistrations(ConfirmedRegistrations):
+    """ Confirmed registrations, stored under compact integer ids.
+
+    Records live in 'records_by_id', and the login / e-mail / token indexes
+    map onto integer ids rather than 36-character UUID strings, keeping
+    their buckets small.  The API still speaks UUIDs, mapped to and from
+    the ids via 'ids_by_uuid' / 'uuids_by_id'.
+    """
+    ATTR = 'ids_by_uuid'
+    LOGIN_INDEX = 'ids_by_login'
+    EMAIL_INDEX = 'ids_by_email'
+    TOKEN_INDEX = 'ids_by_token'
+    TREES = {'ids_by_uuid': OIBTree,
+             'uuids_by_id': IOBTree,
+             'records_by_id': IOBTree,
+             'ids_by_login': OIBTree,
+             'ids_by_email': OIBTree,
+             'ids_by_token': OIBTree,
+            }
+
+    def get(self, key, default=None):
+        """ See IRegistrations.
+        """
+        return self._lookup(self.ATTR, key, default)
+
+    def page(self, after=None, size=20, before=None):
+        """ See IRegistrations.
+        """
+        if self._getCartouche() is None:
+            return []
+        ids = self._getMapping()
+        if before is not None:
+            items = ids.items(max=before, excludemax=True)
+            items = items[-size:] if size else []
+        elif after is None:
+            items = islice(ids.items(), size)
+        else:
+            items = islice(ids.items(min=after, excludemin=True), size)
+        records = self._getIndex('records_by_id')
+        return [(key, records[ref]) for key, ref in items]
+
+    def __iter__(self):
+        if self._getCartouche() is None:
+            return iter(())
+        records = self._getIndex('records_by_id')
+        return iter([(key, records[ref])
+                        for key, ref in self._getMapping().items()])
+
+    def _getMapping(self, attr=None):
+        if self.cartouche is None: #pragma NO COVER
+            raise ValueError('Call _getCartouche first!')
+        return self._getIndex(attr or self.ATTR)
+
+    def _getRecord(self, key):
+        return self._getIndex('records_by_id')[self._getMapping()[key]]
+
+    def _deref(self, ref, default=None):
+        return self._getIndex('records_by_id').get(ref, default)
+
+    def _item(self, ref):
+        return (self._getIndex('uuids_by_id')[ref],
+                self._getIndex('records_by_id')[ref])
+
+    def _refOf(self, key):
+        return self._getMapping()[key]
+
+    def _storeRecord(self, key, record):
+        ids = self._getIndex(self.ATTR, True)
+        ref = ids.get(key)
+        if ref is None:
+            ref = ids[key] = self._newId()
+            self._getIndex('uuids_by_id', True)[ref] = key
+        self._getIndex('records_by_id', True)[ref] = record
+        return ref
+
+    def _deleteRecord(self, key):
+        ids = self._getMapping()
+        ref = ids[key]
+        del ids[key]
+        del self._getIndex('uuids_by_id')[ref]
+        del self._getIndex('records_by_id')[ref]
+
+    def _newId(self):
+        # Allocate ids sequentially from a random start, so that concurrent
+        # writers touch different buckets (cf. 'zope.intid').
+        uuids = self._getIndex('uuids_by_id', True)
+        cartouche = self.cartouche
+        while True:
+            ref = getattr(cartouche, '_v_nextid', None)
+            if ref is None or ref >= _MAXID:
+                ref = randrange(0, _MAXID)
+            cartouche._v_nextid = ref + 1
+            if ref not in uuids:
+                return ref
+            cartouche._v_nextid = None
+
+
+@implementer(IGroups)
+class Groups(_CartoucheAdapterBase):
+    """ Adapter for managing group memberships of confirmed users.
+
+    Memberships are stored as 'OOTreeSet' values in both the 'group_users'
+    and 'user_groups' mappings, so that concurrent changes to the same group
+    resolve their conflicts rather than rewriting a shared list.
+    """
+    def add(self, uuid, group):
+        """ See IGroups.
+        """
+        self._getCartouche(True)
+        self._getSet('group_users', group).add(uuid)
+        self._getSet('user_groups', uuid).add(group)
+
+    def remove(self, uuid, group):
+        """ See IGroups.
+        """
+        if self._getCartouche() is None:
+            raise KeyError(group)
+        members = self._getSet('group_users', group, False)
+        if uuid not in members:
+            raise KeyError(group)
+        self._getSet('group_users', group).remove(uuid)
+        self._getSet('user_groups', uuid).remove(group)
+
+    def members(self, group):
+        """ See IGroups.
+        """
+        if self._getCartouche() is None:
+            return ()
+        return self._getSet('group_users', group, False)
+
+    def groups_of(self, uuid):
+        """ See IGroups.
+        """
+        if self._getCartouche() is None:
+            return ()
+        return self._getSet('user_groups', uuid, False)
+
+    def _getSet(self, attr, key, create=True):
+        mapping = self._getMapping(attr)
+        found = mapping.get(key)
+        if not create:
+            return found or ()
+        if found is None or isinstance(found, list):
+            # Data created by earlier versions stored plain lists.
+            found = mapping[key] = OOTreeSet(found or ())
+        return found
+
+
+@implementer(IGroups)
+class CompactGroups(Groups):
+    """ Group memberships keyed by the compact ids of confirmed users.
+
+    Pairs with 'CompactConfirmedRegistrations':  'group_ids' maps each group
+    onto an 'IITreeSet' of user ids, and 'id_groups' maps each user id onto
+    an 'OOTreeSet' of group names.
+    """
+    def add(self, uuid, group):
+        """ See IGroups.
+        """
+        ref = self._getId(uuid)
+        if ref is None:
+            raise KeyError(uuid)
+        self._getSet('group_ids', group, IITreeSet).add(ref)
+        self._getSet('id_groups', ref, OOTreeSet).add(group)
+
+    def remove(self, uuid, group):
+        """ See IGroups.
+        """
+        ref = self._getId(uuid)
+        members = self._getSet('group_ids', group)
+        if ref is None or ref not in members:
+            raise KeyError(group)
+        members.remove(ref)
+        self._getSet('id_groups', ref).remove(group)
+
+    def members(self, group):
+        """ See IGroups.
+        """
+        uuids = self._getTree('uuids_by_id')
+        return [uuids[ref] for ref in self._getSet('group_ids', group)]
+
+    def groups_of(self, uuid):
+        """ See IGroups.
+        """
+        ref = self._getId(uuid)
+        if ref is None:
+            return ()
+        return self._getSet('id_groups', ref)
+
+    def _getId(self, uuid):
+        return self._getTree('ids_by_uuid').get(uuid)
+
+    def _getTree(self, attr):
+        if self._getCartouche() is None:
+            return {}
+        return getattr(self.cartouche, attr, None) or {}
+
+    def _getSet(self, attr, key, factory=None):
+        found = self._getTree(attr).get(key)
+        if found is None and factory is not None:
+            tree = getattr(self.cartouche, attr, None)
+            if tree is None:
+                tree = IOBTree() if attr == 'id_groups' else OOBTree()
+                setattr(self.cartouche, attr, tree)
+            found = tree[key] = factory()
+        return found if found is not None else ()
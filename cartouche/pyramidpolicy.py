@@ -30,10 +30,15 @@ from zope.interface import implementer
 from zope.schema import ASCIILine
 from zope.schema import TextLine
 
+from .interfaces import IGroups
 from .interfaces import IRegistrations
 from .persistence import ConfirmedRegistrations
+from .persistence import Groups
 from ._compat import u
 
+_CACHE_KEY = 'cartouche.pyramidpolicy.cache'
+_marker = object()
+
 
 class ICartouchePolicyDirective(Interface):
     config_file = ASCIILine(title=u('config_file'), required=True)
@@ -59,26 +64,34 @@ class PyramidPolicy(object):
     def authenticated_userid(self, request):
         """ See IAuthenticationPolicy.
         """
-        identity = self._getIdentity(request)
-
-        if identity is not None:
-            confirmed = self._getConfirmed(request)
-            uuid = identity['repoze.who.userid']
-            record = confirmed.get(uuid)
-            if record is not None:
-                return uuid
+        cache = self._getCache(request)
+        uuid = cache.get('userid', _marker)
+        if uuid is _marker:
+            uuid = None
+            identity = self._getIdentity(request)
+            if identity is not None:
+                confirmed = self._getConfirmed(request)
+                candidate = identity['repoze.who.userid']
+                if confirmed.get(candidate) is not None:
+                    uuid = candidate
+            cache['userid'] = uuid
+        return uuid
 
     def effective_principals(self, request):
         """ See IAuthenticationPolicy.
         """
-        uuid = self.authenticated_userid(request)
-        if uuid is not None:
-            groups = ([uuid] +
-                      self._getGroups(uuid, request) +
-                      [Authenticated, Everyone])
-        else:
-            groups = [Everyone]
-        return groups
+        cache = self._getCache(request)
+        principals = cache.get('principals')
+        if principals is None:
+            uuid = self.authenticated_userid(request)
+            if uuid is not None:
+                principals = ([uuid] +
+                              self._getGroups(uuid, request) +
+                              [Authenticated, Everyone])
+            else:
+                principals = [Everyone]
+            cache['principals'] = principals
+        return list(principals)
 
     def remember(self, request, principal, **kw):
         """ See IAuthenticationPolicy.
@@ -87,6 +100,7 @@ class PyramidPolicy(object):
         identity = {'repoze.who.userid': principal,
                     'identifier': self._identifier_id,
                    }
+        self._clearCache(request)
         return api.remember(identity)
 
     def forget(self, request):
@@ -94,16 +108,29 @@ class PyramidPolicy(object):
         """
         api = self._getAPI(request)
         identity = self._getIdentity(request)
+        self._clearCache(request)
         return api.forget(identity)
 
+    def _getCache(self, request):
+        # Pyramid consults the policy for every permission check:  memoize
+        # the identity, userid and principals for the life of the request.
+        return request.environ.setdefault(_CACHE_KEY, {})
+
+    def _clearCache(self, request):
+        request.environ.pop(_CACHE_KEY, None)
+
     def _getAPI(self, request):
         return self._api_factory(request.environ)
 
     def _getIdentity(self, request):
-        identity = request.environ.get('repoze.who.identity')
-        if identity is None:
-            api = self._getAPI(request)
-            identity = api.authenticate()
+        cache = self._getCache(request)
+        identity = cache.get('identity', _marker)
+        if identity is _marker:
+            identity = request.environ.get('repoze.who.identity')
+            if identity is None:
+                api = self._getAPI(request)
+                identity = api.authenticate()
+            cache['identity'] = identity
         return identity
 
     def _getConfirmed(self, request):
@@ -116,9 +143,11 @@ class PyramidPolicy(object):
         return confirmed
 
     def _getGroups(self, uuid, request):
-        confirmed = self._getConfirmed(request)
-        confirmed._getCartouche()
-        return confirmed._getMapping('user_groups').get(uuid) or []
+        context = request.context
+        groups = request.registry.queryAdapter(context, IGroups)
+        if groups is None:
+            groups = Groups(context)
+        return list(groups.groups_of(uuid))
 
 
 def cartoucheAuthenticationPolicy(_context, config_file, identifier_name):
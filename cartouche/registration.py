@@ -13,6 +13,7 @@
 ##############################################################################
 from email.message import Message
 from pkg_resources import resource_filename
+from time import time
 
 from colander import Email
 from colander import Invalid
@@ -20,7 +21,6 @@ from colander import Schema
 from colander import SchemaNode
 from colander import String
 from colander import deferred
-from colander import null
 from colander import _marker as missing_required # XXX: reach-around
 from deform import Form
 from deform import ValidationFailure
@@ -29,8 +29,6 @@ from deform.widget import CheckedPasswordWidget
 from deform.widget import HiddenWidget
 from deform.widget import PasswordWidget
 from deform.widget import SelectWidget
-from pyramid.renderers import get_renderer
-from repoze.sendmail.interfaces import IMailDelivery
 from webob.exc import HTTPForbidden
 from webob.exc import HTTPFound
 from webob.exc import HTTPUnauthorized
@@ -40,8 +38,11 @@ from .interfaces import IAutoLogin
 from .interfaces import IRegistrations
 from .persistence import ConfirmedRegistrations
 from .persistence import PendingRegistrations
+from .util import getMailDelivery
+from .util import getMainTemplate
+from .util import getNewUserId
 from .util import getRandomToken
-from .util import localhost_mta
+from .util import renderBlankForm
 from .util import sendGeneratedPassword
 from .util import view_url
 from ._compat import u
@@ -50,7 +51,9 @@ _BLANK = u('')
 
 
 templates_dir = resource_filename('cartouche', 'templates/')
-Form.set_zpt_renderer([templates_dir, deform_templates_dir])
+# Not in Chameleon's debug mode (deform's default), which compiles each
+# template into a throwaway directory, bypassing 'cartouche.template_cache'.
+Form.set_zpt_renderer([templates_dir, deform_templates_dir], debug=False)
 
 
 class Signup(Schema):
@@ -144,10 +147,17 @@ complete your registration.
 """
 
 
+_SIGNUP = Signup()
+
+
+def _signupForm():
+    return Form(_SIGNUP, buttons=('register',))
+
+
 def register_view(context, request):
-    form = Form(Signup(), buttons=('register',))
-    rendered_form = form.render(null)
+    rendered_form = None
     if 'register' in request.POST:
+        form = _signupForm()
         try:
             appstruct = form.validate(request.POST.items())
         except ValidationFailure as e:
@@ -162,8 +172,7 @@ def register_view(context, request):
             pending.set(email, token=token)
 
             from_addr = request.registry.settings['cartouche.from_addr']
-            delivery = request.registry.queryUtility(IMailDelivery,
-                                                     default=localhost_mta)
+            delivery = getMailDelivery(request)
             confirmation_url = view_url(context, request, 'confirmation_url',
                                         'confirm_registration.html',
                                         email=email)
@@ -175,8 +184,9 @@ def register_view(context, request):
             delivery.send(from_addr, [email], message)
             return HTTPFound(location=confirmation_url)
 
-    main_template = get_renderer('templates/main.pt')
-    return {'main_template': main_template.implementation(),
+    if rendered_form is None:
+        rendered_form = renderBlankForm(request, 'register', _signupForm)
+    return {'main_template': getMainTemplate(request),
             'rendered_form': rendered_form,
             'message': request.GET.get('message'),
            }
@@ -187,6 +197,18 @@ REGISTER_FIRST = 'Please register first.'
 REGISTER_OR_VISIT = ('Please register first '
                      'or visit the link in your confirmation e-mail.')
 CHECK_TOKEN = ('Please copy the token from your confirmation e-mail.')
+REGISTRATION_EXPIRED = 'Your registration has expired.  Please register again.'
+
+
+def pendingExpired(request, info):
+    """ Has the pending registration 'info' outlived 'cartouche.pending_ttl'?
+    """
+    ttl = request.registry.settings.get('cartouche.pending_ttl')
+    created = getattr(info, 'created', None)
+    if ttl is None or created is None:
+        return False
+    return created + float(ttl) < time()
+
 
 def confirm_registration_view(context, request):
     form = Form(Confirm(), buttons=('confirm',))
@@ -210,6 +232,14 @@ def confirm_registration_view(context, request):
                                           'register.html',
                                           message=REGISTER_FIRST,
                                          ))
+            if pendingExpired(request, info):
+                pending.remove(email)
+                return HTTPFound(
+                        location=view_url(context, request,
+                                          'register_url',
+                                          'register.html',
+                                          message=REGISTRATION_EXPIRED,
+                                         ))
             if token != info.token:
                 return HTTPFound(
                         location=view_url(context, request,
@@ -223,7 +253,7 @@ def confirm_registration_view(context, request):
             if confirmed is None:  #pragma NO COVERAGE
                 confirmed = ConfirmedRegistrations(context)
             pending.remove(email)
-            uuid = getRandomToken(request)
+            uuid = getNewUserId(request)
             confirmed.set(uuid,
                           email=email,
                           login=email,
@@ -254,17 +284,25 @@ def confirm_registration_view(context, request):
                                           'register.html',
                                           message=REGISTER_OR_VISIT,
                                          ))
-        if pending.get(email) is None:
+        info = pending.get(email)
+        if info is None:
             return HTTPFound(
                         location=view_url(context, request,
                                           'register_url',
                                           'register.html',
                                           message=REGISTER_FIRST,
                                          ))
+        if pendingExpired(request, info):
+            pending.remove(email)
+            return HTTPFound(
+                        location=view_url(context, request,
+                                          'register_url',
+                                          'register.html',
+                                          message=REGISTRATION_EXPIRED,
+                                         ))
         rendered_form = form.render({'email': email})
 
-    main_template = get_renderer('templates/main.pt')
-    return {'main_template': main_template.implementation(),
+    return {'main_template': getMainTemplate(request),
             'rendered_form': rendered_form,
            }
 
@@ -309,21 +347,21 @@ def edit_account_view(context, request):
             password = pwd_mgr.encodePassword(appstruct['password'])
             security_question = appstruct['security']['question']
             security_answer = appstruct['security']['answer']
-            confirmed.set(userid,
-                          email=email,
-                          login=login, 
-                          password=password,
-                          security_question=security_question,
-                          security_answer=security_answer,
-                         )
+            confirmed.update(userid,
+                             email=email,
+                             login=login,
+                             password=password,
+                             security_question=security_question,
+                             security_answer=security_answer,
+                             token=None,
+                             token_expires=None,
+                            )
             return HTTPFound(
                         location=view_url(context, request,
                                           'after_edit_url',
                                           request.view_name,
                                          ))
 
-    main_template = get_renderer('templates/main.pt')
-
-    return {'main_template': main_template.implementation(),
+    return {'main_template': getMainTemplate(request),
             'rendered_form': rendered_form,
            }
@@ -1,9 +1,15 @@
+from __future__ import print_function
 import os
 import sys
 
 from pyramid.paster import bootstrap
 import transaction
 
+from cartouche.interfaces import IGroups
+from cartouche.interfaces import IRegistrations
+from cartouche.persistence import ConfirmedRegistrations
+from cartouche.persistence import Groups
+
 
 def main(argv=None):
     __doc__ = """ Make an existing cartouche user a member of the 'admin' group.
@@ -13,18 +19,18 @@ def main(argv=None):
     if argv is None:
         argv = sys.argv[1:]
     try:
-        config_uri, login = sys.argv[1:]
+        config_uri, login = argv
     except:
-        print __doc__ % sys.argv[0]
+        print(__doc__ % sys.argv[0])
         sys.exit(2)
 
     ini_file = config_uri.split('#')[0]
 
     if not os.path.isfile(ini_file):
-        print __doc__ % sys.argv[0]
-        print
-        print 'Invalid config file:', ini_file
-        print
+        print(__doc__ % sys.argv[0])
+        print('')
+        print('Invalid config file:', ini_file)
+        print('')
         sys.exit(2)
 
     env = bootstrap(config_uri)
@@ -36,20 +42,18 @@ def main(argv=None):
 
     info = confirmed.get_by_login(login)
     if info is None:
-        print __doc__ % sys.argv[0]
-        print
-        print 'Invalid login:', login
-        print
+        print(__doc__ % sys.argv[0])
+        print('')
+        print('Invalid login:', login)
+        print('')
         sys.exit(2)
 
-    admins = confirmed._getMapping('group_users').get('g:admin') or []
-    if info.uuid not in admins:
-        admins.append(info.uuid)
-        confirmed._getMapping('group_users')['g:admin'] = admins
-        groups = confirmed._getMapping('user_groups').get(info.uuid) or []
-        groups.append('g:admin')
-        confirmed._getMapping('user_groups')[info.uuid] = groups
+    groups = request.registry.queryAdapter(root, IGroups)
+    if groups is None:
+        groups = Groups(root)
+
+    if info.uuid not in groups.members('g:admin'):
+        groups.add(info.uuid, 'g:admin')
 
     transaction.commit()
     env['closer']()
-
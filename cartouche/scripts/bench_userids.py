@@ -0,0 +1,109 @@
+""" Compare user-id generators under concurrent confirmations.
+
+Each worker thread confirms registrations in its own ZODB connection,
+committing every 'per_txn' records and retrying on conflicts.  For each
+generator, report the conflict rate and the number of objects (mostly BTree
+buckets) written per commit.
+
+Usage:  python -m cartouche.scripts.bench_userids [threads [commits [per_txn]]]
+"""
+from __future__ import print_function
+import os
+import shutil
+import sys
+import tempfile
+from threading import Lock
+from threading import Thread
+from time import time
+from uuid import uuid4
+
+import transaction
+from ZODB import DB
+from ZODB.FileStorage import FileStorage
+from ZODB.POSException import ConflictError
+
+from cartouche.models import Root
+from cartouche.persistence import ConfirmedRegistrations
+from cartouche.util import USERID_GENERATORS
+
+
+def bench(generator, threads=4, commits=50, per_txn=10, prefill=10000):
+    """ Return a mapping of statistics for 'generator'.
+    """
+    # FileStorage, unlike MappingStorage, resolves BTree conflicts.
+    tmpdir = tempfile.mkdtemp()
+    db = DB(FileStorage(os.path.join(tmpdir, 'Data.fs')))
+    conn = db.open()
+    root = conn.root()['cartouche'] = Root()
+    confirmed = ConfirmedRegistrations(root)
+    # Start from a populated container, so that inserts land in a tree
+    # with many buckets.
+    for i in range(prefill):
+        key = generator()
+        email = uuid4().hex
+        confirmed.set(key, email=email, login=email)
+    transaction.commit()
+    conn.close()
+
+    stats = {'commits': 0, 'conflicts': 0, 'stores': 0}
+    lock = Lock()
+
+    def _worker():
+        tm = transaction.TransactionManager()
+        conn = db.open(tm)
+        conflicts = stores = 0
+        for i in range(commits):
+            while True:
+                tm.begin()
+                confirmed = ConfirmedRegistrations(conn.root()['cartouche'])
+                for j in range(per_txn):
+                    email = uuid4().hex
+                    confirmed.set(generator(), email=email, login=email)
+                try:
+                    tm.commit()
+                except ConflictError:
+                    tm.abort()
+                    conflicts += 1
+                else:
+                    break
+            stores += conn.getTransferCounts(True)[1]
+        conn.close()
+        with lock:
+            stats['commits'] += commits
+            stats['conflicts'] += conflicts
+            stats['stores'] += stores
+
+    workers = [Thread(target=_worker) for i in range(threads)]
+    started = time()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    stats['elapsed'] = time() - started
+    db.close()
+    shutil.rmtree(tmpdir)
+    stats['conflict_rate'] = float(stats['conflicts']) / (
+                                stats['commits'] + stats['conflicts'])
+    stats['stores_per_commit'] = float(stats['stores']) / stats['commits']
+    return stats
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    try:
+        args = [int(x) for x in argv]
+        if len(args) > 3:
+            raise ValueError(argv)
+    except ValueError:
+        print(__doc__)
+        sys.exit(2)
+    for name in sorted(USERID_GENERATORS):
+        stats = bench(USERID_GENERATORS[name], *args)
+        print('%-14s conflicts: %5.1f%%  objects written / commit: %6.1f  '
+              '(%.1fs)' % (name, stats['conflict_rate'] * 100,
+                           stats['stores_per_commit'], stats['elapsed']))
+
+
+if __name__ == '__main__':  #pragma NO COVERAGE
+    main()
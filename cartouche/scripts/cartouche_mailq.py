@@ -0,0 +1,71 @@
+from __future__ import print_function
+import argparse
+import logging
+import os
+import sys
+import time
+
+from pyramid.paster import get_appsettings
+
+from cartouche.mailqueue import DEFAULT_BACKOFF
+from cartouche.mailqueue import DEFAULT_MAX_ATTEMPTS
+from cartouche.mailqueue import DEFAULT_WORKERS
+from cartouche.mailqueue import MailQueueRunner
+from cartouche.mailqueue import mailerFromSettings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Send the e-mail queued in the maildir named by the '
+                    "application's 'cartouche.mail_queue' setting, via the "
+                    "SMTP server given by its 'cartouche.smtp_*' settings.")
+    parser.add_argument('config_uri')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help='Messages sent in parallel '
+                             '(default: %(default)s)')
+    parser.add_argument('--max-attempts', type=int,
+                        default=DEFAULT_MAX_ATTEMPTS,
+                        help='Attempts before moving a message to the '
+                             'dead-letter directory (default: %(default)s)')
+    parser.add_argument('--backoff', type=float, default=DEFAULT_BACKOFF,
+                        help='Seconds before the first retry, doubling for '
+                             'each later one (default: %(default)s)')
+    parser.add_argument('--dead-letter',
+                        help="Directory for undeliverable messages (default: "
+                             "'.dead' within the queue)")
+    parser.add_argument('--loop', type=float, metavar='SECONDS',
+                        help='Keep running, polling the queue this often')
+    if argv is None:
+        argv = sys.argv[1:]
+    args = parser.parse_args(argv)
+
+    ini_file = args.config_uri.split('#')[0]
+    if not os.path.isfile(ini_file):
+        parser.error('Invalid config file: %s' % ini_file)
+
+    settings = get_appsettings(args.config_uri)
+    queue_path = settings.get('cartouche.mail_queue')
+    if not queue_path:
+        parser.error("No 'cartouche.mail_queue' setting in %s" % ini_file)
+
+    logging.basicConfig(level=logging.INFO)
+    mailer = mailerFromSettings(settings, args.workers)
+    runner = MailQueueRunner(mailer,
+                             queue_path,
+                             args.dead_letter,
+                             workers=args.workers,
+                             max_attempts=args.max_attempts,
+                             backoff=args.backoff,
+                            )
+    try:
+        while True:
+            counts = runner.run()
+            if args.loop is None:
+                break
+            time.sleep(args.loop)
+    finally:
+        mailer.close()
+    print('Sent %(sent)d, retrying %(retry)d, dead-lettered %(dead)d'
+          % counts)
+    print('%(rate).1f messages/s over %(connections_opened)d SMTP '
+          'connections' % mailer.stats())
@@ -0,0 +1,81 @@
+from __future__ import print_function
+import os
+import sys
+
+from pyramid.paster import bootstrap
+
+from cartouche.export import exportLines
+from cartouche.interfaces import IRegistrations
+from cartouche.persistence import ConfirmedRegistrations
+from cartouche.persistence import PendingRegistrations
+
+
+def export(registrations, stream, after=None, limit=None, minimize=None,
+           report=None):
+    """ Write registrations to 'stream' as JSON lines.
+
+    Return the key of the last record written ('after' if none were),
+    which may be passed back as 'after' to resume the export.  If the
+    export is interrupted, 'report' is still called with that key.
+    """
+    last = after
+    try:
+        for key, line in exportLines(registrations, after, limit,
+                                     minimize=minimize):
+            stream.write(line)
+            last = key
+    finally:
+        if report is not None:
+            report(last)
+    return last
+
+
+def _report(last):
+    print('Last key exported:', last, file=sys.stderr)
+
+
+def main(argv=None):
+    __doc__ = """ Export cartouche registrations as JSON lines on stdout.
+
+    Usage:  %s config_uri [pending|confirmed] [after_key [limit]]
+
+    The key of the last record exported is reported on stderr;  pass it
+    as 'after_key' to resume an interrupted export.
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    try:
+        config_uri = argv[0]
+        which = argv[1] if len(argv) > 1 else 'confirmed'
+        after = argv[2] if len(argv) > 2 else None
+        limit = int(argv[3]) if len(argv) > 3 else None
+        if len(argv) > 4 or which not in ('pending', 'confirmed'):
+            raise ValueError(argv)
+    except:
+        print(__doc__ % sys.argv[0], file=sys.stderr)
+        sys.exit(2)
+
+    ini_file = config_uri.split('#')[0]
+
+    if not os.path.isfile(ini_file):
+        print(__doc__ % sys.argv[0], file=sys.stderr)
+        print('', file=sys.stderr)
+        print('Invalid config file:', ini_file, file=sys.stderr)
+        print('', file=sys.stderr)
+        sys.exit(2)
+
+    env = bootstrap(config_uri)
+    request, root = env['request'], env['root']
+    registrations = request.registry.queryAdapter(root, IRegistrations,
+                                                  name=which)
+    if registrations is None:
+        if which == 'pending':
+            registrations = PendingRegistrations(root)
+        else:
+            registrations = ConfirmedRegistrations(root)
+
+    try:
+        export(registrations, sys.stdout, after, limit,
+               minimize=root._p_jar.cacheGC, report=_report)
+    finally:
+        env['closer']()
@@ -0,0 +1,214 @@
+from __future__ import print_function
+import argparse
+import csv
+from functools import partial
+from itertools import islice
+import json
+import os
+import sys
+from time import time
+
+from pyramid.paster import bootstrap
+import transaction
+from zope.password.password import SSHAPasswordManager
+
+from cartouche.interfaces import IRegistrations
+from cartouche.persistence import ConfirmedRegistrations
+from cartouche.util import uuidRandomToken
+
+DEFAULT_BATCH_SIZE = 10000
+FIELDS = ('email', 'login', 'password', 'security_question',
+          'security_answer')
+
+
+def readRecords(stream, format='csv'):
+    """ Yield one dict per record from 'stream'.
+
+    'format' is either 'csv' (with a header row naming the fields) or
+    'jsonl' (one JSON object per line).
+    """
+    if format == 'csv':
+        for row in csv.DictReader(stream):
+            yield row
+    elif format == 'jsonl':
+        for line in stream:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+    else:
+        raise ValueError('Unknown format: %s' % format)
+
+
+def hashPassword(plaintext):
+    return SSHAPasswordManager().encodePassword(plaintext)
+
+
+def _hashAll(passwords):
+    return [hashPassword(x) for x in passwords]
+
+
+def _batches(records, batch_size):
+    records = iter(records)
+    while True:
+        batch = list(islice(records, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def _prepare(record):
+    kw = dict([(name, record.get(name)) for name in FIELDS])
+    if not kw['login']:
+        kw['login'] = kw['email']
+    # A blank password is no password:  never store (or hash) ''.
+    kw['password'] = kw['password'] or None
+    return record.get('uuid') or uuidRandomToken(), kw
+
+
+def _conflict(confirmed, seen, key, kw):
+    # Return why the record can't be stored under 'key', or None.
+    for name in ('email', 'login'):
+        value = kw[name]
+        owner = seen[name].get(value)
+        if owner is None:
+            existing = getattr(confirmed, 'get_by_%s' % name)(value)
+            if existing is not None:
+                owner = existing.uuid
+        if owner is not None and owner != key:
+            return '%s %s already belongs to %s' % (name, value, owner)
+
+
+def import_records(confirmed, records, batch_size=DEFAULT_BATCH_SIZE,
+                   commit=None, minimize=None, hasher=None, report=None,
+                   reject=None):
+    """ Store 'records' via 'confirmed.set_many', in batches.
+
+    After each batch, call 'commit' (a full commit or a savepoint), then
+    'minimize' (to evict unmodified objects from the connection cache), then
+    'report(imported, elapsed)'.  If 'hasher' is passed, it maps a list of
+    plaintext passwords onto a list of encoded ones.
+
+    Records with a missing or blank password are stored without one:  those
+    users cannot log in until they reset their passwords.
+
+    Records whose e-mail or login belongs to another user (stored, or
+    earlier in 'records') are skipped, calling 'reject(record, reason)'.
+
+    Return the number of records imported.
+    """
+    if commit is None:
+        commit = transaction.commit
+    imported = 0
+    started = time()
+    seen = {'email': {}, 'login': {}}
+    for batch in _batches(records, batch_size):
+        items = []
+        for record in batch:
+            key, kw = _prepare(record)
+            reason = _conflict(confirmed, seen, key, kw)
+            if reason is not None:
+                if reject is not None:
+                    reject(record, reason)
+                continue
+            seen['email'][kw['email']] = seen['login'][kw['login']] = key
+            items.append((key, kw))
+        if hasher is not None:
+            with_password = [kw for key, kw in items if kw['password']]
+            encoded = hasher([kw['password'] for kw in with_password])
+            for kw, password in zip(with_password, encoded):
+                kw['password'] = password
+        imported += confirmed.set_many(items)
+        commit()
+        if minimize is not None:
+            minimize()
+        if report is not None:
+            report(imported, time() - started)
+    return imported
+
+
+def _report(imported, elapsed):
+    rate = elapsed and imported / elapsed or 0.0
+    print('Imported %d records in %.1fs (%.0f records/s)'
+          % (imported, elapsed, rate))
+
+
+def _reject(record, reason):
+    print('Skipped %s:  %s' % (record.get('uuid') or record.get('email'),
+                               reason), file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Bulk-load confirmed cartouche registrations from a CSV '
+                    'or JSONL file.  Records hold the fields: uuid, email, '
+                    'login, password, security_question, security_answer.')
+    parser.add_argument('config_uri')
+    parser.add_argument('filename')
+    parser.add_argument('--format', choices=('csv', 'jsonl'),
+                        help='Input format (default: from the file '
+                             'extension)')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help='Records per batch (default: %(default)s)')
+    parser.add_argument('--savepoints', action='store_true',
+                        help='Take a savepoint after each batch, and commit '
+                             'once at the end, rather than committing each '
+                             'batch')
+    parser.add_argument('--hash-passwords', action='store_true',
+                        help='Passwords are plaintext:  encode them')
+    parser.add_argument('--processes', type=int, default=0,
+                        help='Encode passwords across a pool of this many '
+                             'processes (default: in process)')
+    if argv is None:
+        argv = sys.argv[1:]
+    args = parser.parse_args(argv)
+
+    ini_file = args.config_uri.split('#')[0]
+    if not os.path.isfile(ini_file):
+        parser.error('Invalid config file: %s' % ini_file)
+    if not os.path.isfile(args.filename):
+        parser.error('Invalid input file: %s' % args.filename)
+
+    format = args.format
+    if format is None:
+        format = args.filename.endswith('.csv') and 'csv' or 'jsonl'
+
+    pool = hasher = None
+    if args.hash_passwords:
+        if args.processes > 0:
+            from multiprocessing import Pool
+            pool = Pool(args.processes)
+            hasher = partial(pool.map, hashPassword)
+        else:
+            hasher = _hashAll
+
+    if args.savepoints:
+        commit = partial(transaction.savepoint, optimistic=True)
+    else:
+        commit = transaction.commit
+
+    env = bootstrap(args.config_uri)
+    request, root = env['request'], env['root']
+    confirmed = request.registry.queryAdapter(root, IRegistrations,
+                                              name='confirmed')
+    if confirmed is None:
+        confirmed = ConfirmedRegistrations(root)
+
+    try:
+        # The csv module requires files opened with newline=''.
+        with open(args.filename, newline='') as stream:
+            imported = import_records(confirmed,
+                                      readRecords(stream, format),
+                                      args.batch_size,
+                                      commit=commit,
+                                      minimize=root._p_jar.cacheMinimize,
+                                      hasher=hasher,
+                                      report=_report,
+                                      reject=_reject,
+                                     )
+        transaction.commit()
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    print('Done:  imported %d records' % imported)
+    env['closer']()
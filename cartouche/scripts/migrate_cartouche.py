@@ -0,0 +1,50 @@
+from __future__ import print_function
+import os
+import sys
+
+from pyramid.paster import bootstrap
+import transaction
+
+from cartouche.migrations import DEFAULT_BATCH_SIZE
+from cartouche.migrations import MIGRATIONS
+
+
+def main(argv=None):
+    __doc__ = """ Migrate the storage layout of cartouche registrations.
+
+    Usage:  %s config_uri migration [batch_size]
+
+    Migrations:  """ + ', '.join(sorted(MIGRATIONS))
+    if argv is None:
+        argv = sys.argv[1:]
+    try:
+        config_uri, name = argv[:2]
+        migration = MIGRATIONS[name]
+        batch_size = int(argv[2]) if len(argv) > 2 else DEFAULT_BATCH_SIZE
+        if len(argv) > 3:
+            raise ValueError(argv)
+    except:
+        print(__doc__ % sys.argv[0])
+        sys.exit(2)
+
+    ini_file = config_uri.split('#')[0]
+
+    if not os.path.isfile(ini_file):
+        print(__doc__ % sys.argv[0])
+        print('')
+        print('Invalid config file:', ini_file)
+        print('')
+        sys.exit(2)
+
+    env = bootstrap(config_uri)
+    root = env['root']
+    jar = root._p_jar
+
+    def _savepoint():
+        transaction.savepoint(optimistic=True)
+        jar.cacheMinimize()
+
+    count = migration(root, _savepoint, batch_size)
+    transaction.commit()
+    print('Migrated %d registrations (%s)' % (count, name))
+    env['closer']()
@@ -0,0 +1,85 @@
+from __future__ import print_function
+import os
+import sys
+from time import time
+
+from pyramid.paster import bootstrap
+import transaction
+
+from cartouche.interfaces import IRegistrations
+from cartouche.persistence import PendingRegistrations
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+def reap(pending, cutoff, batch_size=DEFAULT_BATCH_SIZE, commit=None):
+    """ Remove registrations created before 'cutoff', in batches.
+
+    Call 'commit' after each batch;  return the number removed.  Skip
+    registrations already gone (e.g. confirmed meanwhile).
+    """
+    if commit is None:
+        commit = transaction.commit
+    removed = 0
+    while True:
+        batch = pending.expired(cutoff, batch_size)
+        if not batch:
+            return removed
+        count = 0
+        for email in batch:
+            try:
+                pending.remove(email)
+            except KeyError:
+                continue
+            count += 1
+        commit()
+        removed += count
+        if not count:
+            # Nothing left to remove:  don't spin on the same batch.
+            return removed
+
+
+def main(argv=None):
+    __doc__ = """ Remove pending cartouche registrations older than the
+    'cartouche.pending_ttl' setting (in seconds).
+
+    Usage:  %s config_uri [batch_size]
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    try:
+        config_uri = argv[0]
+        batch_size = int(argv[1]) if len(argv) > 1 else DEFAULT_BATCH_SIZE
+        if len(argv) > 2:
+            raise ValueError(argv)
+    except:
+        print(__doc__ % sys.argv[0])
+        sys.exit(2)
+
+    ini_file = config_uri.split('#')[0]
+
+    if not os.path.isfile(ini_file):
+        print(__doc__ % sys.argv[0])
+        print('')
+        print('Invalid config file:', ini_file)
+        print('')
+        sys.exit(2)
+
+    env = bootstrap(config_uri)
+    request, root = env['request'], env['root']
+    ttl = request.registry.settings.get('cartouche.pending_ttl')
+    if ttl is None:
+        print(__doc__ % sys.argv[0])
+        print('')
+        print('No cartouche.pending_ttl setting in:', ini_file)
+        print('')
+        sys.exit(2)
+
+    pending = request.registry.queryAdapter(root, IRegistrations,
+                                            name='pending')
+    if pending is None:
+        pending = PendingRegistrations(root)
+
+    removed = reap(pending, time() - float(ttl), batch_size)
+    print('Removed %d expired pending registrations' % removed)
+    env['closer']()
@@ -0,0 +1,54 @@
+from __future__ import print_function
+import os
+import sys
+
+from pyramid.paster import bootstrap
+
+from cartouche.interfaces import IGroups
+from cartouche.interfaces import IRegistrations
+from cartouche.persistence import ConfirmedRegistrations
+from cartouche.persistence import Groups
+from cartouche.snapshot import iterCredentials
+from cartouche.snapshot import writeSnapshot
+
+
+def main(argv=None):
+    __doc__ = """ Write a credential snapshot of confirmed cartouche users.
+
+    Usage:  %s config_uri snapshot_file
+
+    The snapshot is replaced atomically:  'WhoPlugin' instances configured
+    with 'snapshot = snapshot_file' pick it up on their next reload.
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    try:
+        config_uri, path = argv
+    except:
+        print(__doc__ % sys.argv[0])
+        sys.exit(2)
+
+    ini_file = config_uri.split('#')[0]
+
+    if not os.path.isfile(ini_file):
+        print(__doc__ % sys.argv[0])
+        print('')
+        print('Invalid config file:', ini_file)
+        print('')
+        sys.exit(2)
+
+    env = bootstrap(config_uri)
+    request, root = env['request'], env['root']
+    confirmed = request.registry.queryAdapter(root, IRegistrations,
+                                              name='confirmed')
+    if confirmed is None:
+        confirmed = ConfirmedRegistrations(root)
+    groups = request.registry.queryAdapter(root, IGroups)
+    if groups is None:
+        groups = Groups(root)
+
+    try:
+        count = writeSnapshot(path, iterCredentials(confirmed, groups))
+    finally:
+        env['closer']()
+    print('Wrote %d credentials to %s' % (count, path))
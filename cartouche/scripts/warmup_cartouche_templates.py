@@ -0,0 +1,49 @@
+from __future__ import print_function
+import os
+import sys
+
+from pyramid.paster import bootstrap
+
+from cartouche.warmup import CACHE_SETTING
+from cartouche.warmup import useTemplateCache
+from cartouche.warmup import warmup
+
+
+def main(argv=None):
+    __doc__ = """ Compile cartouche's templates into the template cache.
+
+    Usage:  %s config_uri
+
+    The application's settings must name the cache directory, via
+    'cartouche.template_cache':  workers started afterwards load the
+    compiled templates from there, rather than compiling them.
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    try:
+        config_uri, = argv
+    except:
+        print(__doc__ % sys.argv[0])
+        sys.exit(2)
+
+    ini_file = config_uri.split('#')[0]
+
+    if not os.path.isfile(ini_file):
+        print(__doc__ % sys.argv[0])
+        print('')
+        print('Invalid config file:', ini_file)
+        print('')
+        sys.exit(2)
+
+    env = bootstrap(config_uri)
+    registry = env['registry']
+    try:
+        path = (registry.settings or {}).get(CACHE_SETTING)
+        if not path:
+            print('No %r setting in:' % CACHE_SETTING, config_uri)
+            sys.exit(2)
+        useTemplateCache(path)
+        count = warmup(registry)
+    finally:
+        env['closer']()
+    print('Compiled %d templates into %s' % (count, path))
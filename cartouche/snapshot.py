@@ -0,0 +1,238 @@
+##############################################################################
+#
+# Copyright (c) 2010 Agendaless Consulting and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+""" Read-only, memory-mapped snapshots of confirmed users' credentials.
+
+A snapshot file maps each login onto the user's UUID, password hash and
+groups, sorted by login (and indexed by UUID) so that
+:class:`CredentialSnapshot` can binary-search it in place.  The file is
+mapped read-only, so any number of processes reading the same snapshot
+share its pages via the OS page cache, rather than each holding a ZODB
+connection cache.
+
+Layout (integers are little-endian, unsigned, 32-bit):  the magic bytes,
+the record count 'n', 'n + 1' offsets of the records relative to the end of
+the tables, the 'n' record numbers in UUID order, then the records.  Each
+record is the UTF-8 encoded login, UUID, password hash and groups,
+separated by NUL bytes.
+"""
+from bisect import bisect_left
+import mmap
+import os
+import struct
+from tempfile import mkstemp
+from threading import Lock
+from time import time
+
+MAGIC = b'CARTSNP2'
+_COUNT = struct.Struct('<I')
+_SEP = b'\0'
+
+
+def _encode(value):
+    if value is None:
+        return b''
+    if not isinstance(value, bytes):
+        value = value.encode('utf-8')
+    return value
+
+
+def _decode(value):
+    return value.decode('utf-8')
+
+
+def iterCredentials(confirmed, groups=None):
+    """ Yield '(login, uuid, password, groups)' for each confirmed user.
+
+    'confirmed' is an IRegistrations adapter;  'groups', if passed, an
+    IGroups adapter.
+    """
+    for uuid, record in confirmed:
+        if groups is None:
+            names = ()
+        else:
+            names = tuple(groups.groups_of(uuid))
+        yield record.login, uuid, record.password, names
+        deactivate = getattr(record, '_p_deactivate', None)
+        if deactivate is not None:
+            deactivate()
+
+
+def writeSnapshot(path, credentials):
+    """ Write 'credentials' to a snapshot file at 'path'.
+
+    'credentials' yields '(login, uuid, password, groups)' tuples.  The file
+    is written alongside 'path', then renamed over it, so that readers see
+    either the old snapshot or the new one.  Return the number of records.
+    """
+    records = []
+    for login, uuid, password, groups in credentials:
+        fields = [_encode(login), _encode(uuid), _encode(password)]
+        fields.extend([_encode(name) for name in groups])
+        records.append(_SEP.join(fields))
+    records.sort()
+    offsets = [0]
+    for record in records:
+        offsets.append(offsets[-1] + len(record))
+    by_uuid = sorted(range(len(records)),
+                     key=lambda i: records[i].split(_SEP, 2)[1])
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmpname = mkstemp(prefix='.snapshot-', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as stream:
+            stream.write(MAGIC)
+            stream.write(_COUNT.pack(len(records)))
+            stream.write(struct.pack('<%dI' % len(offsets), *offsets))
+            stream.write(struct.pack('<%dI' % len(by_uuid), *by_uuid))
+            for record in records:
+                stream.write(record)
+            stream.flush()
+            os.fsync(stream.fileno())
+        os.rename(tmpname, path)
+    except:
+        os.unlink(tmpname)
+        raise
+    return len(records)
+
+
+class _MappedSnapshot(object):
+    # One mapping of one version of the file.
+
+    def __init__(self, path):
+        with open(path, 'rb') as stream:
+            self.stat = os.fstat(stream.fileno())
+            self.map = mmap.mmap(stream.fileno(), 0,
+                                 access=mmap.ACCESS_READ)
+        if self.map[:len(MAGIC)] != MAGIC:
+            self.map.close()
+            raise ValueError('Not a credential snapshot: %s' % path)
+        start = len(MAGIC)
+        self.count = _COUNT.unpack_from(self.map, start)[0]
+        self.offsets = start + _COUNT.size
+        self.by_uuid = self.offsets + (self.count + 1) * _COUNT.size
+        self.data = self.by_uuid + self.count * _COUNT.size
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        # The login of the i'th record:  lets 'bisect' search in place.
+        start, end = self._bounds(i)
+        found = self.map.find(_SEP, start, end)
+        return self.map[start:found]
+
+    def _bounds(self, i):
+        start, end = struct.unpack_from('<2I', self.map,
+                                        self.offsets + i * _COUNT.size)
+        return self.data + start, self.data + end
+
+    def get(self, login):
+        i = bisect_left(self, login)
+        if i == self.count or self[i] != login:
+            return None
+        fields = self._fields(i)
+        return (_decode(fields[1]), _decode(fields[2]),
+                tuple([_decode(x) for x in fields[3:]]))
+
+    def get_by_uuid(self, uuid):
+        uuids = _UUIDs(self)
+        i = bisect_left(uuids, uuid)
+        if i == self.count or uuids[i] != uuid:
+            return None
+        fields = self._fields(uuids.record(i))
+        return (_decode(fields[0]), _decode(fields[2]),
+                tuple([_decode(x) for x in fields[3:]]))
+
+    def _fields(self, i):
+        start, end = self._bounds(i)
+        return self.map[start:end].split(_SEP)
+
+
+class _UUIDs(object):
+    # The UUIDs of a mapped snapshot, in order:  lets 'bisect' search the
+    # UUID table in place.
+
+    def __init__(self, mapped):
+        self.mapped = mapped
+
+    def __len__(self):
+        return self.mapped.count
+
+    def __getitem__(self, i):
+        return self.mapped._fields(self.record(i))[1]
+
+    def record(self, i):
+        return _COUNT.unpack_from(self.mapped.map,
+                                  self.mapped.by_uuid + i * _COUNT.size)[0]
+
+
+class CredentialSnapshot(object):
+    """ Look up credentials in the snapshot file at 'path'.
+
+    Every 'reload_interval' seconds (if not None), a lookup checks whether
+    the file has been replaced, and if so maps the new one.
+    """
+    def __init__(self, path, reload_interval=None, timer=time):
+        self.path = path
+        self.reload_interval = reload_interval
+        self._timer = timer
+        self._lock = Lock()
+        self._mapped = _MappedSnapshot(path)
+        self._checked = timer()
+
+    def __len__(self):
+        return len(self._mapped)
+
+    def get(self, login, default=None):
+        """ Return '(uuid, password, groups)' for 'login'.
+        """
+        if login is None:
+            return default
+        self._maybeReload()
+        found = self._mapped.get(_encode(login))
+        if found is None:
+            return default
+        return found
+
+    def get_by_uuid(self, uuid, default=None):
+        """ Return '(login, password, groups)' for 'uuid'.
+        """
+        if uuid is None:
+            return default
+        self._maybeReload()
+        found = self._mapped.get_by_uuid(_encode(uuid))
+        if found is None:
+            return default
+        return found
+
+    def reload(self):
+        """ Map the file afresh if it has been replaced.
+
+        Return True if it had been.
+        """
+        with self._lock:
+            self._checked = self._timer()
+            current = os.stat(self.path)
+            old = self._mapped.stat
+            if (current.st_ino, current.st_mtime, current.st_size) == (
+                    old.st_ino, old.st_mtime, old.st_size):
+                return False
+            # Lookups in progress keep using the old mapping, which is
+            # unmapped once they release it.
+            self._mapped = _MappedSnapshot(self.path)
+            return True
+
+    def _maybeReload(self):
+        interval = self.reload_interval
+        if interval is not None and self._timer() - self._checked >= interval:
+            self.reload()
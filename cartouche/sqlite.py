@@ -0,0 +1,370 @@
+##############################################################################
+#
+# Copyright (c) 2010 Agendaless Consulting and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+""" SQLite-based storage for registrations.
+
+An alternative to :mod:`cartouche.persistence`, for sites with more users
+than fit comfortably in ZODB.  The adapters take the database path from the
+``cartouche.sqlite_path`` setting.  Each thread gets its own connection to
+a database in WAL mode, so readers do not block the writer, and closed
+once its thread is gone;  the statements are fixed strings, which
+``sqlite3`` prepares once per connection and caches.  Prefix searches
+(``LIKE``, which ignores case) use the ``COLLATE NOCASE`` indexes.
+
+Each write is committed as it is made:  it does not join the ZODB
+transaction of the request.
+"""
+import sqlite3
+from threading import Lock
+from threading import local
+from weakref import WeakSet
+from time import time
+
+from pyramid.threadlocal import get_current_registry
+from zope.interface import implementer
+
+from cartouche.interfaces import IPendingRegistrationInfo
+from cartouche.interfaces import IRegistrationInfo
+from cartouche.interfaces import IRegistrations
+
+PATH_SETTING = 'cartouche.sqlite_path'
+
+SCHEMA = """\
+CREATE TABLE IF NOT EXISTS pending (
+    email TEXT PRIMARY KEY,
+    token TEXT,
+    created REAL
+);
+CREATE INDEX IF NOT EXISTS pending_created ON pending (created);
+CREATE INDEX IF NOT EXISTS pending_email_nocase
+    ON pending (email COLLATE NOCASE);
+CREATE TABLE IF NOT EXISTS confirmed (
+    uuid TEXT PRIMARY KEY,
+    email TEXT UNIQUE,
+    login TEXT UNIQUE,
+    password TEXT,
+    security_question TEXT,
+    security_answer TEXT,
+    token TEXT UNIQUE,
+    token_expires REAL
+);
+CREATE INDEX IF NOT EXISTS confirmed_token_expires
+    ON confirmed (token_expires);
+CREATE INDEX IF NOT EXISTS confirmed_login_nocase
+    ON confirmed (login COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS confirmed_email_nocase
+    ON confirmed (email COLLATE NOCASE);
+"""
+
+
+class _ConnectionHolder(object):
+    # The only strong reference to a thread's connection, held in its
+    # thread-local storage:  closes the connection once the thread is gone.
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __del__(self):
+        self.conn.close()
+
+
+class Database(object):
+    """ SQLite database at 'path', with one connection per thread.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._local = local()
+        self._holders = WeakSet()
+        self._lock = Lock()
+
+    def connection(self):
+        holder = getattr(self._local, 'holder', None)
+        if holder is None:
+            conn = sqlite3.connect(self.path,
+                                   isolation_level=None,  # autocommit
+                                   check_same_thread=False,
+                                   cached_statements=256)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(SCHEMA)
+            holder = self._local.holder = _ConnectionHolder(conn)
+            with self._lock:
+                self._holders.add(holder)
+        return holder.conn
+
+    def close(self):
+        with self._lock:
+            holders = list(self._holders)
+            self._holders = WeakSet()
+        for holder in holders:
+            holder.conn.close()
+        self._local = local()
+
+
+_databases = {}
+_lock = Lock()
+
+
+def get_database(path):
+    """ Return the shared database for 'path', opening it if needed.
+    """
+    with _lock:
+        db = _databases.get(path)
+        if db is None:
+            db = _databases[path] = Database(path)
+        return db
+
+
+def close_database(path):
+    """ Close and forget the shared database for 'path', if open.
+    """
+    with _lock:
+        db = _databases.pop(path, None)
+    if db is not None:
+        db.close()
+
+
+class _Record(object):
+
+    def __init__(self, row):
+        for name in self.FIELDS:
+            setattr(self, name, row[name])
+
+
+@implementer(IPendingRegistrationInfo)
+class PendingRecord(_Record):
+    FIELDS = ('email', 'token', 'created')
+
+
+@implementer(IRegistrationInfo)
+class ConfirmedRecord(_Record):
+    FIELDS = ('uuid', 'email', 'login', 'password', 'security_question',
+              'security_answer', 'token', 'token_expires')
+
+
+def _escapeLike(prefix):
+    return (prefix.replace('\\', '\\\\')
+                  .replace('%', '\\%')
+                  .replace('_', '\\_')) + '%'
+
+
+class _SQLiteRegistrationsBase(object):
+
+    def __init__(self, context, path=None):
+        self.context = context
+        if path is None:
+            settings = get_current_registry().settings or {}
+            path = settings[PATH_SETTING]
+        self.db = get_database(path)
+
+    def _execute(self, sql, params=()):
+        return self.db.connection().execute(sql, params)
+
+    def _select(self, where, params=(), suffix=''):
+        sql = 'SELECT %s FROM %s WHERE %s%s' % (
+                ', '.join(self.RECORD.FIELDS), self.TABLE, where, suffix)
+        return [(row[self.KEY], self.RECORD(row))
+                    for row in self._execute(sql, params)]
+
+    def _selectOne(self, column, value, default):
+        found = self._select('%s = ?' % column, (value,))
+        if not found:
+            return default
+        return found[0][1]
+
+    def __iter__(self):
+        """ See IRegistrations.
+        """
+        return iter(self._select('1', suffix=' ORDER BY %s' % self.KEY))
+
+    def count(self):
+        """ See IRegistrations.
+        """
+        sql = 'SELECT COUNT(*) FROM %s' % self.TABLE
+        return self._execute(sql).fetchone()[0]
+
+    def page(self, after=None, size=20, before=None):
+        """ See IRegistrations.
+        """
+        if before is not None:
+            suffix = ' ORDER BY %s DESC LIMIT ?' % self.KEY
+            found = self._select('%s < ?' % self.KEY, (before, size), suffix)
+            found.reverse()
+            return found
+        suffix = ' ORDER BY %s LIMIT ?' % self.KEY
+        if after is None:
+            return self._select('1', (size,), suffix)
+        return self._select('%s > ?' % self.KEY, (after, size), suffix)
+
+    def search(self, prefix, limit=20):
+        """ See IRegistrations.
+        """
+        if not prefix:
+            return []
+        pattern = _escapeLike(prefix)
+        where = ' OR '.join(["%s LIKE ? ESCAPE '\\'" % column
+                                for column in self.SEARCHED])
+        suffix = ' ORDER BY %s LIMIT ?' % self.SEARCHED[0]
+        params = (pattern,) * len(self.SEARCHED) + (limit,)
+        return self._select(where, params, suffix)
+
+    def set(self, key, **kw):
+        """ See IRegistrations.
+        """
+        self._execute(self._upsertSQL(), self._upsertParams(key, kw))
+
+    def set_many(self, items):
+        """ See IRegistrations.
+        """
+        params = [self._upsertParams(key, kw) for key, kw in items]
+        conn = self.db.connection()
+        conn.execute('BEGIN')
+        try:
+            conn.executemany(self._upsertSQL(), params)
+        except:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        return len(params)
+
+    def update(self, key, **changes):
+        """ See IRegistrations.
+        """
+        for name in changes:
+            if name not in self.RECORD.FIELDS or name == self.KEY:
+                raise TypeError('Unknown field: %s' % name)
+        names = sorted(changes)
+        if names:
+            sql = 'UPDATE %s SET %s WHERE %s = ?' % (
+                    self.TABLE,
+                    ', '.join(['%s = ?' % name for name in names]),
+                    self.KEY)
+            params = [changes[name] for name in names] + [key]
+            cursor = self._execute(sql, params)
+            if cursor.rowcount == 0:
+                raise KeyError(key)
+        elif self.get(key) is None:
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        """ See IRegistrations.
+        """
+        return self._selectOne(self.KEY, key, default)
+
+    def remove(self, key):
+        """ See IRegistrations.
+        """
+        sql = 'DELETE FROM %s WHERE %s = ?' % (self.TABLE, self.KEY)
+        if self._execute(sql, (key,)).rowcount == 0:
+            raise KeyError(key)
+
+    def _upsertSQL(self):
+        fields = self.RECORD.FIELDS
+        return ('INSERT INTO %s (%s) VALUES (%s) '
+                'ON CONFLICT (%s) DO UPDATE SET %s' % (
+                    self.TABLE,
+                    ', '.join(fields),
+                    ', '.join(['?'] * len(fields)),
+                    self.KEY,
+                    ', '.join(['%s = excluded.%s' % (name, name)
+                                for name in fields if name != self.KEY])))
+
+    def _upsertParams(self, key, kw):
+        kw = dict(kw)
+        kw[self.KEY] = key
+        return [kw.get(name) for name in self.RECORD.FIELDS]
+
+
+@implementer(IRegistrations)
+class PendingRegistrations(_SQLiteRegistrationsBase):
+    """ Adapter for looking up pending registrations, keyed by e-mail.
+    """
+    TABLE = 'pending'
+    KEY = 'email'
+    RECORD = PendingRecord
+    SEARCHED = ('email',)
+
+    def get_by_email(self, email, default=None):
+        """ See IRegistrations.
+        """
+        return self.get(email, default)
+
+    def get_by_login(self, login, default=None):
+        """ See IRegistrations.
+        """
+        raise NotImplementedError
+
+    def get_by_token(self, token, default=None):
+        """ See IRegistrations.
+        """
+        raise NotImplementedError
+
+    def expired(self, cutoff, limit=None):
+        """ Return e-mails of registrations created before 'cutoff'.
+
+        Return at most 'limit' e-mails, oldest first.
+        """
+        sql = ('SELECT email FROM pending WHERE created < ? '
+               'ORDER BY created LIMIT ?')
+        limit = -1 if limit is None else limit
+        return [row[0] for row in self._execute(sql, (cutoff, limit))]
+
+    def _upsertParams(self, key, kw):
+        if kw.get('created') is None:
+            kw = dict(kw, created=time())
+        return super(PendingRegistrations, self)._upsertParams(key, kw)
+
+
+@implementer(IRegistrations)
+class ConfirmedRegistrations(_SQLiteRegistrationsBase):
+    """ Adapter for looking up confirmed registrations, keyed by UUID.
+    """
+    TABLE = 'confirmed'
+    KEY = 'uuid'
+    RECORD = ConfirmedRecord
+    SEARCHED = ('login', 'email')
+
+    def get_by_email(self, email, default=None):
+        """ See IRegistrations.
+        """
+        return self._selectOne('email', email, default)
+
+    def get_by_login(self, login, default=None):
+        """ See IRegistrations.
+        """
+        return self._selectOne('login', login, default)
+
+    def get_by_token(self, token, default=None):
+        """ See IRegistrations.
+        """
+        if token is None:
+            return default
+        found = self._select(
+                    'token = ? AND (token_expires IS NULL '
+                    'OR token_expires > ?)', (token, time()))
+        if not found:
+            return default
+        return found[0][1]
+
+    def purge_expired_tokens(self, cutoff, limit=None):
+        """ Clear tokens expiring before 'cutoff'.
+
+        Clear at most 'limit' tokens, oldest first;  return the number
+        cleared.
+        """
+        sql = ('UPDATE confirmed SET token = NULL, token_expires = NULL '
+               'WHERE uuid IN (SELECT uuid FROM confirmed '
+               'WHERE token_expires < ? ORDER BY token_expires LIMIT ?)')
+        limit = -1 if limit is None else limit
+        return self._execute(sql, (cutoff, limit)).rowcount
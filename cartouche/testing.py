@@ -1,11 +1,12 @@
 # Testing app / config
 
-from pyramid.renderers import get_renderer
 from repoze.sendmail.interfaces import IMailDelivery
 from zope.interface import implementer
 from zope.password.password import SSHAPasswordManager
 
 from cartouche.interfaces import IRegistrations
+from cartouche.util import getMainTemplate
+from cartouche._compat import STRING_TYPES
 
 DIVIDER =  "#" * 80
 
@@ -54,6 +55,28 @@ def _factory(_make_info):
                 self._store[email] = key
             print(DIVIDER)
 
+        def set_many(self, items):
+            count = 0
+            for key, kw in items:
+                self.set(key, **kw)
+                count += 1
+            return count
+
+        def update(self, key, **changes):
+            info = self._store[key]
+            print(DIVIDER)
+            print('Updating registration for key: %s' % key)
+            print('fields:', ', '.join(sorted(changes)))
+            for name in ('login', 'email'):
+                if name in changes:
+                    old = getattr(info, name, None)
+                    if old is not None and old in self._store:
+                        del self._store[old]
+                    self._store[changes[name]] = key
+            for name, value in changes.items():
+                setattr(info, name, value)
+            print(DIVIDER)
+
         def get(self, key, default=None):
             return self._store.get(key, default)
 
@@ -69,6 +92,12 @@ def _factory(_make_info):
                 return default
             return self._store.get(key, default)
 
+        def get_by_token(self, token, default=None):
+            for value in self._store.values():
+                if getattr(value, 'token', None) == token:
+                    return value
+            return default
+
         def remove(self, key, default=None):
             old_info = self._store.get(key)
             if old_info is not None:
@@ -86,6 +115,32 @@ def _factory(_make_info):
         def __iter__(self):
             return iter(self._store.items())
 
+        def count(self):
+            return len([x for x in self._store.values()
+                            if not isinstance(x, STRING_TYPES)])
+
+        def page(self, after=None, size=20, before=None):
+            # Skip the login / email "index" entries.
+            items = [(key, info) for key, info in sorted(self._store.items())
+                        if not isinstance(info, STRING_TYPES)
+                            and (after is None or key > after)
+                            and (before is None or key < before)]
+            if before is not None:
+                return items[max(len(items) - size, 0):]
+            return items[:size]
+
+        def search(self, prefix, limit=20):
+            prefix = prefix.lower()
+            found = {}
+            for key, value in self._store.items():
+                if (isinstance(value, STRING_TYPES) and
+                    key.lower().startswith(prefix)):
+                    found[value] = self._store[value]
+                elif (not isinstance(value, STRING_TYPES) and
+                      key.lower().startswith(prefix)):
+                    found[key] = value # pending, keyed by email
+            return sorted(found.items())[:limit]
+
     return FauxRegistrations
 
 
@@ -140,8 +195,7 @@ def homepage_view(context, request):
         else:
             login_name = account_info.login
             email = account_info.email
-    main_template = get_renderer('templates/main.pt')
-    return {'main_template': main_template.implementation(),
+    return {'main_template': getMainTemplate(request),
             'authenticated_user': authenticated_user,
             'login_name': login_name,
             'email': email,
@@ -166,8 +220,7 @@ def debug_view(context, request):
         else:
             login_name = account_info.login
             email = account_info.email
-    main_template = get_renderer('templates/main.pt')
-    return {'main_template': main_template.implementation(),
+    return {'main_template': getMainTemplate(request),
             'authenticated_user': authenticated_user,
             'login_name': login_name,
             'email': email,
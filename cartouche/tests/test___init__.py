@@ -47,3 +47,25 @@ class Test_main(unittest.TestCase):
         request = DummyRequest()
         root = app.root_factory(request)
         self.assertEqual(root.data, {})
+
+    def test_w_template_cache(self):
+        import os
+        import shutil
+        import tempfile
+        from chameleon.loader import ModuleLoader
+        from chameleon.template import BaseTemplate
+        tempdir = tempfile.mkdtemp()
+        saved = BaseTemplate.loader
+        try:
+            path = os.path.join(tempdir, 'cache')
+            zcml_file = os.path.join(tempdir, 'configure.zcml')
+            with open(zcml_file, 'w') as f:
+                f.write('<configure xmlns="http://pylonshq.com/pyramid"/>')
+            self._callFUT(None, zodb_uri='memory://',
+                          configure_zcml=zcml_file,
+                          **{'cartouche.template_cache': path})
+            self.assertTrue(isinstance(BaseTemplate.loader, ModuleLoader))
+            self.assertEqual(BaseTemplate.loader.path, path)
+        finally:
+            BaseTemplate.loader = saved
+            shutil.rmtree(tempdir)
@@ -60,11 +60,23 @@ class Test_admin_overview(_Base, unittest.TestCase):
         info = self._callFUT(context, request)
         self.assertEqual(info['pending'], [('abc', abc)])
         self.assertEqual(info['confirmed'], [('xyz', xyz)])
+        self.assertEqual(info['pending_count'], 1)
+        self.assertEqual(info['confirmed_count'], 1)
+
+    def test_counts_w_counters(self):
+        from BTrees.Length import Length
+        cartouche = DummyCartouche()
+        cartouche.pending_count = Length(12)
+        cartouche.confirmed_count = Length(34)
+        context = self._makeContext(cartouche=cartouche)
+        info = self._callFUT(context, self._makeRequest())
+        self.assertEqual(info['pending_count'], 12)
+        self.assertEqual(info['confirmed_count'], 34)
 
     def test_w_pending_adapter(self):
         from cartouche.interfaces import IRegistrations
         PENDING = [('abc', object())]
-        self.config.registry.registerAdapter(lambda x: PENDING,
+        self.config.registry.registerAdapter(lambda x: DummyPaged(PENDING),
                                              (None,), IRegistrations,
                                              name='pending')
         context = self._makeContext()
@@ -75,7 +87,7 @@ class Test_admin_overview(_Base, unittest.TestCase):
     def test_w_confirmed_adapter(self):
         from cartouche.interfaces import IRegistrations
         CONFIRMED = [('abc', object())]
-        self.config.registry.registerAdapter(lambda x: CONFIRMED,
+        self.config.registry.registerAdapter(lambda x: DummyPaged(CONFIRMED),
                                              (None,), IRegistrations,
                                              name='confirmed')
         context = self._makeContext()
@@ -83,6 +95,104 @@ class Test_admin_overview(_Base, unittest.TestCase):
         info = self._callFUT(context, request)
         self.assertEqual(info['confirmed'], CONFIRMED)
 
+    def test_w_search(self):
+        from cartouche.persistence import ConfirmedRegistrations
+        from cartouche.persistence import PendingRegistrations
+        context = self._makeContext(cartouche=DummyCartouche())
+        PendingRegistrations(context).set('Phred@example.com', token='T')
+        PendingRegistrations(context).set('bharney@example.com', token='T')
+        confirmed = ConfirmedRegistrations(context)
+        confirmed.set('UUID1', login='phred', email='p@example.com')
+        confirmed.set('UUID2', login='bharney', email='PHR@example.com')
+        confirmed.set('UUID3', login='wylma', email='w@example.com')
+        request = self._makeRequest(params={'q': ' phR '})
+        info = self._callFUT(context, request)
+        self.assertEqual(info['search'], 'phR')
+        self.assertEqual([x[0] for x in info['pending']],
+                         ['Phred@example.com'])
+        self.assertEqual([x[0] for x in info['confirmed']],
+                         ['UUID2', 'UUID1'])
+        self.assertEqual(info['confirmed_next_url'], None)
+
+    def test_single_page_has_no_links(self):
+        cartouche = DummyCartouche()
+        cartouche.by_uuid['xyz'] = object()
+        context = self._makeContext(cartouche=cartouche)
+        info = self._callFUT(context, self._makeRequest())
+        self.assertEqual(info['confirmed_next_url'], None)
+        self.assertEqual(info['confirmed_prev_url'], None)
+        self.assertEqual(info['pending_next_url'], None)
+        self.assertEqual(info['pending_prev_url'], None)
+
+    def test_pages_forward_and_back(self):
+        from webob.multidict import MultiDict
+        from cartouche import admin
+        from .._compat import parse_qsl
+        from .._compat import urlparse
+        cartouche = DummyCartouche()
+        for key in 'abcde':
+            cartouche.by_uuid[key] = object()
+        cartouche.pending['p'] = object()
+        context = self._makeContext(cartouche=cartouche)
+        def _follow(url):
+            query = urlparse(url)[4]
+            return self._makeRequest(params=MultiDict(parse_qsl(query)),
+                                     view_name='admin.html')
+        original, admin.PAGE_SIZE = admin.PAGE_SIZE, 2
+        try:
+            first = self._callFUT(context,
+                                  self._makeRequest(view_name='admin.html'))
+            self.assertEqual([x[0] for x in first['confirmed']], ['a', 'b'])
+            self.assertEqual(first['confirmed_prev_url'], None)
+            second = self._callFUT(context,
+                                   _follow(first['confirmed_next_url']))
+            self.assertEqual([x[0] for x in second['confirmed']], ['c', 'd'])
+            third = self._callFUT(context,
+                                  _follow(second['confirmed_next_url']))
+            self.assertEqual([x[0] for x in third['confirmed']], ['e'])
+            self.assertEqual(third['confirmed_next_url'], None)
+            self.assertEqual([x[0] for x in third['pending']], ['p'])
+            back = self._callFUT(context,
+                                 _follow(third['confirmed_prev_url']))
+            self.assertEqual([x[0] for x in back['confirmed']], ['c', 'd'])
+            start = self._callFUT(context,
+                                  _follow(back['confirmed_prev_url']))
+            self.assertEqual([x[0] for x in start['confirmed']], ['a', 'b'])
+            self.assertEqual(start['confirmed_prev_url'], None)
+        finally:
+            admin.PAGE_SIZE = original
+
+    def test_page_links_carry_one_cursor(self):
+        from webob.multidict import MultiDict
+        from cartouche import admin
+        from .._compat import parse_qsl
+        from .._compat import urlparse
+        cartouche = DummyCartouche()
+        for key in 'abcdefghij':
+            cartouche.by_uuid[key] = object()
+        context = self._makeContext(cartouche=cartouche)
+        def _follow(url):
+            query = urlparse(url)[4]
+            return self._makeRequest(params=MultiDict(parse_qsl(query)),
+                                     view_name='admin.html')
+        original, admin.PAGE_SIZE = admin.PAGE_SIZE, 2
+        try:
+            info = self._callFUT(context,
+                                 self._makeRequest(view_name='admin.html'))
+            for i in range(4):
+                info = self._callFUT(context,
+                                     _follow(info['confirmed_next_url']))
+            self.assertEqual([x[0] for x in info['confirmed']], ['i', 'j'])
+            query = parse_qsl(urlparse(info['confirmed_prev_url'])[4])
+            self.assertEqual(query, [('confirmed_before', 'i')])
+            back = self._callFUT(context,
+                                 _follow(info['confirmed_prev_url']))
+            self.assertEqual([x[0] for x in back['confirmed']], ['g', 'h'])
+            query = parse_qsl(urlparse(back['confirmed_next_url'])[4])
+            self.assertEqual(query, [('confirmed_after', 'h')])
+        finally:
+            admin.PAGE_SIZE = original
+
 
 class Test_admin_pending(_Base, unittest.TestCase):
 
@@ -230,9 +340,115 @@ class Test_admin_confirmed(_Base, unittest.TestCase):
         self.assertEqual(info['token'], TOKEN)
 
 
+class Test_admin_export(_Base, unittest.TestCase):
+
+    def _callFUT(self, context=None, request=None):
+        from cartouche.admin import admin_export
+        if context is None:
+            context = self._makeContext()
+        if request is None:
+            request = self._makeRequest()
+        return admin_export(context, request)
+
+    def _body(self, response):
+        import json
+        lines = b''.join(response.app_iter).decode('utf-8').splitlines()
+        return [json.loads(x) for x in lines]
+
+    def test_invalid_registrations(self):
+        from pyramid.exceptions import HTTPNotFound
+        request = self._makeRequest(params={'registrations': 'bogus'})
+        response = self._callFUT(request=request)
+        self.assertTrue(isinstance(response, HTTPNotFound))
+
+    def test_wo_adapters_confirmed(self):
+        from cartouche.models import RegistrationInfo
+        cartouche = DummyCartouche()
+        cartouche.by_uuid['UUID'] = RegistrationInfo('UUID',
+                                                     'phred@example.com',
+                                                     'login', 'password',
+                                                     'question', 'answer')
+        context = self._makeContext(cartouche=cartouche)
+        response = self._callFUT(context)
+        self.assertEqual(response.content_type, 'application/x-ndjson')
+        self.assertEqual(response.content_disposition,
+                         'attachment; filename=confirmed.jsonl')
+        records = self._body(response)
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]['key'], 'UUID')
+        self.assertEqual(records[0]['login'], 'login')
+        self.assertEqual(records[0]['email'], 'phred@example.com')
+        self.assertFalse('password' in records[0])
+        self.assertFalse('token' in records[0])
+        self.assertFalse('token_expires' in records[0])
+        self.assertFalse('security_question' in records[0])
+        self.assertFalse('security_answer' in records[0])
+
+    def test_invalid_limit(self):
+        from pyramid.httpexceptions import HTTPBadRequest
+        for limit in ('bogus', '-1'):
+            request = self._makeRequest(params={'limit': limit})
+            response = self._callFUT(request=request)
+            self.assertTrue(isinstance(response, HTTPBadRequest))
+
+    def test_minimizes_connection_cache(self):
+        from cartouche.interfaces import IRegistrations
+        pending = DummyPaged([('%d@example.com' % i,
+                               Dummy(email='%d@example.com' % i))
+                                for i in range(5)])
+        self.config.registry.registerAdapter(lambda context: pending,
+                                             (None,), IRegistrations,
+                                             name='pending')
+        collected = []
+        class DummyJar(object):
+            def cacheGC(self):
+                collected.append(1)
+        context = self._makeContext(_p_jar=DummyJar())
+        request = self._makeRequest(params={'registrations': 'pending'})
+        response = self._callFUT(context, request)
+        records = self._body(response)
+        self.assertEqual(len(records), 5)
+        self.assertEqual(collected, [1])
+
+    def test_w_adapter_pending_w_after_and_limit(self):
+        from cartouche.interfaces import IRegistrations
+        pending = DummyPaged([('a@example.com', Dummy(email='a@example.com')),
+                              ('b@example.com', Dummy(email='b@example.com')),
+                              ('c@example.com', Dummy(email='c@example.com')),
+                             ])
+        self.config.registry.registerAdapter(lambda context: pending,
+                                             (None,), IRegistrations,
+                                             name='pending')
+        request = self._makeRequest(params={'registrations': 'pending',
+                                            'after': 'a@example.com',
+                                            'limit': '1',
+                                           })
+        response = self._callFUT(request=request)
+        records = self._body(response)
+        self.assertEqual([x['key'] for x in records], ['b@example.com'])
+        self.assertEqual(records[0]['email'], 'b@example.com')
+
+
+class Dummy(object):
+    def __init__(self, **kw):
+        self.__dict__.update(kw)
+
+
+class DummyPaged(object):
+    def __init__(self, items):
+        self._items = items
+    def page(self, after=None, size=20, before=None):
+        if before is not None:
+            items = [x for x in self._items if x[0] < before]
+            return items[max(len(items) - size, 0):]
+        return [x for x in self._items if after is None or x[0] > after][:size]
+    def count(self):
+        return len(self._items)
+
 class DummyCartouche(object):
     def __init__(self):
-        self.pending = {}
-        self.by_uuid = {}
-        self.by_login = {}
-        self.by_email = {}
+        from BTrees.OOBTree import OOBTree
+        self.pending = OOBTree()
+        self.by_uuid = OOBTree()
+        self.by_login = OOBTree()
+        self.by_email = OOBTree()
@@ -0,0 +1,213 @@
+##############################################################################
+#
+# Copyright (c) 2010 Agendaless Consulting and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+import unittest
+
+
+class AuthCheckAppTests(unittest.TestCase):
+
+    def _getTargetClass(self):
+        from cartouche.authcheck import AuthCheckApp
+        return AuthCheckApp
+
+    def _makeOne(self, identity=None, **kw):
+        environs = self._environs = []
+        class DummyAPI(object):
+            def __init__(self, environ):
+                environs.append(environ)
+            def authenticate(self):
+                return identity
+        return self._getTargetClass()(DummyAPI, **kw)
+
+    def _callApp(self, app, environ=None):
+        started = []
+        def start_response(status, headers):
+            started.append((status, headers))
+        if environ is None:
+            environ = {}
+        body = app(environ, start_response)
+        self.assertEqual(list(body), [])
+        self.assertEqual(len(started), 1)
+        return started[0]
+
+    def test_unauthenticated(self):
+        app = self._makeOne()
+        environ = {'HTTP_AUTHORIZATION': 'Basic bogus'}
+        status, headers = self._callApp(app, environ)
+        self.assertEqual(status, '401 Unauthorized')
+        self.assertEqual(headers, [('Content-Length', '0')])
+        self.assertTrue(self._environs[0] is environ)
+
+    def test_closes_connections(self):
+        from repoze.zodbconn.finder import CLOSER_KEY
+        from cartouche.databases import CONNECTION_KEY
+        from cartouche.databases import RequestCleanup
+        closed = []
+        class DummyConnection(object):
+            def close(self):
+                closed.append(self)
+        conn = DummyConnection()
+        environ = {CONNECTION_KEY: conn,
+                   CLOSER_KEY: RequestCleanup(conn, {}),
+                  }
+        app = self._makeOne()
+        self._callApp(app, environ)
+        self.assertEqual(closed, [conn])
+        self.assertEqual(environ, {})
+
+    def test_authenticated_not_confirmed(self):
+        # E.g., an 'auth_tkt' cookie of a user since removed.
+        app = self._makeOne({'repoze.who.userid': 'UUID'})
+        status, headers = self._callApp(app)
+        self.assertEqual(status, '401 Unauthorized')
+
+    def test_authenticated_wo_groups(self):
+        from cartouche.whoplugin import CONFIRMED_KEY
+        app = self._makeOne({'repoze.who.userid': 'UUID',
+                             CONFIRMED_KEY: True})
+        status, headers = self._callApp(app)
+        self.assertEqual(status, '204 No Content')
+        self.assertEqual(headers, [('X-Cartouche-Userid', 'UUID')])
+
+    def test_authenticated_w_groups(self):
+        from cartouche.whoplugin import CONFIRMED_KEY
+        app = self._makeOne({'repoze.who.userid': 'UUID',
+                             'groups': ('g:admin', 'g:staff'),
+                             CONFIRMED_KEY: True},
+                            userid_header='X-User',
+                            groups_header='X-Groups')
+        status, headers = self._callApp(app)
+        self.assertEqual(status, '204 No Content')
+        self.assertEqual(headers, [('X-User', 'UUID'),
+                                   ('X-Groups', 'g:admin,g:staff')])
+
+    def test_non_ascii_userid_sent_as_utf8(self):
+        from cartouche._compat import u
+        from cartouche.whoplugin import CONFIRMED_KEY
+        app = self._makeOne({'repoze.who.userid': u('j\xfcrgen'),
+                             CONFIRMED_KEY: True})
+        status, headers = self._callApp(app)
+        value = headers[0][1]
+        if not isinstance(value, bytes):
+            value = value.encode('latin-1')
+        self.assertEqual(value, b'j\xc3\xbcrgen')
+
+
+class Test_make_app(unittest.TestCase):
+
+    _tempdir = None
+
+    def tearDown(self):
+        if self._tempdir is not None:
+            import shutil
+            shutil.rmtree(self._tempdir)
+
+    def _callFUT(self, global_conf, who_config, **kw):
+        from cartouche.authcheck import make_app
+        return make_app(global_conf, who_config, **kw)
+
+    def _writeConfig(self):
+        import os
+        from tempfile import mkdtemp
+        from cartouche.snapshot import writeSnapshot
+        from zope.password.password import SSHAPasswordManager
+        self._tempdir = mkdtemp('authchecktests')
+        encoded = SSHAPasswordManager().encodePassword('password')
+        writeSnapshot(os.path.join(self._tempdir, 'credentials.snap'),
+                      [('login', 'UUID', encoded, ('g:admin',))])
+        with open(os.path.join(self._tempdir, 'who.ini'), 'w') as stream:
+            stream.write(WHO_INI)
+        return self._tempdir
+
+    def test_authenticates_basic_auth_against_snapshot(self):
+        import base64
+        from cartouche.authcheck import AuthCheckApp
+        here = self._writeConfig()
+        app = self._callFUT({'here': here}, 'who.ini')
+        self.assertTrue(isinstance(app, AuthCheckApp))
+
+        started = []
+        def start_response(status, headers):
+            started.append((status, headers))
+        credentials = base64.b64encode(b'login:password').decode('ascii')
+        environ = {'REQUEST_METHOD': 'GET',
+                   'HTTP_AUTHORIZATION': 'Basic %s' % credentials,
+                  }
+        app(environ, start_response)
+        self.assertEqual(started, [('204 No Content',
+                                    [('X-Cartouche-Userid', 'UUID'),
+                                     ('X-Cartouche-Groups', 'g:admin'),
+                                    ])])
+
+        credentials = base64.b64encode(b'login:bogus').decode('ascii')
+        environ['HTTP_AUTHORIZATION'] = 'Basic %s' % credentials
+        app(environ, start_response)
+        self.assertEqual(started[1][0], '401 Unauthorized')
+
+    def test_checks_auth_tkt_userid_against_snapshot(self):
+        from repoze.who._auth_tkt import AuthTicket
+        here = self._writeConfig()
+        app = self._callFUT({'here': here}, 'who.ini')
+
+        started = []
+        def start_response(status, headers):
+            started.append((status, headers))
+        for userid in ('UUID', 'REMOVED'):
+            ticket = AuthTicket('s33kr1t', userid, '0.0.0.0')
+            environ = {'REQUEST_METHOD': 'GET',
+                       'REMOTE_ADDR': '127.0.0.1',
+                       'HTTP_COOKIE': 'auth_tkt=%s' % ticket.cookie_value(),
+                      }
+            app(environ, start_response)
+        self.assertEqual(started, [('204 No Content',
+                                    [('X-Cartouche-Userid', 'UUID'),
+                                     ('X-Cartouche-Groups', 'g:admin'),
+                                    ]),
+                                   ('401 Unauthorized',
+                                    [('Content-Length', '0')]),
+                                  ])
+
+
+WHO_INI = """\
+[plugin:basicauth]
+use = repoze.who.plugins.basicauth:make_plugin
+realm = test
+
+[plugin:auth_tkt]
+use = repoze.who.plugins.auth_tkt:make_plugin
+secret = s33kr1t
+
+[plugin:cartouche]
+use = cartouche.whoplugin:make_plugin
+snapshot = %(here)s/credentials.snap
+
+[general]
+request_classifier = repoze.who.classifiers:default_request_classifier
+challenge_decider = repoze.who.classifiers:default_challenge_decider
+
+[identifiers]
+plugins =
+      auth_tkt
+      basicauth
+
+[authenticators]
+plugins =
+      auth_tkt
+      cartouche
+
+[mdproviders]
+plugins = cartouche
+
+[challengers]
+plugins = basicauth
+"""
@@ -0,0 +1,336 @@
+##############################################################################
+#
+# Copyright (c) 2010 Agendaless Consulting and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+import unittest
+
+
+class _Base(object):
+
+    def setUp(self):
+        import transaction
+        transaction.begin()
+
+    def tearDown(self):
+        import transaction
+        transaction.abort()
+
+
+class CachingRegistrationsTests(_Base, unittest.TestCase):
+
+    def _getTargetClass(self):
+        from cartouche.caching import CachingRegistrations
+        return CachingRegistrations
+
+    def _makeOne(self, registrations=None, cache=None):
+        from cartouche.lru import LRUCache
+        if registrations is None:
+            registrations = self._makeConfirmed()
+        if cache is None:
+            cache = LRUCache(10)
+        return self._getTargetClass()(registrations, cache)
+
+    def _makeConfirmed(self):
+        from pyramid.testing import DummyModel
+        from cartouche.persistence import ConfirmedRegistrations
+        confirmed = ConfirmedRegistrations(DummyModel())
+        confirmed.set('UUID', email='phred@example.com', login='login',
+                      password='password', token='token')
+        return CountingRegistrations(confirmed)
+
+    def test_class_conforms_to_IRegistrations(self):
+        from zope.interface.verify import verifyClass
+        from cartouche.interfaces import IRegistrations
+        verifyClass(IRegistrations, self._getTargetClass())
+
+    def test_instance_conforms_to_IRegistrations(self):
+        from zope.interface.verify import verifyObject
+        from cartouche.interfaces import IRegistrations
+        verifyObject(IRegistrations, self._makeOne())
+
+    def test_get_miss(self):
+        adapter = self._makeOne()
+        self.assertEqual(adapter.get('nonesuch', 'default'), 'default')
+
+    def test_get_caches_snapshot(self):
+        from cartouche.interfaces import IRegistrationInfo
+        confirmed = self._makeConfirmed()
+        adapter = self._makeOne(confirmed)
+
+        first = adapter.get('UUID')
+        second = adapter.get('UUID')
+
+        self.assertEqual(confirmed._calls, [('get', 'UUID')])
+        self.assertEqual(second.uuid, 'UUID')
+        self.assertEqual(first.login, 'login')
+        self.assertEqual(first.password, 'password')
+        self.assertTrue(IRegistrationInfo.providedBy(first))
+        self.assertFalse(hasattr(first, '_p_jar'))
+
+    def test_get_by_login_and_email_share_record(self):
+        confirmed = self._makeConfirmed()
+        adapter = self._makeOne(confirmed)
+
+        by_login = adapter.get_by_login('login')
+        self.assertEqual(adapter.get_by_login('login').uuid, 'UUID')
+        self.assertEqual(adapter.get('UUID').uuid, 'UUID')
+        by_email = adapter.get_by_email('phred@example.com')
+        self.assertEqual(adapter.get_by_email('phred@example.com').uuid,
+                         'UUID')
+        self.assertEqual(by_login.uuid, by_email.uuid)
+
+        self.assertEqual(confirmed._calls,
+                         [('get_by_login', 'login'),
+                          ('get_by_email', 'phred@example.com')])
+
+    def test_snapshot_omits_profile(self):
+        confirmed = self._makeConfirmed()
+        confirmed.registrations.update('UUID', security_question='question')
+        adapter = self._makeOne(confirmed)
+        adapter.get('UUID')
+
+        cached = adapter.cache.get(('key', 'UUID'))
+
+        self.assertFalse('security_question' in cached.__dict__)
+        self.assertFalse('security_answer' in cached.__dict__)
+        self.assertRaises(AttributeError, getattr, cached,
+                          'security_question')
+
+    def test_get_hit_loads_profile_on_access(self):
+        confirmed = self._makeConfirmed()
+        confirmed.registrations.update('UUID', security_question='question')
+        adapter = self._makeOne(confirmed)
+        adapter.get('UUID')
+        del confirmed._calls[:]
+
+        record = adapter.get('UUID')
+        self.assertEqual(confirmed._calls, [])
+        self.assertEqual(record.login, 'login')
+        self.assertEqual(confirmed._calls, [])
+
+        self.assertEqual(record.security_question, 'question')
+        self.assertEqual(record.security_answer, None)
+        self.assertEqual(confirmed._calls, [('get', 'UUID')])
+
+    def test_get_by_login_miss(self):
+        adapter = self._makeOne()
+        self.assertEqual(adapter.get_by_login('nonesuch'), None)
+
+    def test_get_by_login_stale_index_entry(self):
+        from cartouche.lru import LRUCache
+        confirmed = self._makeConfirmed()
+        cache = LRUCache(10)
+        adapter = self._makeOne(confirmed, cache)
+        adapter.get_by_login('login')
+        # Simulate a rename made by another process.
+        confirmed.registrations.update('UUID', login='renamed')
+        cache.remove(('key', 'UUID'))
+
+        self.assertEqual(adapter.get_by_login('login'), None)
+        self.assertEqual(cache.get(('login', 'login')), None)
+
+    def test_get_by_token_not_cached(self):
+        confirmed = self._makeConfirmed()
+        adapter = self._makeOne(confirmed)
+
+        record = adapter.get_by_token('token')
+        adapter.get_by_token('token')
+
+        self.assertEqual(record.uuid, 'UUID')
+        self.assertEqual(confirmed._calls,
+                         [('get_by_token', 'token', None),
+                          ('get_by_token', 'token', None)])
+
+    def test_update_invalidates(self):
+        adapter = self._makeOne()
+        adapter.get_by_login('login')
+
+        adapter.update('UUID', login='renamed')
+
+        self.assertEqual(adapter.get_by_login('login'), None)
+        self.assertEqual(adapter.get('UUID').login, 'renamed')
+        self.assertEqual(adapter.get_by_login('renamed').uuid, 'UUID')
+
+    def test_set_invalidates(self):
+        adapter = self._makeOne()
+        adapter.get_by_email('phred@example.com')
+
+        adapter.set('UUID', email='bharney@example.com', login='login')
+
+        self.assertEqual(adapter.get_by_email('phred@example.com'), None)
+        self.assertEqual(adapter.get('UUID').email, 'bharney@example.com')
+
+    def test_set_many_invalidates(self):
+        adapter = self._makeOne()
+        adapter.get('UUID')
+
+        count = adapter.set_many(iter([
+            ('UUID', {'email': 'phred@example.com', 'login': 'new'}),
+            ('UUID2', {'email': 'bharney@example.com', 'login': 'other'}),
+        ]))
+
+        self.assertEqual(count, 2)
+        self.assertEqual(adapter.get('UUID').login, 'new')
+
+    def test_remove_invalidates(self):
+        adapter = self._makeOne()
+        adapter.get_by_login('login')
+
+        adapter.remove('UUID')
+
+        self.assertEqual(adapter.get('UUID'), None)
+        self.assertEqual(adapter.get_by_login('login'), None)
+
+    def test_uncommitted_write_not_cached(self):
+        confirmed = self._makeConfirmed()
+        adapter = self._makeOne(confirmed)
+        adapter.update('UUID', password='new')
+        del confirmed._calls[:]
+
+        adapter.get('UUID')
+        adapter.get_by_login('login')
+        # Another adapter sharing the cache, in the same transaction.
+        self._makeOne(confirmed, adapter.cache).get('UUID')
+
+        self.assertEqual(len(adapter.cache), 0)
+        self.assertEqual(confirmed._calls, [('get', 'UUID'),
+                                            ('get_by_login', 'login'),
+                                            ('get', 'UUID')])
+
+    def test_abort_discards_uncommitted_state(self):
+        import transaction
+        from ZODB import DB
+        from cartouche.models import Root
+        from cartouche.persistence import ConfirmedRegistrations
+        db = DB(None)
+        conn = db.open()
+        try:
+            root = conn.root()['app_root'] = Root()
+            confirmed = ConfirmedRegistrations(root)
+            confirmed.set('UUID', email='phred@example.com', login='login',
+                          password='old')
+            transaction.commit()
+            adapter = self._makeOne(confirmed)
+            self.assertEqual(adapter.get_by_login('login').password, 'old')
+
+            adapter.update('UUID', password='new')
+            self.assertEqual(adapter.get_by_login('login').password, 'new')
+            transaction.abort()
+
+            self.assertEqual(confirmed.get('UUID').password, 'old')
+            self.assertEqual(adapter.get_by_login('login').password, 'old')
+            self.assertEqual(adapter.get('UUID').password, 'old')
+        finally:
+            transaction.abort()
+            conn.close()
+            db.close()
+
+    def test_commit_clears_entries_recached_meanwhile(self):
+        import transaction
+        adapter = self._makeOne()
+        stale = adapter.get('UUID')
+        adapter.update('UUID', password='new')
+        # As another thread would, before our commit.
+        adapter.cache.set(('key', 'UUID'), stale)
+
+        transaction.commit()
+
+        self.assertEqual(adapter.cache.get(('key', 'UUID')), None)
+        self.assertEqual(adapter.get('UUID').password, 'new')
+        self.assertEqual(len(adapter.cache), 1)
+
+    def test_delegates_listing(self):
+        adapter = self._makeOne()
+        self.assertEqual([key for key, record in adapter], ['UUID'])
+        self.assertEqual(adapter.count(), 1)
+        self.assertEqual([key for key, record in adapter.page()], ['UUID'])
+        self.assertEqual([key for key, record in adapter.search('log')],
+                         ['UUID'])
+
+
+class CachingRegistrationsFactoryTests(_Base, unittest.TestCase):
+
+    def _getTargetClass(self):
+        from cartouche.caching import CachingRegistrationsFactory
+        return CachingRegistrationsFactory
+
+    def _makeOne(self, *args, **kw):
+        from cartouche.persistence import ConfirmedRegistrations
+        return self._getTargetClass()(ConfirmedRegistrations, *args, **kw)
+
+    def test_adapters_share_cache(self):
+        from pyramid.testing import DummyModel
+        factory = self._makeOne(5, 30)
+        context = DummyModel()
+
+        first = factory(context)
+        second = factory(context)
+
+        self.assertTrue(first.cache is second.cache is factory.cache)
+        self.assertTrue(first.registrations.context is context)
+
+    def test_stats(self):
+        from pyramid.testing import DummyModel
+        factory = self._makeOne(5, 30)
+        import transaction
+        adapter = factory(DummyModel())
+        adapter.set('UUID', email='phred@example.com', login='login')
+        transaction.commit()
+
+        adapter.get('UUID')
+        adapter.get('UUID')
+
+        self.assertEqual(factory.stats(), {'hits': 1,
+                                           'misses': 1,
+                                           'size': 1,
+                                           'maxsize': 5,
+                                           'ttl': 30,
+                                          })
+
+
+class Test_cachedRegistrations(unittest.TestCase):
+
+    def test_directive(self):
+        from pyramid.config import Configurator
+        from pyramid.testing import DummyModel
+        from cartouche.caching import CachingRegistrations
+        from cartouche.interfaces import IRegistrations
+        config = Configurator()
+        config.include('pyramid_zcml')
+        config.load_zcml('cartouche.tests:caching.zcml')
+        config.commit()
+
+        adapter = config.registry.queryAdapter(DummyModel(), IRegistrations,
+                                               name='confirmed')
+
+        self.assertTrue(isinstance(adapter, CachingRegistrations))
+        self.assertEqual(adapter.cache.maxsize, 10)
+        self.assertEqual(adapter.cache.ttl, 5.0)
+
+
+class CountingRegistrations(object):
+    # Record lookups which reach the wrapped adapter.
+    def __init__(self, registrations):
+        self.registrations = registrations
+        self._calls = []
+
+    def __getattr__(self, name):
+        attr = getattr(self.registrations, name)
+        if name.startswith('get'):
+            def _wrapper(*args, **kw):
+                self._calls.append((name,) + args)
+                return attr(*args, **kw)
+            return _wrapper
+        return attr
+
+    def __iter__(self):
+        return iter(self.registrations)
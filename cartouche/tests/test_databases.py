@@ -0,0 +1,195 @@
+##############################################################################
+#
+# Copyright (c) 2010 Agendaless Consulting and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+import unittest
+
+_URI = 'memory://?database_name=cartouche_tests'
+
+
+class _Base(object):
+
+    def tearDown(self):
+        from cartouche import databases
+        entry = databases._databases.pop(_URI, None)
+        if entry is not None:
+            entry[0].close()
+
+
+class Test_get_db(_Base, unittest.TestCase):
+
+    def _callFUT(self, zodb_uri=_URI):
+        from cartouche.databases import get_db
+        return get_db(zodb_uri)
+
+    def test_same_uri_returns_same_db(self):
+        db = self._callFUT()
+        self.assertTrue(self._callFUT() is db)
+
+    def test_after_close_db_opens_new_db(self):
+        from cartouche.databases import close_db
+        db = self._callFUT()
+        close_db(_URI)
+        self.assertFalse(self._callFUT() is db)
+
+    def test_close_db_keeps_db_referenced_elsewhere(self):
+        from cartouche.databases import close_db
+        db = self._callFUT()
+        self.assertTrue(self._callFUT() is db)
+        close_db(_URI)
+        self.assertTrue(self._callFUT() is db)
+
+
+class Test_close_db(_Base, unittest.TestCase):
+
+    def _callFUT(self, zodb_uri=_URI):
+        from cartouche.databases import close_db
+        return close_db(zodb_uri)
+
+    def test_not_opened(self):
+        self._callFUT('memory://?database_name=nonesuch') # no raise
+
+
+class SharedApplicationFinderTests(_Base, unittest.TestCase):
+
+    def _getTargetClass(self):
+        from cartouche.databases import SharedApplicationFinder
+        return SharedApplicationFinder
+
+    def _makeOne(self, appmaker=None):
+        if appmaker is None:
+            appmaker = lambda root: root
+        return self._getTargetClass()(_URI, appmaker)
+
+    def test_finders_share_db(self):
+        from cartouche.databases import get_db
+        first, second = self._makeOne(), self._makeOne()
+        self.assertTrue(first.db is second.db)
+        self.assertTrue(first.db is get_db(_URI))
+
+    def test_opens_connection_once_per_environ(self):
+        from repoze.zodbconn.finder import CLOSER_KEY
+        from cartouche.databases import CONNECTION_KEY
+        first, second = self._makeOne(), self._makeOne()
+        environ = {}
+        root = first(environ)
+        conn = environ[CONNECTION_KEY]
+        self.assertTrue(CLOSER_KEY in environ)
+        self.assertTrue(second(environ) is root)
+        self.assertTrue(environ[CONNECTION_KEY] is conn)
+        del environ[CLOSER_KEY]
+        self.assertTrue(conn.opened is None)
+
+    def test_finders_for_other_db_open_own_connection(self):
+        from repoze.zodbconn.finder import CLOSER_KEY
+        from cartouche.databases import CONNECTION_KEY
+        OTHER = 'memory://?database_name=cartouche_other'
+        first = self._makeOne()
+        other = self._getTargetClass()(OTHER, lambda root: root)
+        try:
+            environ = {}
+            root = first(environ)
+            conn = environ[CONNECTION_KEY]
+            other_root = other(environ)
+            self.assertFalse(other_root is root)
+            other_conn = environ['%s:%s' % (CONNECTION_KEY, OTHER)]
+            self.assertTrue(other_conn.db() is other.db)
+            self.assertTrue(other(environ) is other_root)
+            self.assertTrue(first(environ) is root)
+            self.assertTrue(environ[CONNECTION_KEY] is conn)
+            self.assertEqual(sorted([x for x in environ
+                                        if x.startswith(CLOSER_KEY)]),
+                             [CLOSER_KEY])
+            # Removing the closer (e.g. the 'repoze.zodbconn' closer
+            # middleware) closes both connections.
+            del environ[CLOSER_KEY]
+            self.assertTrue(conn.opened is None)
+            self.assertTrue(other_conn.opened is None)
+        finally:
+            other.close()
+
+    def test_concurrent_first_use_takes_one_reference(self):
+        import threading
+        from cartouche import databases
+        finder = self._makeOne()
+        opened = []
+        real_get_db = databases.get_db
+        def slow_get_db(uri):
+            opened.append(uri)
+            threading.Event().wait(0.05)
+            return real_get_db(uri)
+        databases.get_db = slow_get_db
+        try:
+            threads = [threading.Thread(target=lambda: finder.db)
+                       for i in range(3)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            databases.get_db = real_get_db
+        self.assertEqual(opened, [_URI])
+        finder.close()
+        self.assertFalse(_URI in databases._databases)
+
+    def test_close_releases_db(self):
+        from cartouche.databases import get_db
+        finder = self._makeOne()
+        db = finder.db
+        other = get_db(_URI)
+        self.assertTrue(other is db)
+        finder.close()
+        self.assertTrue(get_db(_URI) is db)  # still referenced
+        finder.close()  # no-op:  already released
+
+    def test_uses_zodbconn_connection_in_environ(self):
+        from repoze.zodbconn.connector import CONNECTION_KEY
+        ROOT = object()
+        class DummyConnection(object):
+            def root(self):
+                return ROOT
+        environ = {CONNECTION_KEY: DummyConnection()}
+        finder = self._makeOne()
+        self.assertTrue(finder(environ) is ROOT)
+        self.assertEqual(len(environ), 1)
+
+
+class Test_closeConnections(_Base, unittest.TestCase):
+
+    def _callFUT(self, environ):
+        from cartouche.databases import closeConnections
+        return closeConnections(environ)
+
+    def test_empty(self):
+        environ = {}
+        self._callFUT(environ)
+        self.assertEqual(environ, {})
+
+    def test_closes_connections_opened_by_finders(self):
+        from cartouche.databases import SharedApplicationFinder
+        OTHER = 'memory://?database_name=cartouche_other'
+        first = SharedApplicationFinder(_URI, lambda root: root)
+        other = SharedApplicationFinder(OTHER, lambda root: root)
+        try:
+            environ = {'REQUEST_METHOD': 'GET'}
+            first(environ)
+            other(environ)
+            conns = [environ[key] for key in environ
+                        if key.startswith('cartouche.connection')]
+            self.assertEqual(len(conns), 2)
+            self._callFUT(environ)
+            self.assertEqual(environ, {'REQUEST_METHOD': 'GET'})
+            for conn in conns:
+                self.assertTrue(conn.opened is None)
+        finally:
+            other.close()
+            first.close()
@@ -0,0 +1,165 @@
+##############################################################################
+#
+# Copyright (c) 2010 Agendaless Consulting and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+import unittest
+
+
+class Test_recordToDict(unittest.TestCase):
+
+    def _callFUT(self, key, record):
+        from cartouche.export import recordToDict
+        return recordToDict(key, record)
+
+    def test_confirmed(self):
+        from cartouche.models import RegistrationInfo
+        record = RegistrationInfo('UUID', 'phred@example.com', 'login',
+                                  'password', 'question', 'answer', 'token')
+        result = self._callFUT('UUID', record)
+        self.assertEqual(result, {'key': 'UUID',
+                                  'uuid': 'UUID',
+                                  'email': 'phred@example.com',
+                                  'login': 'login',
+                                  'password': 'password',
+                                  'security_question': 'question',
+                                  'security_answer': 'answer',
+                                  'token': 'token',
+                                  'token_expires': None,
+                                 })
+
+    def test_pending(self):
+        from cartouche.models import PendingRegistrationInfo
+        record = PendingRegistrationInfo('phred@example.com', 'token', 1.0)
+        result = self._callFUT('phred@example.com', record)
+        self.assertEqual(result, {'key': 'phred@example.com',
+                                  'email': 'phred@example.com',
+                                  'token': 'token',
+                                  'created': 1.0,
+                                 })
+
+    def test_w_exclude(self):
+        from cartouche.export import recordToDict
+        from cartouche.models import PendingRegistrationInfo
+        record = PendingRegistrationInfo('phred@example.com', 'token', 1.0)
+        result = recordToDict('phred@example.com', record, ('token',))
+        self.assertEqual(result, {'key': 'phred@example.com',
+                                  'email': 'phred@example.com',
+                                  'created': 1.0,
+                                 })
+
+    def test_unknown_uses_all_fields(self):
+        result = self._callFUT('KEY', object())
+        self.assertEqual(result['key'], 'KEY')
+        self.assertEqual(result['login'], None)
+        self.assertEqual(result['created'], None)
+
+
+class Test_exportLines(unittest.TestCase):
+
+    def _callFUT(self, registrations, *args, **kw):
+        from cartouche.export import exportLines
+        return list(exportLines(registrations, *args, **kw))
+
+    def _makeRegistrations(self, count):
+        from pyramid.testing import DummyModel
+        from cartouche.persistence import PendingRegistrations
+        pending = PendingRegistrations(DummyModel())
+        for i in range(count):
+            pending.set('%d@example.com' % i, token='token', created=float(i))
+        return pending
+
+    def test_empty(self):
+        self.assertEqual(self._callFUT(self._makeRegistrations(0)), [])
+
+    def test_batches_in_key_order(self):
+        import json
+        pending = self._makeRegistrations(5)
+        minimized = []
+
+        result = self._callFUT(pending, batch_size=2,
+                               minimize=lambda: minimized.append(1))
+
+        self.assertEqual([key for key, line in result],
+                         ['%d@example.com' % i for i in range(5)])
+        self.assertEqual(len(minimized), 3)
+        for key, line in result:
+            self.assertTrue(line.endswith('\n'))
+            self.assertEqual(json.loads(line)['email'], key)
+
+    def test_resumes_after_key_w_limit(self):
+        pending = self._makeRegistrations(5)
+
+        result = self._callFUT(pending, '1@example.com', 2, batch_size=1)
+
+        self.assertEqual([key for key, line in result],
+                         ['2@example.com', '3@example.com'])
+
+    def test_deactivates_records(self):
+        deactivated = []
+        class _Record(object):
+            email = 'phred@example.com'
+            def _p_deactivate(self):
+                deactivated.append(self)
+        record = _Record()
+        class _Registrations(object):
+            def page(self, after=None, size=20):
+                if after is None:
+                    return [('phred@example.com', record)]
+                return []
+
+        self._callFUT(_Registrations())
+
+        self.assertEqual(deactivated, [record])
+
+    def test_deactivates_profiles(self):
+        deactivated = []
+        class _Persistent(object):
+            def _p_deactivate(self):
+                deactivated.append(self)
+        profile = _Persistent()
+        record = _Persistent()
+        record.email = 'phred@example.com'
+        record.profile = profile
+        class _Registrations(object):
+            def page(self, after=None, size=20):
+                if after is None:
+                    return [('phred@example.com', record)]
+                return []
+
+        self._callFUT(_Registrations())
+
+        self.assertEqual(deactivated, [profile, record])
+
+    def test_w_exclude_profile_fields_doesnt_load_profile(self):
+        import json
+        from cartouche.export import PROFILE_FIELDS
+        from cartouche.interfaces import IRegistrationInfo
+        from zope.interface import implementer
+        @implementer(IRegistrationInfo)
+        class _Record(object):
+            uuid = login = email = 'phred@example.com'
+            password = token = token_expires = None
+            @property
+            def security_question(self):
+                raise AssertionError('profile loaded')
+            security_answer = security_question
+        class _Registrations(object):
+            def page(self, after=None, size=20):
+                if after is None:
+                    return [('phred@example.com', _Record())]
+                return []
+
+        result = self._callFUT(_Registrations(), exclude=PROFILE_FIELDS)
+
+        record = json.loads(result[0][1])
+        self.assertFalse('security_question' in record)
+        self.assertFalse('security_answer' in record)
@@ -52,6 +52,14 @@ class _Base(object):
                 if uuid is None:
                     return default
                 return by_uuid.get(uuid, default)
+            def get_by_token(self, token, default=None):
+                from time import time
+                for record in by_uuid.values():
+                    if getattr(record, 'token', None) == token:
+                        expires = getattr(record, 'token_expires', None)
+                        if expires is None or expires > time():
+                            return record
+                return default
             def set(self, key, **kw):
                 old_record = by_uuid.get(key)
                 if old_record is not None:
@@ -61,6 +69,13 @@ class _Base(object):
                 by_uuid[key] = record
                 by_login[record.login] = key
                 by_email[record.email] = key
+            def update(self, key, **changes):
+                record = by_uuid[key]
+                del by_login[record.login]
+                del by_email[record.email]
+                record.__dict__.update(changes)
+                by_login[record.login] = key
+                by_email[record.email] = key
             def remove(self, key):
                 info = by_uuid[key]
                 del by_uuid[key]
@@ -566,6 +581,98 @@ class Test_reset_password(_Base, unittest.TestCase):
         self.assertEqual(delivery._sent[2]['Subject'],
                          'Password reset confirmation')
         self.assertTrue(reset_url in delivery._sent[2].get_payload())
+        self.assertEqual(by_uuid['UUID'].token_expires, None)
+
+    def test_POST_w_valid_login_no_token_w_token_ttl(self):
+        from time import time
+        from repoze.sendmail.interfaces import IMailDelivery
+
+        FROM_EMAIL = 'admin@example.com'
+        TO_EMAIL = 'phred@example.com'
+        POST = {'login_name': 'login', 'token': '', 'reset': ''}
+        self.config.registry.settings['cartouche.from_addr'] = FROM_EMAIL
+        self.config.registry.settings['cartouche.token_ttl'] = '3600'
+        delivery = DummyMailer()
+        self.config.registry.registerUtility(delivery, IMailDelivery)
+        by_uuid, by_login, by_email = self._registerConfirmed()
+        by_uuid['UUID'] = Dummy(uuid='UUID',
+                                email=TO_EMAIL,
+                                login='login',
+                                password='password',
+                                security_question='question',
+                                security_answer='answer',
+                               )
+        by_email[TO_EMAIL] = 'UUID'
+        by_login['login'] = 'UUID'
+        context = self._makeContext()
+        request = self._makeRequest(POST=POST, view_name='reset_pasword.html')
+        before = time()
+
+        self._callFUT(context, request)
+
+        expires = by_uuid['UUID'].token_expires
+        self.assertTrue(before + 3600 <= expires <= time() + 3600)
+
+    def test_POST_w_valid_login_w_token_expired(self):
+        from time import time
+        from repoze.sendmail.interfaces import IMailDelivery
+        from cartouche.login import CHECK_TOKEN
+
+        TO_EMAIL = 'phred@example.com'
+        POST = {'login_name': 'login', 'token': 'token', 'reset': ''}
+        delivery = DummyMailer()
+        self.config.registry.registerUtility(delivery, IMailDelivery)
+        by_uuid, by_login, by_email = self._registerConfirmed()
+        by_uuid['UUID'] = Dummy(uuid='UUID',
+                                email=TO_EMAIL,
+                                login='login',
+                                password='password',
+                                security_question='question',
+                                security_answer='answer',
+                                token='token',
+                                token_expires=time() - 1,
+                               )
+        by_email[TO_EMAIL] = 'UUID'
+        by_login['login'] = 'UUID'
+        context = self._makeContext()
+        request = self._makeRequest(POST=POST, view_name='reset_pasword.html')
+
+        info = self._callFUT(context, request)
+
+        self.assertEqual(info['message'], CHECK_TOKEN)
+        self.assertEqual(by_uuid['UUID'].password, 'password')
+
+    def test_POST_w_valid_login_w_other_users_token(self):
+        from repoze.sendmail.interfaces import IMailDelivery
+        from cartouche.login import CHECK_TOKEN
+
+        POST = {'login_name': 'login', 'token': 'other', 'reset': ''}
+        delivery = DummyMailer()
+        self.config.registry.registerUtility(delivery, IMailDelivery)
+        by_uuid, by_login, by_email = self._registerConfirmed()
+        by_uuid['UUID'] = Dummy(uuid='UUID',
+                                email='phred@example.com',
+                                login='login',
+                                password='password',
+                                security_question='question',
+                                security_answer='answer',
+                                token='token',
+                               )
+        by_uuid['OTHER'] = Dummy(uuid='OTHER',
+                                 email='bharney@example.com',
+                                 login='other',
+                                 password='password',
+                                 security_question='question',
+                                 security_answer='answer',
+                                 token='other',
+                                )
+        context = self._makeContext()
+        request = self._makeRequest(POST=POST, view_name='reset_pasword.html')
+        by_login['login'] = 'UUID'
+
+        info = self._callFUT(context, request)
+
+        self.assertEqual(info['message'], CHECK_TOKEN)
 
     def test_POST_w_valid_login_w_token_mismatch(self):
         from repoze.sendmail.interfaces import IMailDelivery
@@ -627,6 +734,44 @@ class Test_reset_password(_Base, unittest.TestCase):
         for key, value in api.LOGIN_HEADERS:
             self.assertEqual(response.headers[key], value)
 
+    def test_POST_w_valid_login_w_token_not_indexed(self):
+        from webob.exc import HTTPFound
+        from cartouche.interfaces import IRegistrations
+        self._registerAutoLogin()
+        TO_EMAIL = 'phred@example.com'
+        POST = {'login_name': 'login', 'token': 'token', 'reset': ''}
+        record = Dummy(uuid='UUID',
+                       email=TO_EMAIL,
+                       login='login',
+                       password='password',
+                       security_question='question',
+                       security_answer='answer',
+                       token='token',
+                      )
+        updated = []
+        class LegacyConfirmed(object):
+            # Issued before the token index:  'get_by_token' misses.
+            def __init__(self, context):
+                pass
+            def get_by_login(self, login, default=None):
+                return record
+            def get_by_token(self, token, default=None):
+                return default
+            def update(self, key, **kw):
+                updated.append((key, kw))
+        self.config.registry.registerAdapter(LegacyConfirmed, (None,),
+                                             IRegistrations, 'confirmed')
+        context = self._makeContext()
+        api = FauxAPI()
+        request = self._makeRequest(POST=POST,
+                                   environ={'repoze.who.api': api})
+
+        response = self._callFUT(context, request)
+
+        self.assertTrue(isinstance(response, HTTPFound))
+        self.assertEqual(updated[0][0], 'UUID')
+        self.assertEqual(updated[0][1]['token'], None)
+
     def test_POST_w_valid_login_w_token_match_no_auto_login(self):
         from repoze.sendmail.interfaces import IMailDelivery
         from webob.exc import HTTPFound
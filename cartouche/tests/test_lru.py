@@ -0,0 +1,70 @@
+##############################################################################
+#
+# Copyright (c) 2010 Agendaless Consulting and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+import unittest
+
+
+class LRUCacheTests(unittest.TestCase):
+
+    _now = 1000.0
+
+    def _getTargetClass(self):
+        from cartouche.lru import LRUCache
+        return LRUCache
+
+    def _makeOne(self, maxsize=3, ttl=None):
+        return self._getTargetClass()(maxsize, ttl, timer=lambda: self._now)
+
+    def test_get_miss(self):
+        cache = self._makeOne()
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.get('a', 'default'), 'default')
+        self.assertEqual(cache.misses, 2)
+        self.assertEqual(cache.hits, 0)
+
+    def test_set_then_get_hit(self):
+        cache = self._makeOne()
+        cache.set('a', 'A')
+        self.assertEqual(cache.get('a'), 'A')
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(len(cache), 1)
+
+    def test_evicts_least_recently_used(self):
+        cache = self._makeOne(maxsize=2)
+        cache.set('a', 'A')
+        cache.set('b', 'B')
+        cache.get('a')
+        cache.set('c', 'C')
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), 'A')
+        self.assertEqual(cache.get('c'), 'C')
+        self.assertEqual(len(cache), 2)
+
+    def test_expired_entries_miss(self):
+        cache = self._makeOne(ttl=10)
+        cache.set('a', 'A')
+        self._now += 9
+        self.assertEqual(cache.get('a'), 'A')
+        self._now += 1
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(len(cache), 0)
+
+    def test_remove_and_clear(self):
+        cache = self._makeOne()
+        cache.set('a', 'A')
+        cache.set('b', 'B')
+        cache.remove('a')
+        cache.remove('nonesuch')
+        self.assertEqual(cache.get('a'), None)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
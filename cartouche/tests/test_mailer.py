@@ -0,0 +1,271 @@
+##############################################################################
+#
+# Copyright (c) 2010 Agendaless Consulting and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+import unittest
+
+
+class PooledSMTPMailerTests(unittest.TestCase):
+
+    def setUp(self):
+        self._now = [1000.0]
+
+    def _getTargetClass(self):
+        from cartouche.mailer import PooledSMTPMailer
+        return PooledSMTPMailer
+
+    def _makeOne(self, **kw):
+        kw.setdefault('timer', lambda: self._now[0])
+        mailer = self._getTargetClass()(**kw)
+        opened = self._opened = []
+        def _factory():
+            smtp = FauxSMTP()
+            opened.append(smtp)
+            return smtp
+        mailer.smtp_factory = _factory
+        return mailer
+
+    def _makeMessage(self):
+        from email.message import Message
+        message = Message()
+        message['Subject'] = 'Hello'
+        message.set_payload('Body')
+        return message
+
+    def test_not_a_message(self):
+        from repoze.sendmail.delivery import NotAnEmailMessage
+        mailer = self._makeOne()
+        self.assertRaises(NotAnEmailMessage,
+                          mailer.send, 'from@example.com', ['to@example.com'],
+                          'bogus')
+
+    def test_reuses_connection(self):
+        mailer = self._makeOne()
+        for i in range(5):
+            mailer.send('from@example.com', ['to@example.com'],
+                        self._makeMessage())
+
+        self.assertEqual(len(self._opened), 1)
+        self.assertEqual(len(self._opened[0].sent), 5)
+        self.assertEqual(self._opened[0].ehlos, 1)
+        stats = mailer.stats()
+        self.assertEqual(stats['sent'], 5)
+        self.assertEqual(stats['connections_opened'], 1)
+        self.assertEqual(stats['idle'], 1)
+
+    def test_replaces_connection_after_max_messages(self):
+        mailer = self._makeOne(max_messages=2)
+        for i in range(5):
+            mailer.send('from@example.com', ['to@example.com'],
+                        self._makeMessage())
+
+        self.assertEqual([len(x.sent) for x in self._opened], [2, 2, 1])
+        self.assertTrue(self._opened[0].quitted)
+        self.assertFalse(self._opened[2].quitted)
+
+    def test_replaces_idle_connection_after_timeout(self):
+        mailer = self._makeOne(idle_timeout=30)
+        mailer.send('from@example.com', ['to@example.com'],
+                    self._makeMessage())
+        self._now[0] += 31
+        mailer.send('from@example.com', ['to@example.com'],
+                    self._makeMessage())
+
+        self.assertEqual(len(self._opened), 2)
+        self.assertTrue(self._opened[0].quitted)
+
+    def test_reconnects_once_if_dropped(self):
+        import smtplib
+        mailer = self._makeOne()
+        mailer.send('from@example.com', ['to@example.com'],
+                    self._makeMessage())
+        self._opened[0].error = smtplib.SMTPServerDisconnected('gone')
+
+        mailer.send('from@example.com', ['to@example.com'],
+                    self._makeMessage())
+
+        self.assertEqual(len(self._opened), 2)
+        self.assertEqual(len(self._opened[1].sent), 1)
+        self.assertEqual(mailer.stats()['reconnects'], 1)
+        self.assertEqual(mailer.stats()['sent'], 2)
+
+    def test_fresh_connection_dropped_raises(self):
+        import smtplib
+        mailer = self._makeOne()
+        mailer.smtp_factory = lambda: FauxSMTP(
+                                smtplib.SMTPServerDisconnected('gone'))
+        self.assertRaises(smtplib.SMTPServerDisconnected,
+                          mailer.send, 'from@example.com', ['to@example.com'],
+                          self._makeMessage())
+        self.assertEqual(mailer.stats()['failed'], 1)
+        self.assertEqual(mailer.stats()['idle'], 0)
+
+    def test_refused_keeps_connection_after_reset(self):
+        import smtplib
+        mailer = self._makeOne()
+        mailer.send('from@example.com', ['to@example.com'],
+                    self._makeMessage())
+        smtp = self._opened[0]
+        smtp.error = smtplib.SMTPRecipientsRefused({})
+
+        self.assertRaises(smtplib.SMTPRecipientsRefused,
+                          mailer.send, 'from@example.com', ['to@example.com'],
+                          self._makeMessage())
+
+        self.assertEqual(smtp.resets, 1)
+        smtp.error = None
+        mailer.send('from@example.com', ['to@example.com'],
+                    self._makeMessage())
+        self.assertEqual(len(self._opened), 1)
+        self.assertEqual(mailer.stats()['failed'], 1)
+
+    def test_keeps_at_most_max_idle(self):
+        mailer = self._makeOne(max_idle=1)
+        first = mailer._checkout()
+        second = mailer._checkout()
+        first.sent = second.sent = 1
+        mailer._checkin(first)
+        mailer._checkin(second)
+
+        self.assertEqual(mailer.stats()['idle'], 1)
+        self.assertTrue(self._opened[1].quitted)
+
+    def test_close(self):
+        mailer = self._makeOne()
+        mailer.send('from@example.com', ['to@example.com'],
+                    self._makeMessage())
+        mailer.close()
+        self.assertTrue(self._opened[0].quitted)
+        self.assertEqual(mailer.stats()['idle'], 0)
+
+    def test_stats_rate(self):
+        mailer = self._makeOne()
+        self.assertEqual(mailer.stats()['rate'], 0.0)
+        for i in range(4):
+            mailer.send('from@example.com', ['to@example.com'],
+                        self._makeMessage())
+        self._now[0] += 2
+        self.assertEqual(mailer.stats()['rate'], 2.0)
+
+    def test_against_local_server(self):
+        from cartouche.mailer import PooledSMTPMailer
+        server = LocalSMTPServer()
+        try:
+            mailer = PooledSMTPMailer(port=server.port, no_tls=True)
+            for i in range(3):
+                mailer.send('from@example.com', ['%d@example.com' % i],
+                            self._makeMessage())
+            mailer.close()
+        finally:
+            server.stop()
+        self.assertEqual(server.connections, 1)
+        self.assertEqual([to for fromaddr, to, data in server.received],
+                         [['0@example.com'], ['1@example.com'],
+                          ['2@example.com']])
+        self.assertTrue(b'Subject: Hello' in server.received[0][2])
+
+
+class FauxSMTP(object):
+    does_esmtp = True
+    quitted = False
+
+    def __init__(self, error=None):
+        self.error = error
+        self.sent = []
+        self.ehlos = self.resets = 0
+
+    def ehlo(self):
+        self.ehlos += 1
+        return 250, 'OK'
+
+    def has_extn(self, name):
+        return False
+
+    def sendmail(self, fromaddr, toaddrs, message):
+        if self.error is not None:
+            raise self.error
+        self.sent.append((fromaddr, toaddrs, message))
+
+    def rset(self):
+        self.resets += 1
+
+    def quit(self):
+        self.quitted = True
+
+    def close(self):
+        pass
+
+
+class LocalSMTPServer(object):
+    """ Minimal SMTP server on a free local port, recording what it gets.
+    """
+    def __init__(self):
+        import socketserver
+        import threading
+        self.received = []
+        self.connections = 0
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                server.connections += 1
+                self._reply('220 localhost ready')
+                fromaddr, toaddrs = None, []
+                while True:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    command = line.strip().decode('ascii')
+                    verb = command.split(' ', 1)[0].split(':', 1)[0].upper()
+                    if verb in ('EHLO', 'HELO'):
+                        self._reply('250 localhost')
+                    elif verb == 'MAIL':
+                        fromaddr = command.split(':', 1)[1].strip('<> ')
+                        self._reply('250 OK')
+                    elif verb == 'RCPT':
+                        toaddrs.append(command.split(':', 1)[1].strip('<> '))
+                        self._reply('250 OK')
+                    elif verb == 'DATA':
+                        self._reply('354 Go ahead')
+                        data = []
+                        for line in iter(self.rfile.readline, b''):
+                            if line.rstrip(b'\r\n') == b'.':
+                                break
+                            data.append(line)
+                        server.received.append(
+                            (fromaddr, toaddrs, b''.join(data)))
+                        fromaddr, toaddrs = None, []
+                        self._reply('250 OK')
+                    elif verb in ('RSET', 'NOOP'):
+                        self._reply('250 OK')
+                    elif verb == 'QUIT':
+                        self._reply('221 Bye')
+                        return
+                    else:
+                        self._reply('502 Unknown')
+
+            def _reply(self, text):
+                self.wfile.write(text.encode('ascii') + b'\r\n')
+
+        class Server(socketserver.ThreadingMixIn, socketserver.TCPServer):
+            daemon_threads = True
+
+        self._server = Server(('127.0.0.1', 0), Handler)
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
@@ -0,0 +1,254 @@
+##############################################################################
+#
+# Copyright (c) 2010 Agendaless Consulting and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+import unittest
+
+
+class Test_mailerFromSettings(unittest.TestCase):
+
+    def _callFUT(self, settings):
+        from cartouche.mailqueue import mailerFromSettings
+        return mailerFromSettings(settings)
+
+    def test_defaults(self):
+        mailer = self._callFUT({})
+        self.assertEqual(mailer.hostname, 'localhost')
+        self.assertEqual(mailer.port, 25)
+        self.assertEqual(mailer.username, None)
+        self.assertFalse(mailer.no_tls)
+
+    def test_w_settings(self):
+        mailer = self._callFUT({'cartouche.smtp_host': 'smtp.example.com',
+                                'cartouche.smtp_port': '587',
+                                'cartouche.smtp_username': 'user',
+                                'cartouche.smtp_password': 'secret',
+                                'cartouche.smtp_force_tls': 'true',
+                               })
+        self.assertEqual(mailer.hostname, 'smtp.example.com')
+        self.assertEqual(mailer.port, 587)
+        self.assertEqual(mailer.username, 'user')
+        self.assertEqual(mailer.password, 'secret')
+        self.assertTrue(mailer.force_tls)
+
+
+class MailQueueRunnerTests(unittest.TestCase):
+
+    _tempdir = None
+
+    def setUp(self):
+        from tempfile import mkdtemp
+        self._tempdir = mkdtemp('mailqueuetests')
+        self._now = [1000000.0]
+
+    def tearDown(self):
+        import shutil
+        import transaction
+        transaction.abort()
+        shutil.rmtree(self._tempdir)
+
+    def _getTargetClass(self):
+        from cartouche.mailqueue import MailQueueRunner
+        return MailQueueRunner
+
+    def _getQueuePath(self):
+        import os
+        return os.path.join(self._tempdir, 'queue')
+
+    def _makeOne(self, mailer=None, **kw):
+        if mailer is None:
+            mailer = DummyMailer()
+        kw.setdefault('timer', lambda: self._now[0])
+        return self._getTargetClass()(mailer, self._getQueuePath(), **kw)
+
+    def _queue(self, *recipients):
+        # Queue a message per recipient, as the views would.
+        import os
+        from email.message import Message
+        import transaction
+        from repoze.sendmail.delivery import QueuedMailDelivery
+        delivery = QueuedMailDelivery(self._getQueuePath())
+        for recipient in recipients:
+            message = Message()
+            message['Subject'] = 'Hello %s' % recipient
+            message.set_payload('Body')
+            delivery.send('from@example.com', [recipient], message)
+        transaction.commit()
+        # Backdate the files, so that they are due under our fake timer.
+        new = os.path.join(self._getQueuePath(), 'new')
+        for i, name in enumerate(sorted(os.listdir(new))):
+            path = os.path.join(new, name)
+            os.utime(path, (self._now[0] - 100 + i, self._now[0] - 100 + i))
+
+    def _listdir(self, *names):
+        import os
+        return sorted(os.listdir(os.path.join(self._getQueuePath(), *names)))
+
+    def test_empty_queue(self):
+        runner = self._makeOne()
+        self.assertEqual(runner.run(), {'sent': 0, 'retry': 0, 'dead': 0})
+        self.assertEqual(self._listdir(), ['.dead', 'cur', 'new', 'tmp'])
+
+    def test_sends_in_parallel(self):
+        mailer = DummyMailer()
+        runner = self._makeOne(mailer, workers=3)
+        recipients = ['%d@example.com' % i for i in range(10)]
+        self._queue(*recipients)
+
+        self.assertEqual(runner.run(), {'sent': 10, 'retry': 0, 'dead': 0})
+
+        self.assertEqual(sorted([to for fromaddr, to, message
+                                    in mailer.sent]),
+                         [(x,) for x in sorted(recipients)])
+        fromaddr, toaddrs, message = mailer.sent[0]
+        self.assertEqual(fromaddr, 'from@example.com')
+        self.assertEqual(message['X-Actually-To'], None)
+        self.assertTrue(message['Subject'].startswith('Hello'))
+        self.assertEqual(self._listdir('new'), [])
+        self.assertEqual(self._listdir('cur'), [])
+
+    def test_transient_failure_retried_with_backoff(self):
+        import socket
+        mailer = DummyMailer(socket.error('connection refused'))
+        runner = self._makeOne(mailer, backoff=10, workers=1)
+        self._queue('phred@example.com')
+
+        self.assertEqual(runner.run(), {'sent': 0, 'retry': 1, 'dead': 0})
+        self.assertEqual(self._listdir('new'), [])
+        name, = self._listdir('cur')
+        self.assertTrue(name.endswith('.retry1'))
+
+        # Not yet due.
+        self._now[0] += 9
+        self.assertEqual(runner.run(), {'sent': 0, 'retry': 0, 'dead': 0})
+
+        self._now[0] += 1
+        self.assertEqual(runner.run(), {'sent': 0, 'retry': 1, 'dead': 0})
+        name, = self._listdir('cur')
+        self.assertTrue(name.endswith('.retry2'))
+
+        # The second retry waits twice as long.
+        self._now[0] += 19
+        self.assertEqual(runner.due(), [])
+        self._now[0] += 1
+        mailer.error = None
+        self.assertEqual(runner.run(), {'sent': 1, 'retry': 0, 'dead': 0})
+        self.assertEqual(self._listdir('cur'), [])
+
+    def test_too_many_attempts_dead_lettered(self):
+        import socket
+        mailer = DummyMailer(socket.error('connection refused'))
+        runner = self._makeOne(mailer, backoff=0, max_attempts=2)
+        self._queue('phred@example.com')
+
+        self.assertEqual(runner.run(), {'sent': 0, 'retry': 1, 'dead': 0})
+        self.assertEqual(runner.run(), {'sent': 0, 'retry': 0, 'dead': 1})
+
+        self.assertEqual(self._listdir('cur'), [])
+        name, = self._listdir('.dead')
+        self.assertFalse('.retry' in name)
+
+    def test_permanent_failure_dead_lettered(self):
+        import os
+        import smtplib
+        mailer = DummyMailer(smtplib.SMTPResponseException(550, 'No such'))
+        dead = os.path.join(self._tempdir, 'dead')
+        runner = self._makeOne(mailer, dead_letter_path=dead)
+        self._queue('phred@example.com')
+
+        self.assertEqual(runner.run(), {'sent': 0, 'retry': 0, 'dead': 1})
+
+        self.assertEqual(len(os.listdir(dead)), 1)
+        self.assertEqual(self._listdir('new'), [])
+
+    def test_transient_smtp_response_retried(self):
+        import smtplib
+        mailer = DummyMailer(smtplib.SMTPResponseException(451, 'Later'))
+        runner = self._makeOne(mailer)
+        self._queue('phred@example.com')
+
+        self.assertEqual(runner.run(), {'sent': 0, 'retry': 1, 'dead': 0})
+
+    def test_process_already_claimed(self):
+        import os
+        runner = self._makeOne()
+        self._queue('phred@example.com')
+        path, = runner.due()
+        os.remove(path)
+
+        self.assertEqual(runner.process(path), None)
+
+    def test_recovers_stale_claims(self):
+        import os
+        runner = self._makeOne()
+        self._queue('phred@example.com', 'bharney@example.com')
+        stale, fresh = runner.due()
+        for path, age in ((stale, 4 * 60 * 60), (fresh, 60)):
+            directory, name = os.path.split(path)
+            claimed = os.path.join(directory, '.sending-' + name)
+            os.rename(path, claimed)
+            when = self._now[0] - age
+            os.utime(claimed, (when, when))
+
+        self.assertEqual(runner.run(), {'sent': 1, 'retry': 0, 'dead': 0})
+        name, = self._listdir('new')
+        self.assertTrue(name.startswith('.sending-'))
+
+    def test_claim_of_old_message_not_recovered_while_sending(self):
+        import os
+        self._queue('phred@example.com')
+        path, = self._makeOne().due()
+        old = self._now[0] - 4 * 60 * 60
+        os.utime(path, (old, old))
+        other = self._makeOne()
+        class RecoveringMailer(DummyMailer):
+            # Another runner starts up while the message is being sent.
+            def send(self, fromaddr, toaddrs, message):
+                other.recoverStaleClaims()
+                DummyMailer.send(self, fromaddr, toaddrs, message)
+        mailer = RecoveringMailer()
+        runner = self._makeOne(mailer)
+
+        self.assertEqual(runner.process(path), 'sent')
+        self.assertEqual(len(mailer.sent), 1)
+        self.assertEqual(self._listdir('new'), [])
+        self.assertEqual(other.run(), {'sent': 0, 'retry': 0, 'dead': 0})
+
+    def test_claimed_file_gone_after_sending(self):
+        import os
+        self._queue('phred@example.com')
+        path, = self._makeOne().due()
+        directory, name = os.path.split(path)
+        class RequeuedMailer(DummyMailer):
+            def send(self, fromaddr, toaddrs, message):
+                DummyMailer.send(self, fromaddr, toaddrs, message)
+                os.remove(os.path.join(directory, '.sending-' + name))
+        mailer = RequeuedMailer()
+        runner = self._makeOne(mailer)
+
+        self.assertEqual(runner.process(path), 'sent')
+        self.assertEqual(len(mailer.sent), 1)
+
+
+class DummyMailer(object):
+
+    def __init__(self, error=None):
+        from threading import Lock
+        self.error = error
+        self.sent = []
+        self._lock = Lock()
+
+    def send(self, fromaddr, toaddrs, message):
+        if self.error is not None:
+            raise self.error
+        with self._lock:
+            self.sent.append((fromaddr, toaddrs, message))
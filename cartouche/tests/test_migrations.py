@@ -0,0 +1,162 @@
+##############################################################################
+#
+# Copyright (c) 2010 Agendaless Consulting and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+import unittest
+
+
+class Test_compact_ids(unittest.TestCase):
+
+    def _callFUT(self, root, commit=None, batch_size=2):
+        from cartouche.migrations import compact_ids
+        return compact_ids(root, commit, batch_size)
+
+    def _makeRoot(self):
+        from pyramid.testing import DummyModel
+        from cartouche.persistence import ConfirmedRegistrations
+        from cartouche.persistence import Groups
+        root = DummyModel()
+        confirmed = ConfirmedRegistrations(root)
+        for i in range(3):
+            confirmed.set('UUID%d' % i, email='%d@example.com' % i,
+                          login='login%d' % i, password='password',
+                          token='token%d' % i, token_expires=1000.0)
+        groups = Groups(root)
+        groups.add('UUID0', 'g:admin')
+        groups.add('UUID1', 'g:admin')
+        groups.add('GONE', 'g:admin')
+        return root
+
+    def test_no_cartouche(self):
+        from pyramid.testing import DummyModel
+        self.assertEqual(self._callFUT(DummyModel()), 0)
+
+    def test_migrates_records_and_groups(self):
+        from cartouche.persistence import CompactConfirmedRegistrations
+        from cartouche.persistence import CompactGroups
+        root = self._makeRoot()
+        commits = []
+
+        count = self._callFUT(root, lambda: commits.append(1))
+
+        self.assertEqual(count, 3)
+        self.assertEqual(len(commits), 2)
+        confirmed = CompactConfirmedRegistrations(root)
+        self.assertEqual(confirmed.count(), 3)
+        self.assertEqual(confirmed.get_by_login('login2').uuid, 'UUID2')
+        self.assertEqual(confirmed.get_by_email('1@example.com').uuid,
+                         'UUID1')
+        self.assertEqual(confirmed.purge_expired_tokens(2000.0), 3)
+        groups = CompactGroups(root)
+        self.assertEqual(sorted(groups.members('g:admin')),
+                         ['UUID0', 'UUID1'])
+        cartouche = root.cartouche
+        for attr in ('by_uuid', 'by_login', 'by_email', 'by_token',
+                     'group_users', 'user_groups'):
+            self.assertEqual(len(getattr(cartouche, attr)), 0)
+
+
+class Test_split_profiles(unittest.TestCase):
+
+    def _callFUT(self, root, commit=None, batch_size=2):
+        from cartouche.migrations import split_profiles
+        return split_profiles(root, commit, batch_size)
+
+    def _makeLegacy(self, uuid):
+        from cartouche.models import RegistrationInfo
+        record = RegistrationInfo.__new__(RegistrationInfo)
+        record.__dict__.update(uuid=uuid, email='%s@example.com' % uuid,
+                               login=uuid, password='password',
+                               security_question='question',
+                               security_answer='answer', token=None)
+        return record
+
+    def test_no_cartouche(self):
+        from pyramid.testing import DummyModel
+        self.assertEqual(self._callFUT(DummyModel()), 0)
+
+    def test_splits_legacy_records(self):
+        from pyramid.testing import DummyModel
+        from cartouche.models import Cartouche
+        root = DummyModel()
+        cartouche = root.cartouche = Cartouche()
+        for i in range(3):
+            uuid = 'UUID%d' % i
+            cartouche.by_uuid[uuid] = self._makeLegacy(uuid)
+        commits = []
+
+        count = self._callFUT(root, lambda: commits.append(1))
+
+        self.assertEqual(count, 3)
+        self.assertEqual(len(commits), 1)
+        for record in cartouche.by_uuid.values():
+            self.assertFalse('security_question' in record.__dict__)
+            self.assertFalse('security_answer' in record.__dict__)
+            self.assertEqual(record.profile.security_question, 'question')
+            self.assertEqual(record.security_answer, 'answer')
+        self.assertEqual(self._callFUT(root), 0)
+
+    def test_splits_compact_records(self):
+        from BTrees.IOBTree import IOBTree
+        from pyramid.testing import DummyModel
+        from cartouche.models import Cartouche
+        root = DummyModel()
+        cartouche = root.cartouche = Cartouche()
+        cartouche.records_by_id = IOBTree()
+        cartouche.records_by_id[1] = self._makeLegacy('UUID1')
+
+        self.assertEqual(self._callFUT(root), 1)
+        self.assertEqual(cartouche.records_by_id[1].profile.security_answer,
+                         'answer')
+
+
+class Test_auth_index(unittest.TestCase):
+
+    def _callFUT(self, root, commit=None, batch_size=2):
+        from cartouche.migrations import auth_index
+        return auth_index(root, commit, batch_size)
+
+    def test_no_cartouche(self):
+        from pyramid.testing import DummyModel
+        self.assertEqual(self._callFUT(DummyModel()), 0)
+
+    def test_builds_index(self):
+        from pyramid.testing import DummyModel
+        from cartouche.persistence import ConfirmedRegistrations
+        root = DummyModel()
+        confirmed = ConfirmedRegistrations(root)
+        for i in range(3):
+            confirmed.set('UUID%d' % i, email='%d@example.com' % i,
+                          login='login%d' % i, password='password%d' % i)
+        commits = []
+
+        count = self._callFUT(root, lambda: commits.append(1))
+
+        self.assertEqual(count, 3)
+        self.assertEqual(len(commits), 1)
+        self.assertEqual(dict(root.cartouche.auth_by_login),
+                         {'login0': ('UUID0', 'password0'),
+                          'login1': ('UUID1', 'password1'),
+                          'login2': ('UUID2', 'password2'),
+                         })
+
+    def test_builds_index_compact_layout(self):
+        from pyramid.testing import DummyModel
+        from cartouche.persistence import CompactConfirmedRegistrations
+        root = DummyModel()
+        confirmed = CompactConfirmedRegistrations(root)
+        confirmed.set('UUID', email='phred@example.com', login='login',
+                      password='password')
+
+        self.assertEqual(self._callFUT(root), 1)
+        self.assertEqual(confirmed.get_credentials('login'),
+                         ('UUID', 'password'))
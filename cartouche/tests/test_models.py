@@ -63,6 +63,16 @@ class CartoucheTests(unittest.TestCase):
         from cartouche.interfaces import ICartouche
         verifyObject(ICartouche, self._makeOne())
 
+    def test_ctor_counters(self):
+        cartouche = self._makeOne()
+        self.assertEqual(cartouche.pending_count(), 0)
+        self.assertEqual(cartouche.confirmed_count(), 0)
+
+    def test_ctor_token_indexes(self):
+        cartouche = self._makeOne()
+        self.assertEqual(len(cartouche.by_token), 0)
+        self.assertEqual(len(cartouche.tokens_by_expiry), 0)
+
 
 class PendingRegistrationInfoTests(unittest.TestCase):
 
@@ -83,6 +93,16 @@ class PendingRegistrationInfoTests(unittest.TestCase):
         from cartouche.interfaces import IPendingRegistrationInfo
         verifyObject(IPendingRegistrationInfo, self._makeOne())
 
+    def test_ctor_wo_created_uses_now(self):
+        import time
+        before = time.time()
+        info = self._makeOne()
+        self.assertTrue(before <= info.created <= time.time())
+
+    def test_ctor_w_created(self):
+        info = self._getTargetClass()('phred@example.com', 'token', 123.0)
+        self.assertEqual(info.created, 123.0)
+
 
 class RegistrationInfoTests(unittest.TestCase):
 
@@ -112,3 +132,40 @@ class RegistrationInfoTests(unittest.TestCase):
         from zope.interface.verify import verifyObject
         from cartouche.interfaces import IRegistrationInfo
         verifyObject(IRegistrationInfo, self._makeOne())
+
+    def test_ctor_token_expires_defaults_to_None(self):
+        info = self._makeOne()
+        self.assertEqual(info.token_expires, None)
+
+    def test_ctor_stores_profile_fields_on_profile(self):
+        from cartouche.models import RegistrationProfile
+        info = self._makeOne()
+        self.assertTrue(isinstance(info.profile, RegistrationProfile))
+        self.assertEqual(info.profile.security_question, 'question')
+        self.assertEqual(info.profile.security_answer, 'answer')
+        self.assertFalse('security_question' in info.__dict__)
+        self.assertEqual(info.security_question, 'question')
+        self.assertEqual(info.security_answer, 'answer')
+
+    def test_setting_profile_field_updates_profile(self):
+        info = self._makeOne()
+        info.security_answer = 'other'
+        self.assertEqual(info.profile.security_answer, 'other')
+
+    def test_legacy_record_reads_own_fields(self):
+        info = self._getTargetClass().__new__(self._getTargetClass())
+        info.__dict__.update(security_question='question',
+                             security_answer='answer')
+        self.assertEqual(info.profile, None)
+        self.assertEqual(info.security_question, 'question')
+        self.assertEqual(info.security_answer, 'answer')
+
+    def test_legacy_record_split_on_write(self):
+        info = self._getTargetClass().__new__(self._getTargetClass())
+        info.__dict__.update(security_question='question',
+                             security_answer='answer')
+        info.security_answer = 'other'
+        self.assertEqual(info.profile.security_question, 'question')
+        self.assertEqual(info.profile.security_answer, 'other')
+        self.assertFalse('security_question' in info.__dict__)
+        self.assertFalse('security_answer' in info.__dict__)
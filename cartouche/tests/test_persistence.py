@@ -133,6 +133,12 @@ class PendingRegistrationsTests(_RegistrationsBase, unittest.TestCase):
 
         self.assertRaises(NotImplementedError, adapter.get_by_login, 'login')
 
+    def test_get_by_token_raises(self):
+        context = self._makeContext()
+        adapter = self._makeOne(context)
+
+        self.assertRaises(NotImplementedError, adapter.get_by_token, 'token')
+
     def test_get_by_email_context_is_root_no_cartouche(self):
         context = self._makeContext()
         adapter = self._makeOne(context)
@@ -183,6 +189,109 @@ class PendingRegistrationsTests(_RegistrationsBase, unittest.TestCase):
 
         self.assertFalse('phred@example.com' in cartouche.pending)
 
+    def test_update_context_is_root_no_cartouche(self):
+        adapter = self._makeOne()
+
+        self.assertRaises(KeyError, adapter.update, 'phred@example.com',
+                          token='other')
+
+    def test_update_context_is_root_w_cartouche_hit(self):
+        context = self._makeContext()
+        cartouche = context.cartouche = self._makeCartouche()
+        info = cartouche.pending['phred@example.com'] = self._makeInfo()
+        adapter = self._makeOne(context)
+
+        adapter.update('phred@example.com', token='other')
+
+        self.assertTrue(cartouche.pending['phred@example.com'] is info)
+        self.assertEqual(info.token, 'other')
+
+    def test_set_indexes_created(self):
+        context = self._makeContext()
+        cartouche = context.cartouche = self._makeCartouche()
+        adapter = self._makeOne(context)
+
+        adapter.set('phred@example.com', token='token', created=123.0)
+
+        self.assertEqual(cartouche.pending['phred@example.com'].created, 123.0)
+        self.assertEqual(list(cartouche.pending_by_created),
+                         [(123.0, 'phred@example.com')])
+
+    def test_set_replaces_created_index_entry(self):
+        context = self._makeContext()
+        cartouche = context.cartouche = self._makeCartouche()
+        adapter = self._makeOne(context)
+
+        adapter.set('phred@example.com', token='token', created=123.0)
+        adapter.set('phred@example.com', token='other', created=456.0)
+
+        self.assertEqual(list(cartouche.pending_by_created),
+                         [(456.0, 'phred@example.com')])
+
+    def test_remove_unindexes_created(self):
+        context = self._makeContext()
+        cartouche = context.cartouche = self._makeCartouche()
+        adapter = self._makeOne(context)
+        adapter.set('phred@example.com', token='token', created=123.0)
+
+        adapter.remove('phred@example.com')
+
+        self.assertEqual(list(cartouche.pending_by_created), [])
+
+    def test_expired_no_cartouche(self):
+        adapter = self._makeOne()
+        self.assertEqual(adapter.expired(1000.0), [])
+
+    def test_expired_wo_index(self):
+        context = self._makeContext()
+        cartouche = context.cartouche = self._makeCartouche()
+        cartouche.pending['phred@example.com'] = self._makeInfo()
+        adapter = self._makeOne(context)
+        self.assertEqual(adapter.expired(1000.0), [])
+
+    def test_expired_w_limit(self):
+        context = self._makeContext()
+        context.cartouche = self._makeCartouche()
+        adapter = self._makeOne(context)
+        adapter.set('c@example.com', token='token', created=300.0)
+        adapter.set('a@example.com', token='token', created=100.0)
+        adapter.set('b@example.com', token='token', created=200.0)
+
+        self.assertEqual(adapter.expired(300.0),
+                         ['a@example.com', 'b@example.com'])
+        self.assertEqual(adapter.expired(1000.0, 1), ['a@example.com'])
+
+    def test_update_created_reindexes(self):
+        context = self._makeContext()
+        cartouche = context.cartouche = self._makeCartouche()
+        adapter = self._makeOne(context)
+        adapter.set('phred@example.com', token='token', created=100.0)
+
+        adapter.update('phred@example.com', created=500.0)
+
+        self.assertEqual(list(cartouche.pending_by_created),
+                         [(500.0, 'phred@example.com')])
+        self.assertEqual(adapter.expired(300.0), [])
+        adapter.remove('phred@example.com')
+        self.assertEqual(list(cartouche.pending_by_created), [])
+
+    def test_expired_drops_stale_index_entries(self):
+        from BTrees.OOBTree import OOTreeSet
+        context = self._makeContext()
+        cartouche = context.cartouche = self._makeCartouche()
+        adapter = self._makeOne(context)
+        adapter.set('phred@example.com', token='token', created=500.0)
+        adapter.set('bharney@example.com', token='token', created=200.0)
+        # As left behind by earlier versions' 'update(created=...)'.
+        cartouche.pending_by_created = OOTreeSet(
+            list(cartouche.pending_by_created) +
+            [(100.0, 'phred@example.com'), (150.0, 'gone@example.com')])
+
+        self.assertEqual(adapter.expired(300.0), ['bharney@example.com'])
+        self.assertEqual(list(cartouche.pending_by_created),
+                         [(200.0, 'bharney@example.com'),
+                          (500.0, 'phred@example.com')])
+
     def test___iter___empty(self):
         adapter = self._makeOne()
         self.assertEqual(list(adapter), [])
@@ -296,6 +405,36 @@ class ConfirmedRegistrationsTests(_RegistrationsBase, unittest.TestCase):
         self.assertFalse('old_login' in cartouche.by_login)
         self.assertFalse('old_phred@example.com' in cartouche.by_email)
 
+    def test_set_rejects_email_or_login_of_another_user(self):
+        context = self._makeContext()
+        cartouche = context.cartouche = self._makeCartouche()
+        adapter = self._makeOne(context)
+        adapter.set('U1', email='phred@example.com', login='phred')
+
+        self.assertRaises(ValueError, adapter.set, 'U2',
+                          email='phred@example.com', login='other')
+        self.assertRaises(ValueError, adapter.set_many,
+                          [('U2', {'email': 'other@example.com',
+                                   'login': 'phred'})])
+
+        self.assertEqual(list(cartouche.by_uuid), ['U1'])
+        self.assertEqual(cartouche.by_email['phred@example.com'], 'U1')
+        self.assertEqual(cartouche.by_login['phred'], 'U1')
+
+    def test_update_rejects_email_of_another_user(self):
+        context = self._makeContext()
+        cartouche = context.cartouche = self._makeCartouche()
+        adapter = self._makeOne(context)
+        adapter.set('U1', email='phred@example.com', login='phred')
+        adapter.set('U2', email='bharney@example.com', login='bharney')
+
+        self.assertRaises(ValueError, adapter.update, 'U2',
+                          login='new_bharney', email='phred@example.com')
+
+        self.assertEqual(cartouche.by_email['phred@example.com'], 'U1')
+        self.assertEqual(cartouche.by_login['bharney'], 'U2')
+        self.assertFalse('new_bharney' in cartouche.by_login)
+
     def test_get_context_is_root_no_cartouche(self):
         context = self._makeContext()
         adapter = self._makeOne(context)
@@ -407,6 +546,258 @@ class ConfirmedRegistrationsTests(_RegistrationsBase, unittest.TestCase):
         self.assertFalse(record.login in cartouche.by_login)
         self.assertFalse(record.email in cartouche.by_email)
 
+    def test_update_context_is_root_no_cartouche(self):
+        adapter = self._makeOne()
+
+        self.assertRaises(KeyError, adapter.update, 'UUID', token='token')
+
+    def test_update_context_is_root_w_cartouche_miss(self):
+        context = self._makeContext()
+        context.cartouche = self._makeCartouche()
+        adapter = self._makeOne(context)
+
+        self.assertRaises(KeyError, adapter.update, 'UUID', token='token')
+
+    def test_update_unindexed_field_leaves_indexes_alone(self):
+        context = self._makeContext()
+        cartouche = context.cartouche = self._makeCartouche()
+        adapter = self._makeOne(context)
+        adapter.set('UUID', email='phred@example.com', login='login')
+        record = cartouche.by_uuid['UUID']
+        cartouche.by_uuid = WriteTracking(cartouche.by_uuid)
+        cartouche.by_login = WriteTracking(cartouche.by_login)
+        cartouche.by_email = WriteTracking(cartouche.by_email)
+
+        adapter.update('UUID', login='login', token='token')
+
+        self.assertTrue(cartouche.by_uuid['UUID'] is record)
+        self.assertEqual(record.token, 'token')
+        self.assertEqual(cartouche.by_uuid._writes, [])
+        self.assertEqual(cartouche.by_login._writes, [])
+        self.assertEqual(cartouche.by_email._writes, [])
+
+    def test_update_reindexes_only_changed_fields(self):
+        context = self._makeContext()
+        cartouche = context.cartouche = self._makeCartouche()
+        adapter = self._makeOne(context)
+        adapter.set('UUID', email='phred@example.com', login='old_login')
+        cartouche.by_email = WriteTracking(cartouche.by_email)
+
+        adapter.update('UUID', login='new_login')
+
+        record = cartouche.by_uuid['UUID']
+        self.assertEqual(record.login, 'new_login')
+        self.assertEqual(record.email, 'phred@example.com')
+        self.assertEqual(cartouche.by_login, {'new_login': 'UUID'})
+        self.assertEqual(cartouche.by_email._writes, [])
+
+    def test_set_many(self):
+        context = self._makeContext()
+        cartouche = context.cartouche = self._makeCartouche()
+        adapter = self._makeOne(context)
+
+        count = adapter.set_many(
+                    iter([('UUID1', {'email': 'one@example.com',
+                                     'login': 'one'}),
+                          ('UUID2', {'email': 'two@example.com',
+                                     'login': 'two'}),
+                         ]))
+
+        self.assertEqual(count, 2)
+        self.assertEqual(adapter.count(), 2)
+        self.assertEqual(sorted(cartouche.by_uuid), ['UUID1', 'UUID2'])
+        self.assertEqual(cartouche.by_login['two'], 'UUID2')
+        self.assertEqual(cartouche.by_email['one@example.com'], 'UUID1')
+
+    def test_set_indexes_token(self):
+        context = self._makeContext()
+        cartouche = context.cartouche = self._makeCartouche()
+        adapter = self._makeOne(context)
+
+        adapter.set('UUID', email='phred@example.com', login='login',
+                    token='token', token_expires=1000)
+
+        self.assertEqual(dict(cartouche.by_token), {'token': 'UUID'})
+        self.assertEqual(list(cartouche.tokens_by_expiry),
+                         [(1000, 'token')])
+
+    def test_set_wo_token_expires_skips_expiry_index(self):
+        context = self._makeContext()
+        cartouche = context.cartouche = self._makeCartouche()
+        adapter = self._makeOne(context)
+
+        adapter.set('UUID', email='phred@example.com', login='login',
+                    token='token')
+
+        self.assertEqual(dict(cartouche.by_token), {'token': 'UUID'})
+        self.assertEqual(getattr(cartouche, 'tokens_by_expiry', None), None)
+
+    def test_set_unindexes_old_token(self):
+        context = self._makeContext()
+        cartouche = context.cartouche = self._makeCartouche()
+        adapter = self._makeOne(context)
+        adapter.set('UUID', email='phred@example.com', login='login',
+                    token='old', token_expires=1000)
+
+        adapter.set('UUID', email='phred@example.com', login='login',
+                    token='new', token_expires=2000)
+
+        self.assertEqual(dict(cartouche.by_token), {'new': 'UUID'})
+        self.assertEqual(list(cartouche.tokens_by_expiry), [(2000, 'new')])
+
+    def test_update_reindexes_token(self):
+        context = self._makeContext()
+        cartouche = context.cartouche = self._makeCartouche()
+        adapter = self._makeOne(context)
+        adapter.set('UUID', email='phred@example.com', login='login',
+                    token='old', token_expires=1000)
+
+        adapter.update('UUID', token='new', token_expires=2000)
+
+        self.assertEqual(dict(cartouche.by_token), {'new': 'UUID'})
+        self.assertEqual(list(cartouche.tokens_by_expiry), [(2000, 'new')])
+
+        adapter.update('UUID', token=None, token_expires=None)
+
+        self.assertEqual(dict(cartouche.by_token), {})
+        self.assertEqual(list(cartouche.tokens_by_expiry), [])
+
+    def test_remove_unindexes_token(self):
+        context = self._makeContext()
+        cartouche = context.cartouche = self._makeCartouche()
+        adapter = self._makeOne(context)
+        adapter.set('UUID', email='phred@example.com', login='login',
+                    token='token', token_expires=1000)
+
+        adapter.remove('UUID')
+
+        self.assertEqual(dict(cartouche.by_token), {})
+        self.assertEqual(list(cartouche.tokens_by_expiry), [])
+
+    def test_get_by_token_context_is_root_no_cartouche(self):
+        context = self._makeContext()
+        adapter = self._makeOne(context)
+
+        self.assertEqual(adapter.get_by_token('token'), None)
+
+    def test_get_by_token_miss(self):
+        context = self._makeContext()
+        context.cartouche = self._makeCartouche()
+        adapter = self._makeOne(context)
+        adapter.set('UUID', email='phred@example.com', login='login',
+                    token='token')
+
+        self.assertEqual(adapter.get_by_token('other'), None)
+        self.assertEqual(adapter.get_by_token(None), None)
+
+    def test_get_by_token_hit(self):
+        from time import time
+        context = self._makeContext()
+        cartouche = context.cartouche = self._makeCartouche()
+        adapter = self._makeOne(context)
+        adapter.set('UUID', email='phred@example.com', login='login',
+                    token='token', token_expires=time() + 60)
+
+        self.assertTrue(adapter.get_by_token('token')
+                        is cartouche.by_uuid['UUID'])
+
+    def test_get_by_token_expired(self):
+        from time import time
+        context = self._makeContext()
+        context.cartouche = self._makeCartouche()
+        adapter = self._makeOne(context)
+        adapter.set('UUID', email='phred@example.com', login='login',
+                    token='token', token_expires=time() - 60)
+
+        self.assertEqual(adapter.get_by_token('token', 'default'), 'default')
+
+    def test_get_credentials_no_cartouche(self):
+        adapter = self._makeOne()
+
+        self.assertEqual(adapter.get_credentials('login'), None)
+
+    def test_get_credentials_wo_auth_index(self):
+        context = self._makeContext()
+        context.cartouche = self._makeCartouche()
+        adapter = self._makeOne(context)
+        adapter.set('UUID', email='phred@example.com', login='login',
+                    password='password')
+
+        self.assertEqual(adapter.get_credentials('login'),
+                         ('UUID', 'password'))
+        self.assertEqual(adapter.get_credentials('other', 'default'),
+                         'default')
+        self.assertEqual(adapter.get_credentials(None), None)
+
+    def test_get_credentials_w_auth_index(self):
+        context = self._makeContext()
+        cartouche = context.cartouche = self._makeCartouche()
+        cartouche.auth_by_login = {'login': ('UUID', 'password')}
+        adapter = self._makeOne(context)
+
+        self.assertEqual(adapter.get_credentials('login'),
+                         ('UUID', 'password'))
+        self.assertEqual(adapter.get_credentials('other'), None)
+
+    def test_auth_index_maintained(self):
+        context = self._makeContext()
+        cartouche = context.cartouche = self._makeCartouche()
+        index = cartouche.auth_by_login = {}
+        adapter = self._makeOne(context)
+
+        adapter.set('UUID', email='phred@example.com', login='login',
+                    password='password')
+        self.assertEqual(index, {'login': ('UUID', 'password')})
+
+        adapter.update('UUID', password='changed')
+        self.assertEqual(index, {'login': ('UUID', 'changed')})
+
+        adapter.update('UUID', login='renamed', token='token')
+        self.assertEqual(index, {'renamed': ('UUID', 'changed')})
+
+        adapter.set('UUID', email='phred@example.com', login='again',
+                    password='password')
+        self.assertEqual(index, {'again': ('UUID', 'password')})
+
+        adapter.remove('UUID')
+        self.assertEqual(index, {})
+
+    def test_auth_index_not_created(self):
+        context = self._makeContext()
+        cartouche = context.cartouche = self._makeCartouche()
+        adapter = self._makeOne(context)
+        adapter.set('UUID', email='phred@example.com', login='login',
+                    password='password')
+
+        self.assertFalse(hasattr(cartouche, 'auth_by_login'))
+
+    def test_purge_expired_tokens_no_cartouche(self):
+        adapter = self._makeOne()
+
+        self.assertEqual(adapter.purge_expired_tokens(1000), 0)
+
+    def test_purge_expired_tokens(self):
+        context = self._makeContext()
+        cartouche = context.cartouche = self._makeCartouche()
+        adapter = self._makeOne(context)
+        adapter.set('UUID1', email='one@example.com', login='one',
+                    token='one', token_expires=1000)
+        adapter.set('UUID2', email='two@example.com', login='two',
+                    token='two', token_expires=2000)
+        adapter.set('UUID3', email='three@example.com', login='three',
+                    token='three', token_expires=3000)
+
+        self.assertEqual(adapter.purge_expired_tokens(2500, limit=1), 1)
+        self.assertEqual(adapter.purge_expired_tokens(2500), 1)
+        self.assertEqual(adapter.purge_expired_tokens(2500), 0)
+
+        self.assertEqual(dict(cartouche.by_token), {'three': 'UUID3'})
+        self.assertEqual(list(cartouche.tokens_by_expiry),
+                         [(3000, 'three')])
+        self.assertEqual(cartouche.by_uuid['UUID1'].token, None)
+        self.assertEqual(cartouche.by_uuid['UUID1'].token_expires, None)
+        self.assertEqual(cartouche.by_uuid['UUID3'].token, 'three')
+
     def test___iter___empty(self):
         adapter = self._makeOne()
         self.assertEqual(list(adapter), [])
@@ -419,6 +810,485 @@ class ConfirmedRegistrationsTests(_RegistrationsBase, unittest.TestCase):
         adapter = self._makeOne(context)
         self.assertEqual(list(adapter), [('UUID', record)])
 
+class CompactConfirmedRegistrationsTests(unittest.TestCase):
+
+    def _getTargetClass(self):
+        from cartouche.persistence import CompactConfirmedRegistrations
+        return CompactConfirmedRegistrations
+
+    def _makeOne(self, context=None):
+        from pyramid.testing import DummyModel
+        if context is None:
+            context = DummyModel()
+        return self._getTargetClass()(context)
+
+    def _set(self, adapter, uuid='UUID', email='phred@example.com',
+             login='login', **kw):
+        adapter.set(uuid, email=email, login=login, password='password',
+                    **kw)
+
+    def test_class_conforms_to_IRegistrations(self):
+        from zope.interface.verify import verifyClass
+        from cartouche.interfaces import IRegistrations
+        verifyClass(IRegistrations, self._getTargetClass())
+
+    def test_empty(self):
+        adapter = self._makeOne()
+        self.assertEqual(adapter.get('UUID'), None)
+        self.assertEqual(adapter.get_by_login('login'), None)
+        self.assertEqual(adapter.count(), 0)
+        self.assertEqual(adapter.page(), [])
+        self.assertEqual(list(adapter), [])
+        self.assertEqual(adapter.search('log'), [])
+        self.assertRaises(KeyError, adapter.remove, 'UUID')
+
+    def test_set_stores_under_integer_id(self):
+        from BTrees.IOBTree import IOBTree
+        from BTrees.OIBTree import OIBTree
+        adapter = self._makeOne()
+        self._set(adapter, token='token')
+
+        cartouche = adapter.cartouche
+        self.assertTrue(isinstance(cartouche.ids_by_uuid, OIBTree))
+        self.assertTrue(isinstance(cartouche.records_by_id, IOBTree))
+        ref = cartouche.ids_by_uuid['UUID']
+        self.assertTrue(isinstance(ref, int))
+        self.assertEqual(cartouche.uuids_by_id[ref], 'UUID')
+        self.assertEqual(cartouche.records_by_id[ref].login, 'login')
+        self.assertEqual(cartouche.ids_by_login['login'], ref)
+        self.assertEqual(cartouche.ids_by_email['phred@example.com'], ref)
+        self.assertEqual(cartouche.ids_by_token['token'], ref)
+        self.assertEqual(len(cartouche.by_uuid), 0)
+        self.assertEqual(adapter.count(), 1)
+
+    def test_lookups_speak_uuids(self):
+        adapter = self._makeOne()
+        self._set(adapter, token='token')
+
+        self.assertEqual(adapter.get('UUID').uuid, 'UUID')
+        self.assertEqual(adapter.get_by_login('login').uuid, 'UUID')
+        self.assertEqual(adapter.get_by_email('phred@example.com').uuid,
+                         'UUID')
+        self.assertEqual(adapter.get_by_token('token').uuid, 'UUID')
+        self.assertEqual([key for key, record in adapter], ['UUID'])
+        self.assertEqual([key for key, record in adapter.page()], ['UUID'])
+        self.assertEqual([key for key, record in adapter.search('LOG')],
+                         ['UUID'])
+
+    def test_ids_allocated_sequentially(self):
+        adapter = self._makeOne()
+        self._set(adapter, 'UUID1', 'one@example.com', 'one')
+        self._set(adapter, 'UUID2', 'two@example.com', 'two')
+
+        ids = adapter.cartouche.ids_by_uuid
+        self.assertEqual(ids['UUID2'], ids['UUID1'] + 1)
+
+    def test_set_existing_keeps_id_and_reindexes(self):
+        adapter = self._makeOne()
+        self._set(adapter)
+        ref = adapter.cartouche.ids_by_uuid['UUID']
+
+        self._set(adapter, login='renamed')
+
+        cartouche = adapter.cartouche
+        self.assertEqual(cartouche.ids_by_uuid['UUID'], ref)
+        self.assertEqual(dict(cartouche.ids_by_login), {'renamed': ref})
+        self.assertEqual(adapter.count(), 1)
+
+    def test_update(self):
+        adapter = self._makeOne()
+        self._set(adapter)
+
+        adapter.update('UUID', email='bharney@example.com', token='token')
+
+        self.assertEqual(adapter.get_by_email('phred@example.com'), None)
+        self.assertEqual(adapter.get_by_email('bharney@example.com').uuid,
+                         'UUID')
+        self.assertEqual(adapter.get_by_token('token').uuid, 'UUID')
+        self.assertRaises(KeyError, adapter.update, 'nonesuch', token='x')
+
+    def test_remove(self):
+        adapter = self._makeOne()
+        self._set(adapter, token='token')
+
+        adapter.remove('UUID')
+
+        cartouche = adapter.cartouche
+        self.assertEqual(adapter.get('UUID'), None)
+        self.assertEqual(len(cartouche.uuids_by_id), 0)
+        self.assertEqual(len(cartouche.records_by_id), 0)
+        self.assertEqual(len(cartouche.ids_by_login), 0)
+        self.assertEqual(len(cartouche.ids_by_token), 0)
+        self.assertEqual(adapter.count(), 0)
+
+    def test_purge_expired_tokens(self):
+        adapter = self._makeOne()
+        self._set(adapter, token='token', token_expires=1000)
+
+        self.assertEqual(adapter.purge_expired_tokens(2000), 1)
+
+        self.assertEqual(adapter.get('UUID').token, None)
+        self.assertEqual(len(adapter.cartouche.ids_by_token), 0)
+
+    def test_auth_index_maintained(self):
+        from BTrees.OOBTree import OOBTree
+        adapter = self._makeOne()
+        self._set(adapter, 'UUID1', 'one@example.com', 'one')
+        index = adapter.cartouche.auth_by_login = OOBTree()
+
+        self._set(adapter, 'UUID2', 'two@example.com', 'two')
+        adapter.update('UUID2', password='changed')
+
+        self.assertEqual(dict(index), {'two': ('UUID2', 'changed')})
+        self.assertEqual(adapter.get_credentials('two'),
+                         ('UUID2', 'changed'))
+        adapter.remove('UUID2')
+        self.assertEqual(len(index), 0)
+
+
+class CompactGroupsTests(unittest.TestCase):
+
+    def _getTargetClass(self):
+        from cartouche.persistence import CompactGroups
+        return CompactGroups
+
+    def _makeOne(self, context):
+        return self._getTargetClass()(context)
+
+    def _makeContext(self):
+        from pyramid.testing import DummyModel
+        from cartouche.persistence import CompactConfirmedRegistrations
+        context = DummyModel()
+        confirmed = CompactConfirmedRegistrations(context)
+        confirmed.set('UUID', email='phred@example.com', login='login')
+        return context
+
+    def test_class_conforms_to_IGroups(self):
+        from zope.interface.verify import verifyClass
+        from cartouche.interfaces import IGroups
+        verifyClass(IGroups, self._getTargetClass())
+
+    def test_empty(self):
+        from pyramid.testing import DummyModel
+        groups = self._makeOne(DummyModel())
+        self.assertEqual(list(groups.members('g:admin')), [])
+        self.assertEqual(list(groups.groups_of('UUID')), [])
+        self.assertRaises(KeyError, groups.add, 'UUID', 'g:admin')
+        self.assertRaises(KeyError, groups.remove, 'UUID', 'g:admin')
+
+    def test_add_stores_integer_ids(self):
+        from BTrees.IIBTree import IITreeSet
+        context = self._makeContext()
+        groups = self._makeOne(context)
+
+        groups.add('UUID', 'g:admin')
+
+        cartouche = context.cartouche
+        ref = cartouche.ids_by_uuid['UUID']
+        members = cartouche.group_ids['g:admin']
+        self.assertTrue(isinstance(members, IITreeSet))
+        self.assertEqual(list(members), [ref])
+        self.assertEqual(list(cartouche.id_groups[ref]), ['g:admin'])
+        self.assertEqual(groups.members('g:admin'), ['UUID'])
+        self.assertEqual(list(groups.groups_of('UUID')), ['g:admin'])
+
+    def test_remove(self):
+        context = self._makeContext()
+        groups = self._makeOne(context)
+        groups.add('UUID', 'g:admin')
+
+        groups.remove('UUID', 'g:admin')
+
+        self.assertEqual(groups.members('g:admin'), [])
+        self.assertEqual(list(groups.groups_of('UUID')), [])
+        self.assertRaises(KeyError, groups.remove, 'UUID', 'g:admin')
+
+
+class RegistrationsPageTests(unittest.TestCase):
+
+    def _makeOne(self):
+        from pyramid.testing import DummyModel
+        from cartouche.persistence import ConfirmedRegistrations
+        adapter = ConfirmedRegistrations(DummyModel())
+        for i in range(5):
+            adapter.set('UUID%d' % i, email='%d@example.com' % i,
+                        login='login%d' % i)
+        return adapter
+
+    def test_page_no_cartouche(self):
+        from pyramid.testing import DummyModel
+        from cartouche.persistence import ConfirmedRegistrations
+        adapter = ConfirmedRegistrations(DummyModel())
+        self.assertEqual(adapter.page(), [])
+
+    def test_page_first(self):
+        adapter = self._makeOne()
+        self.assertEqual([key for key, info in adapter.page(size=2)],
+                         ['UUID0', 'UUID1'])
+
+    def test_page_after(self):
+        adapter = self._makeOne()
+        self.assertEqual([key for key, info in adapter.page('UUID1', 2)],
+                         ['UUID2', 'UUID3'])
+        self.assertEqual([key for key, info in adapter.page('UUID3', 2)],
+                         ['UUID4'])
+
+    def test_page_before(self):
+        adapter = self._makeOne()
+        self.assertEqual([key for key, info
+                            in adapter.page(size=2, before='UUID3')],
+                         ['UUID1', 'UUID2'])
+        self.assertEqual([key for key, info
+                            in adapter.page(size=2, before='UUID1')],
+                         ['UUID0'])
+        self.assertEqual(adapter.page(size=2, before='UUID0'), [])
+
+    def test_page_before_pending(self):
+        from pyramid.testing import DummyModel
+        from cartouche.persistence import PendingRegistrations
+        adapter = PendingRegistrations(DummyModel())
+        for i in range(5):
+            adapter.set('%d@example.com' % i, token='token')
+        self.assertEqual([key for key, info
+                            in adapter.page(size=2, before='3@example.com')],
+                         ['1@example.com', '2@example.com'])
+
+
+class RegistrationsCountTests(unittest.TestCase):
+
+    def _makeContext(self, **kw):
+        from pyramid.testing import DummyModel
+        return DummyModel(**kw)
+
+    def test_pending_no_cartouche(self):
+        from cartouche.persistence import PendingRegistrations
+        self.assertEqual(PendingRegistrations(self._makeContext()).count(), 0)
+
+    def test_pending_maintained_by_set_and_remove(self):
+        from cartouche.persistence import PendingRegistrations
+        context = self._makeContext()
+        adapter = PendingRegistrations(context)
+        adapter.set('a@example.com', token='token')
+        adapter.set('b@example.com', token='token')
+        adapter.set('b@example.com', token='other')
+        self.assertEqual(adapter.count(), 2)
+        self.assertEqual(context.cartouche.pending_count(), 2)
+        adapter.remove('a@example.com')
+        self.assertEqual(adapter.count(), 1)
+
+    def test_confirmed_maintained_by_set_and_remove(self):
+        from cartouche.persistence import ConfirmedRegistrations
+        context = self._makeContext()
+        adapter = ConfirmedRegistrations(context)
+        adapter.set('UUID1', login='one', email='one@example.com')
+        adapter.set('UUID2', login='two', email='two@example.com')
+        adapter.set('UUID2', login='deux', email='two@example.com')
+        self.assertEqual(adapter.count(), 2)
+        self.assertEqual(context.cartouche.confirmed_count(), 2)
+        adapter.remove('UUID1')
+        self.assertEqual(adapter.count(), 1)
+
+    def test_legacy_cartouche_wo_counters(self):
+        from cartouche.persistence import ConfirmedRegistrations
+        context = self._makeContext()
+        cartouche = context.cartouche = Dummy(by_uuid={'UUID0': object()},
+                                              by_login={}, by_email={})
+        adapter = ConfirmedRegistrations(context)
+        self.assertEqual(adapter.count(), 1)
+        self.assertFalse('confirmed_count' in cartouche.__dict__)
+        adapter.set('UUID1', login='one', email='one@example.com')
+        self.assertEqual(cartouche.confirmed_count(), 2)
+
+    def test_legacy_cartouche_wo_counters_remove(self):
+        from cartouche.persistence import ConfirmedRegistrations
+        from cartouche.persistence import PendingRegistrations
+        context = self._makeContext()
+        pending = PendingRegistrations(context)
+        confirmed = ConfirmedRegistrations(context)
+        for i in range(5):
+            pending.set('%d@example.com' % i, token='token')
+            confirmed.set('UUID%d' % i, login='login%d' % i,
+                          email='%d@example.com' % i)
+        cartouche = context.cartouche
+        del cartouche.pending_count
+        del cartouche.confirmed_count
+        pending.remove('0@example.com')
+        confirmed.remove('UUID0')
+        self.assertEqual(pending.count(), 4)
+        self.assertEqual(len(list(pending)), 4)
+        self.assertEqual(confirmed.count(), 4)
+        self.assertEqual(len(list(confirmed)), 4)
+
+
+class Test_prefixSearch(unittest.TestCase):
+
+    def _callFUT(self, mapping, prefix, limit=20):
+        from cartouche.persistence import prefixSearch
+        return prefixSearch(mapping, prefix, limit)
+
+    def _makeMapping(self, *keys):
+        from BTrees.OOBTree import OOBTree
+        return OOBTree([(key, key.upper()) for key in keys])
+
+    def test_empty(self):
+        self.assertEqual(self._callFUT(self._makeMapping(), 'a'), [])
+
+    def test_ignores_case(self):
+        mapping = self._makeMapping('abc', 'ABd', 'aBe', 'Ax', 'b')
+        self.assertEqual([key for key, value in self._callFUT(mapping, 'Ab')],
+                         ['ABd', 'aBe', 'abc'])
+
+    def test_long_prefix_filters_tail(self):
+        mapping = self._makeMapping('abcdefghijKL', 'abcdefghijkm')
+        self.assertEqual(self._callFUT(mapping, 'ABCDEFGHIJK'),
+                         [('abcdefghijKL', 'ABCDEFGHIJKL'),
+                          ('abcdefghijkm', 'ABCDEFGHIJKM')])
+
+    def test_long_prefix_scans_bounded_by_limit(self):
+        keys = ['abcdefghij%03d' % i for i in range(100)]
+        keys.extend(['abcdefghiJ%03d' % i for i in range(100)])
+        mapping = self._makeMapping(*keys)
+        scanned = []
+        class _Mapping(object):
+            def minKey(self, min):
+                return mapping.minKey(min)
+            def items(self, min):
+                for item in mapping.items(min=min):
+                    scanned.append(item[0])
+                    yield item
+        found = self._callFUT(_Mapping(), 'ABCDEFGHIJ', 3)
+        self.assertEqual([key for key, value in found],
+                         ['abcdefghiJ000', 'abcdefghiJ001', 'abcdefghiJ002'])
+        # Only the two live case variants are scanned, each for at most
+        # 'limit' keys (plus the one ending the scan).
+        self.assertEqual(len(scanned), 8)
+
+    def test_prefix_w_caseless_chars(self):
+        mapping = self._makeMapping('a.1@x', 'A.2@x', 'a-3@x')
+        self.assertEqual([key for key, value in self._callFUT(mapping, 'a.')],
+                         ['A.2@x', 'a.1@x'])
+
+    def test_w_limit(self):
+        mapping = self._makeMapping('a1', 'a2', 'A3', 'b')
+        self.assertEqual([key for key, value in self._callFUT(mapping, 'a', 2)],
+                         ['A3', 'a1'])
+
+
+class GroupsTests(unittest.TestCase):
+
+    def _getTargetClass(self):
+        from cartouche.persistence import Groups
+        return Groups
+
+    def _makeOne(self, context=None):
+        if context is None:
+            context = self._makeContext()
+        return self._getTargetClass()(context)
+
+    def _makeContext(self, **kw):
+        from pyramid.testing import DummyModel
+        return DummyModel(**kw)
+
+    def _makeCartouche(self):
+        from cartouche.models import Cartouche
+        return Cartouche()
+
+    def test_class_conforms_to_IGroups(self):
+        from zope.interface.verify import verifyClass
+        from cartouche.interfaces import IGroups
+        verifyClass(IGroups, self._getTargetClass())
+
+    def test_instance_conforms_to_IGroups(self):
+        from zope.interface.verify import verifyObject
+        from cartouche.interfaces import IGroups
+        verifyObject(IGroups, self._makeOne())
+
+    def test_queries_no_cartouche(self):
+        context = self._makeContext()
+        adapter = self._makeOne(context)
+
+        self.assertEqual(list(adapter.members('g:admin')), [])
+        self.assertEqual(list(adapter.groups_of('UUID')), [])
+        self.assertFalse('cartouche' in context.__dict__)
+
+    def test_add_no_cartouche_creates_it(self):
+        from BTrees.OOBTree import OOTreeSet
+        context = self._makeContext()
+        adapter = self._makeOne(context)
+
+        adapter.add('UUID', 'g:admin')
+
+        cartouche = context.cartouche
+        self.assertTrue(isinstance(cartouche.group_users['g:admin'],
+                                   OOTreeSet))
+        self.assertTrue(isinstance(cartouche.user_groups['UUID'], OOTreeSet))
+        self.assertEqual(list(adapter.members('g:admin')), ['UUID'])
+        self.assertEqual(list(adapter.groups_of('UUID')), ['g:admin'])
+
+    def test_add_existing_group_leaves_mapping_alone(self):
+        context = self._makeContext()
+        cartouche = context.cartouche = self._makeCartouche()
+        adapter = self._makeOne(context)
+        adapter.add('UUID1', 'g:admin')
+        members = cartouche.group_users['g:admin']
+
+        adapter.add('UUID2', 'g:admin')
+
+        self.assertTrue(cartouche.group_users['g:admin'] is members)
+        self.assertEqual(list(adapter.members('g:admin')), ['UUID1', 'UUID2'])
+
+    def test_add_converts_legacy_lists(self):
+        from BTrees.OOBTree import OOTreeSet
+        context = self._makeContext()
+        cartouche = context.cartouche = self._makeCartouche()
+        cartouche.group_users['g:admin'] = ['UUID1']
+        cartouche.user_groups['UUID2'] = ['g:other']
+        adapter = self._makeOne(context)
+
+        adapter.add('UUID2', 'g:admin')
+
+        self.assertTrue(isinstance(cartouche.group_users['g:admin'],
+                                   OOTreeSet))
+        self.assertEqual(list(adapter.members('g:admin')), ['UUID1', 'UUID2'])
+        self.assertEqual(list(adapter.groups_of('UUID2')),
+                         ['g:admin', 'g:other'])
+
+    def test_remove_no_cartouche(self):
+        adapter = self._makeOne()
+
+        self.assertRaises(KeyError, adapter.remove, 'UUID', 'g:admin')
+
+    def test_remove_miss(self):
+        context = self._makeContext()
+        context.cartouche = self._makeCartouche()
+        adapter = self._makeOne(context)
+
+        self.assertRaises(KeyError, adapter.remove, 'UUID', 'g:admin')
+
+    def test_remove_hit(self):
+        context = self._makeContext()
+        context.cartouche = self._makeCartouche()
+        adapter = self._makeOne(context)
+        adapter.add('UUID1', 'g:admin')
+        adapter.add('UUID2', 'g:admin')
+
+        adapter.remove('UUID1', 'g:admin')
+
+        self.assertEqual(list(adapter.members('g:admin')), ['UUID2'])
+        self.assertEqual(list(adapter.groups_of('UUID1')), [])
+
+
 class Dummy(object):
     def __init__(self, **kw):
         self.__dict__.update(kw)
+
+class WriteTracking(dict):
+    def __init__(self, *args, **kw):
+        super(WriteTracking, self).__init__(*args, **kw)
+        self._writes = []
+    def __setitem__(self, key, value):
+        self._writes.append(('set', key))
+        super(WriteTracking, self).__setitem__(key, value)
+    def __delitem__(self, key):
+        self._writes.append(('del', key))
+        super(WriteTracking, self).__delitem__(key)
@@ -317,6 +317,24 @@ class PyramidPolicyTests(_Base, unittest.TestCase):
         self.assertEqual(policy.effective_principals(request),
                          ['phred', Authenticated, Everyone])
 
+    def test_effective_principals_w_groups_adapter(self):
+        from pyramid.security import Authenticated
+        from pyramid.security import Everyone
+        from cartouche.interfaces import IGroups
+        ENVIRON = {'repoze.who.identity': {'repoze.who.userid': 'phred'}}
+        by_uuid, by_login, by_email = self._registerConfirmed()
+        by_uuid['phred'] = Dummy()
+        class DummyGroups:
+            def __init__(self, context):
+                pass
+            def groups_of(self, uuid):
+                return iter(['g:%s' % uuid])
+        self.config.registry.registerAdapter(DummyGroups, (None,), IGroups)
+        request = self._makeRequest(environ=ENVIRON)
+        policy = self._makeOne()
+        self.assertEqual(policy.effective_principals(request),
+                         ['phred', 'g:phred', Authenticated, Everyone])
+
     def test_remember_w_api_in_environ(self):
         HEADERS = [('Fruit', 'Basket')]
         api = DummyAPI(headers=HEADERS)
@@ -344,6 +362,74 @@ class PyramidPolicyTests(_Base, unittest.TestCase):
         self.assertEqual(api._forgtten, {'repoze.who.userid': 'phred'})
 
 
+    def test_authenticated_userid_memoized_per_request(self):
+        api = DummyAPI('phred')
+        ENVIRON = {'wsgi.version': '1.0',
+                   'HTTP_USER_AGENT': 'testing',
+                   'repoze.who.api': api,
+                  }
+        by_uuid, by_login, by_email = self._registerConfirmed()
+        by_uuid['phred'] = Dummy()
+        request = self._makeRequest(environ=ENVIRON)
+        policy = self._makeOne()
+        self.assertEqual(policy.authenticated_userid(request), 'phred')
+        del by_uuid['phred']
+        self.assertEqual(policy.authenticated_userid(request), 'phred')
+        self.assertEqual(api._authenticate_calls, 1)
+
+    def test_effective_principals_memoized_per_request(self):
+        from pyramid.security import Authenticated
+        from pyramid.security import Everyone
+        api = DummyAPI('phred')
+        ENVIRON = {'wsgi.version': '1.0',
+                   'HTTP_USER_AGENT': 'testing',
+                   'repoze.who.api': api,
+                  }
+        request = self._makeRequest(environ=ENVIRON)
+        cartouche = request.context.cartouche = self._makeCartouche()
+        cartouche.by_uuid['phred'] = Dummy()
+        cartouche.user_groups['phred'] = ['g:admin']
+        policy = self._makeOne()
+        first = policy.effective_principals(request)
+        first.append('mutated')
+        cartouche.user_groups['phred'] = []
+        self.assertEqual(policy.effective_principals(request),
+                         ['phred', 'g:admin', Authenticated, Everyone])
+        self.assertEqual(api._authenticate_calls, 1)
+
+    def test_remember_clears_memoized_values(self):
+        from pyramid.security import Everyone
+        api = DummyAPI()
+        ENVIRON = {'wsgi.version': '1.0',
+                   'HTTP_USER_AGENT': 'testing',
+                   'repoze.who.api': api,
+                  }
+        by_uuid, by_login, by_email = self._registerConfirmed()
+        by_uuid['phred'] = Dummy()
+        request = self._makeRequest(environ=ENVIRON)
+        policy = self._makeOne()
+        self.assertEqual(policy.effective_principals(request), [Everyone])
+        policy.remember(request, 'phred')
+        api._authenticated = 'phred'
+        self.assertEqual(policy.authenticated_userid(request), 'phred')
+        self.assertEqual(api._authenticate_calls, 2)
+
+    def test_forget_clears_memoized_values(self):
+        api = DummyAPI('phred')
+        ENVIRON = {'wsgi.version': '1.0',
+                   'HTTP_USER_AGENT': 'testing',
+                   'repoze.who.api': api,
+                  }
+        by_uuid, by_login, by_email = self._registerConfirmed()
+        by_uuid['phred'] = Dummy()
+        request = self._makeRequest(environ=ENVIRON)
+        policy = self._makeOne()
+        self.assertEqual(policy.authenticated_userid(request), 'phred')
+        policy.forget(request)
+        api._authenticated = None
+        self.assertEqual(policy.authenticated_userid(request), None)
+
+
 class TestCartoucheAuthenticationPolicyDirective(_Base, unittest.TestCase):
 
     def _callFUT(self, context, config_file=None, identifier_id='IDENTIFIER'):
@@ -374,11 +460,14 @@ class TestCartoucheAuthenticationPolicyDirective(_Base, unittest.TestCase):
 
 class DummyAPI:
 
+    _authenticate_calls = 0
+
     def __init__(self, authenticated=None, headers=()):
         self._authenticated = authenticated
         self._headers = headers
 
     def authenticate(self):
+        self._authenticate_calls += 1
         if self._authenticated is not None:
             return {'repoze.who.userid': self._authenticated}
 
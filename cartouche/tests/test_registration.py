@@ -91,6 +91,13 @@ class _Base(object):
                 by_uuid[key] = record
                 by_login[record.login] = key
                 by_email[record.email] = key
+            def update(self, key, **changes):
+                record = by_uuid[key]
+                del by_login[record.login]
+                del by_email[record.email]
+                record.__dict__.update(changes)
+                by_login[record.login] = key
+                by_email[record.email] = key
             def remove(self, key):
                 info = by_uuid[key]
                 del by_uuid[key]
@@ -188,6 +195,25 @@ class Test_register_view(_Base, unittest.TestCase):
         self.assertEqual(info.email, TO_EMAIL)
         self.assertEqual(info.token, 'RANDOM')
 
+    def test_POST_no_errors_skips_rendering(self):
+        from repoze.sendmail.interfaces import IMailDelivery
+        from webob.exc import HTTPFound
+        from cartouche import registration
+        POST = {'email': 'phred@example.com', 'register': ''}
+        self.config.registry.settings['cartouche.from_addr'] = 'a@example.com'
+        self.config.registry.registerUtility(DummyMailer(), IMailDelivery)
+        self._registerPendingRegistrations()
+        request = self._makeRequest(POST=POST)
+        def _render(*args, **kw):
+            raise AssertionError('rendered')
+        original = registration.renderBlankForm
+        registration.renderBlankForm = _render
+        try:
+            response = self._callFUT(request=request)
+        finally:
+            registration.renderBlankForm = original
+        self.assertTrue(isinstance(response, HTTPFound))
+
     def test_POST_no_errors_w_confirmation_url(self):
         from repoze.sendmail.interfaces import IMailDelivery
         from webob.exc import HTTPFound
@@ -290,6 +316,44 @@ class Test_confirm_registration_view(_Base, unittest.TestCase):
         self.assertEqual(inputs,
                          [('email', 'phred@example.com'), ('token', '')])
 
+    def test_GET_w_email_hit_expired(self):
+        from webob.exc import HTTPFound
+        EMAIL = 'phred@example.com'
+        self.config.registry.settings['cartouche.pending_ttl'] = '3600'
+        pending = self._registerPendingRegistrations()
+        pending[EMAIL] = Dummy(token='TOKEN', created=0.0)
+        request = self._makeRequest(GET={'email': EMAIL})
+
+        response = self._callFUT(request=request)
+
+        self.assertTrue(isinstance(response, HTTPFound))
+        self.assertEqual(response.location,
+                         'http://example.com/register.html?message='
+                         'Your+registration+has+expired.'
+                         '++Please+register+again.')
+        self.assertFalse(EMAIL in pending)
+
+    def test_POST_w_token_hit_expired(self):
+        from webob.exc import HTTPFound
+        EMAIL = 'phred@example.com'
+        POST = {'email': EMAIL,
+                'token': 'TOKEN',
+                'confirm': '',
+               }
+        self.config.registry.settings['cartouche.pending_ttl'] = '3600'
+        pending = self._registerPendingRegistrations()
+        pending[EMAIL] = Dummy(token='TOKEN', created=0.0)
+        request = self._makeRequest(POST=POST)
+
+        response = self._callFUT(request=request)
+
+        self.assertTrue(isinstance(response, HTTPFound))
+        self.assertEqual(response.location,
+                         'http://example.com/register.html?message='
+                         'Your+registration+has+expired.'
+                         '++Please+register+again.')
+        self.assertFalse(EMAIL in pending)
+
     def test_POST_w_validation_errors(self):
         import re
         SUMMARY_ERROR = re.compile('<div class="errorMsgLbl[^>]*>'
@@ -466,6 +530,35 @@ class Test_confirm_registration_view(_Base, unittest.TestCase):
         self.assertEqual(response.location, 'http://example.com/after.html')
 
 
+class Test_pendingExpired(_Base, unittest.TestCase):
+
+    def _callFUT(self, request, info):
+        from cartouche.registration import pendingExpired
+        return pendingExpired(request, info)
+
+    def test_wo_ttl(self):
+        request = self._makeRequest()
+        self.assertFalse(self._callFUT(request, Dummy(created=0.0)))
+
+    def test_wo_created(self):
+        self.config.registry.settings['cartouche.pending_ttl'] = '3600'
+        request = self._makeRequest()
+        self.assertFalse(self._callFUT(request, Dummy()))
+
+    def test_w_ttl_not_expired(self):
+        import time
+        self.config.registry.settings['cartouche.pending_ttl'] = '3600'
+        request = self._makeRequest()
+        self.assertFalse(self._callFUT(request, Dummy(created=time.time())))
+
+    def test_w_ttl_expired(self):
+        import time
+        self.config.registry.settings['cartouche.pending_ttl'] = '3600'
+        request = self._makeRequest()
+        self.assertTrue(self._callFUT(request,
+                                      Dummy(created=time.time() - 3601)))
+
+
 class Test_edit_account_view(_Base, unittest.TestCase):
 
     def _callFUT(self, context=None, request=None):
@@ -761,7 +854,9 @@ class Test_edit_account_view(_Base, unittest.TestCase):
                                 email=OLD_EMAIL,
                                 password=encoded,
                                 security_question='borncity',
-                                security_answer='FXBG')
+                                security_answer='FXBG',
+                                token='TOKEN',
+                                token_expires=1000.0)
         by_email[OLD_EMAIL] = by_login['before'] = 'UUID'
         POST = MultiDict([('login_name', 'after'),
                           ('email', NEW_EMAIL),
@@ -791,6 +886,8 @@ class Test_edit_account_view(_Base, unittest.TestCase):
                                               'newpassword'))
         self.assertEqual(new_record.security_question, 'petname')
         self.assertEqual(new_record.security_answer, 'Fido')
+        self.assertEqual(new_record.token, None)
+        self.assertEqual(new_record.token_expires, None)
         self.assertFalse(OLD_EMAIL in by_email)
         self.assertEqual(by_email[NEW_EMAIL], 'UUID')
         self.assertFalse('before' in by_login)
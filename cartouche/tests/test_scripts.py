@@ -0,0 +1,324 @@
+##############################################################################
+#
+# Copyright (c) 2010 Agendaless Consulting and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+import unittest
+
+
+class Test_reap(unittest.TestCase):
+
+    def _callFUT(self, pending, cutoff, batch_size, commit):
+        from cartouche.scripts.reap_cartouche_pending import reap
+        return reap(pending, cutoff, batch_size, commit)
+
+    def _makePending(self):
+        from pyramid.testing import DummyModel
+        from cartouche.persistence import PendingRegistrations
+        pending = PendingRegistrations(DummyModel())
+        for i in range(5):
+            pending.set('%d@example.com' % i, token='token', created=float(i))
+        return pending
+
+    def test_removes_expired_in_batches(self):
+        pending = self._makePending()
+        commits = []
+        def _commit():
+            commits.append(len(list(pending)))
+
+        removed = self._callFUT(pending, 3.0, 2, _commit)
+
+        self.assertEqual(removed, 3)
+        self.assertEqual(commits, [3, 2])
+        self.assertEqual(sorted([key for key, info in pending]),
+                         ['3@example.com', '4@example.com'])
+
+    def test_after_update_created(self):
+        pending = self._makePending()
+        pending.update('0@example.com', created=10.0)
+        commits = []
+
+        removed = self._callFUT(pending, 3.0, 2, lambda: commits.append(1))
+
+        self.assertEqual(removed, 2)
+        self.assertEqual(sorted([key for key, info in pending]),
+                         ['0@example.com', '3@example.com', '4@example.com'])
+        self.assertEqual(self._callFUT(pending, 3.0, 2, lambda: None), 0)
+
+    def test_skips_registrations_already_gone(self):
+        class _Pending(object):
+            def __init__(self):
+                self.batches = [['gone@example.com', '1@example.com'],
+                                ['gone@example.com']]
+                self.removed = []
+            def expired(self, cutoff, limit=None):
+                return self.batches.pop(0)
+            def remove(self, email):
+                if email == 'gone@example.com':
+                    raise KeyError(email)
+                self.removed.append(email)
+        pending = _Pending()
+        commits = []
+
+        removed = self._callFUT(pending, 3.0, 2, lambda: commits.append(1))
+
+        self.assertEqual(removed, 1)
+        self.assertEqual(pending.removed, ['1@example.com'])
+        self.assertEqual(commits, [1, 1])
+
+    def test_nothing_expired(self):
+        pending = self._makePending()
+        commits = []
+
+        removed = self._callFUT(pending, 0.0, 2, lambda: commits.append(1))
+
+        self.assertEqual(removed, 0)
+        self.assertEqual(commits, [])
+
+
+class Test_readRecords(unittest.TestCase):
+
+    def _callFUT(self, stream, format):
+        from cartouche.scripts.import_cartouche_users import readRecords
+        return list(readRecords(stream, format))
+
+    def test_csv(self):
+        from io import StringIO
+        stream = StringIO(u'email,login\nphred@example.com,phred\n')
+
+        records = self._callFUT(stream, 'csv')
+
+        self.assertEqual(records,
+                         [{'email': 'phred@example.com', 'login': 'phred'}])
+
+    def test_jsonl_skips_blank_lines(self):
+        from io import StringIO
+        stream = StringIO(u'{"email": "phred@example.com"}\n\n'
+                          u'{"email": "bharney@example.com"}\n')
+
+        records = self._callFUT(stream, 'jsonl')
+
+        self.assertEqual(records, [{'email': 'phred@example.com'},
+                                   {'email': 'bharney@example.com'}])
+
+    def test_unknown_format(self):
+        self.assertRaises(ValueError, self._callFUT, [], 'xml')
+
+
+class Test_import_records(unittest.TestCase):
+
+    def _callFUT(self, confirmed, records, batch_size, **kw):
+        from cartouche.scripts.import_cartouche_users import import_records
+        return import_records(confirmed, records, batch_size, **kw)
+
+    def _makeConfirmed(self):
+        from pyramid.testing import DummyModel
+        from cartouche.persistence import ConfirmedRegistrations
+        return ConfirmedRegistrations(DummyModel())
+
+    def _makeRecords(self, count):
+        for i in range(count):
+            yield {'uuid': 'UUID%d' % i,
+                   'email': '%d@example.com' % i,
+                   'password': 'password%d' % i,
+                  }
+
+    def test_commits_minimizes_and_reports_each_batch(self):
+        confirmed = self._makeConfirmed()
+        commits = []
+        minimized = []
+        reported = []
+
+        imported = self._callFUT(
+                        confirmed, self._makeRecords(5), 2,
+                        commit=lambda: commits.append(confirmed.count()),
+                        minimize=lambda: minimized.append(1),
+                        report=lambda n, elapsed: reported.append(n),
+                       )
+
+        self.assertEqual(imported, 5)
+        self.assertEqual(commits, [2, 4, 5])
+        self.assertEqual(len(minimized), 3)
+        self.assertEqual(reported, [2, 4, 5])
+        record = confirmed.get('UUID3')
+        self.assertEqual(record.email, '3@example.com')
+        self.assertEqual(record.login, '3@example.com')
+        self.assertEqual(record.password, 'password3')
+
+    def test_generates_missing_uuid(self):
+        confirmed = self._makeConfirmed()
+
+        self._callFUT(confirmed, [{'email': 'phred@example.com',
+                                   'login': 'phred'}], 10,
+                      commit=lambda: None)
+
+        record = confirmed.get_by_login('phred')
+        self.assertTrue(record.uuid)
+        self.assertEqual(confirmed.get(record.uuid), record)
+
+    def test_w_hasher(self):
+        confirmed = self._makeConfirmed()
+        hashed = []
+        def _hasher(passwords):
+            hashed.append(passwords)
+            return ['hashed:' + x for x in passwords]
+
+        self._callFUT(confirmed, self._makeRecords(3), 2,
+                      commit=lambda: None, hasher=_hasher)
+
+        self.assertEqual(hashed, [['password0', 'password1'], ['password2']])
+        self.assertEqual(confirmed.get('UUID2').password, 'hashed:password2')
+
+    def test_blank_or_missing_password_not_stored(self):
+        confirmed = self._makeConfirmed()
+        records = [{'uuid': 'BLANK', 'email': 'blank@example.com',
+                    'password': ''},
+                   {'uuid': 'MISSING', 'email': 'missing@example.com'},
+                   {'uuid': 'SET', 'email': 'set@example.com',
+                    'password': 'secret'},
+                  ]
+
+        self._callFUT(confirmed, records, 10, commit=lambda: None)
+
+        self.assertEqual(confirmed.get('BLANK').password, None)
+        self.assertEqual(confirmed.get('MISSING').password, None)
+        self.assertEqual(confirmed.get('SET').password, 'secret')
+
+    def test_w_hasher_skips_blank_or_missing_password(self):
+        from cartouche.scripts.import_cartouche_users import _hashAll
+        from zope.password.password import SSHAPasswordManager
+        confirmed = self._makeConfirmed()
+        records = [{'uuid': 'BLANK', 'email': 'blank@example.com',
+                    'password': ''},
+                   {'uuid': 'MISSING', 'email': 'missing@example.com'},
+                   {'uuid': 'SET', 'email': 'set@example.com',
+                    'password': 'secret'},
+                  ]
+
+        self._callFUT(confirmed, records, 10, commit=lambda: None,
+                      hasher=_hashAll)
+
+        self.assertEqual(confirmed.get('BLANK').password, None)
+        self.assertEqual(confirmed.get('MISSING').password, None)
+        encoded = confirmed.get('SET').password
+        self.assertTrue(SSHAPasswordManager().checkPassword(encoded,
+                                                            'secret'))
+
+    def test_rejects_duplicate_email_or_login_in_input(self):
+        confirmed = self._makeConfirmed()
+        records = [{'uuid': 'U1', 'email': 'phred@example.com'},
+                   {'uuid': 'U2', 'email': 'phred@example.com'},
+                   {'uuid': 'U3', 'email': 'other@example.com',
+                    'login': 'phred@example.com'},
+                   {'uuid': 'U1', 'email': 'phred@example.com',
+                    'password': 'again'},
+                  ]
+        rejected = []
+
+        imported = self._callFUT(
+                        confirmed, records, 2, commit=lambda: None,
+                        reject=lambda record, reason: rejected.append(
+                                                (record['uuid'], reason)))
+
+        self.assertEqual(imported, 2)
+        self.assertEqual(
+            rejected,
+            [('U2', 'email phred@example.com already belongs to U1'),
+             ('U3', 'login phred@example.com already belongs to U1')])
+        self.assertEqual([key for key, record in confirmed], ['U1'])
+        self.assertEqual(confirmed.get('U1').password, 'again')
+        self.assertEqual(confirmed.get_by_email('phred@example.com').uuid,
+                         'U1')
+
+    def test_rejects_email_of_stored_user(self):
+        confirmed = self._makeConfirmed()
+        confirmed.set('U1', email='phred@example.com', login='phred')
+        records = [{'uuid': 'U2', 'email': 'phred@example.com'}]
+        rejected = []
+
+        imported = self._callFUT(
+                        confirmed, records, 10, commit=lambda: None,
+                        reject=lambda record, reason: rejected.append(reason))
+
+        self.assertEqual(imported, 0)
+        self.assertEqual(rejected,
+                         ['email phred@example.com already belongs to U1'])
+        confirmed.remove('U1')
+        self.assertEqual(confirmed.get_by_email('phred@example.com'), None)
+        self.assertEqual(confirmed.count(), 0)
+
+
+class Test_hashPassword(unittest.TestCase):
+
+    def _callFUT(self, plaintext):
+        from cartouche.scripts.import_cartouche_users import hashPassword
+        return hashPassword(plaintext)
+
+    def test_it(self):
+        from zope.password.password import SSHAPasswordManager
+        encoded = self._callFUT('secret')
+        self.assertTrue(SSHAPasswordManager().checkPassword(encoded, 'secret'))
+
+
+class Test_export(unittest.TestCase):
+
+    def _callFUT(self, registrations, stream, *args, **kw):
+        from cartouche.scripts.export_cartouche_users import export
+        return export(registrations, stream, *args, **kw)
+
+    def _makePending(self):
+        from pyramid.testing import DummyModel
+        from cartouche.persistence import PendingRegistrations
+        pending = PendingRegistrations(DummyModel())
+        for i in range(3):
+            pending.set('%d@example.com' % i, token='token', created=float(i))
+        return pending
+
+    def test_writes_lines_and_reports_last_key(self):
+        from io import StringIO
+        stream = StringIO()
+        reported = []
+
+        last = self._callFUT(self._makePending(), stream, '0@example.com',
+                             report=reported.append)
+
+        self.assertEqual(last, '2@example.com')
+        self.assertEqual(reported, ['2@example.com'])
+        self.assertEqual(len(stream.getvalue().splitlines()), 2)
+
+    def test_interrupted_reports_last_key_written(self):
+        class _Stream(object):
+            def __init__(self):
+                self.lines = []
+            def write(self, line):
+                if len(self.lines) == 2:
+                    raise IOError('disk full')
+                self.lines.append(line)
+        reported = []
+
+        self.assertRaises(IOError, self._callFUT, self._makePending(),
+                          _Stream(), report=reported.append)
+
+        self.assertEqual(reported, ['1@example.com'])
+
+
+class Test_bench(unittest.TestCase):
+
+    def _callFUT(self, generator):
+        from cartouche.scripts.bench_userids import bench
+        return bench(generator, threads=2, commits=2, per_txn=2, prefill=10)
+
+    def test_it(self):
+        from cartouche.util import timeOrderedUserId
+        stats = self._callFUT(timeOrderedUserId)
+        self.assertEqual(stats['commits'], 4)
+        self.assertTrue(stats['stores_per_commit'] > 0)
+        self.assertTrue(0.0 <= stats['conflict_rate'] < 1.0)
@@ -0,0 +1,182 @@
+##############################################################################
+#
+# Copyright (c) 2010 Agendaless Consulting and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+import unittest
+
+
+class _TempdirBase(object):
+
+    _tempdir = None
+
+    def tearDown(self):
+        if self._tempdir is not None:
+            import shutil
+            shutil.rmtree(self._tempdir)
+
+    def _getPath(self, name='credentials.snap'):
+        import os
+        if self._tempdir is None:
+            from tempfile import mkdtemp
+            self._tempdir = mkdtemp('snapshottests')
+        return os.path.join(self._tempdir, name)
+
+
+class Test_iterCredentials(unittest.TestCase):
+
+    def _callFUT(self, confirmed, groups=None):
+        from cartouche.snapshot import iterCredentials
+        return list(iterCredentials(confirmed, groups))
+
+    def test_wo_groups(self):
+        record = Dummy(login='login', password='hashed')
+        self.assertEqual(self._callFUT([('UUID', record)]),
+                         [('login', 'UUID', 'hashed', ())])
+
+    def test_w_groups(self):
+        class DummyGroups(object):
+            def groups_of(self, uuid):
+                return ['g:%s' % uuid]
+        record = Dummy(login='login', password='hashed')
+        self.assertEqual(self._callFUT([('UUID', record)], DummyGroups()),
+                         [('login', 'UUID', 'hashed', ('g:UUID',))])
+
+
+class Test_writeSnapshot(_TempdirBase, unittest.TestCase):
+
+    def _callFUT(self, path, credentials):
+        from cartouche.snapshot import writeSnapshot
+        return writeSnapshot(path, credentials)
+
+    def test_writes_sorted_records(self):
+        from cartouche.snapshot import MAGIC
+        path = self._getPath()
+        count = self._callFUT(path, [('b', 'UUID2', 'h2', ()),
+                                     ('a', 'UUID1', 'h1', ('g:x',)),
+                                    ])
+        self.assertEqual(count, 2)
+        with open(path, 'rb') as stream:
+            data = stream.read()
+        self.assertTrue(data.startswith(MAGIC))
+        self.assertTrue(data.endswith(b'a\0UUID1\0h1\0g:xb\0UUID2\0h2'))
+
+    def test_replaces_existing_file(self):
+        import os
+        path = self._getPath()
+        with open(path, 'w') as stream:
+            stream.write('old')
+        self._callFUT(path, [])
+        with open(path, 'rb') as stream:
+            self.assertNotEqual(stream.read(), b'old')
+        self.assertEqual(os.listdir(self._tempdir), ['credentials.snap'])
+
+
+class CredentialSnapshotTests(_TempdirBase, unittest.TestCase):
+
+    def _getTargetClass(self):
+        from cartouche.snapshot import CredentialSnapshot
+        return CredentialSnapshot
+
+    def _makeOne(self, credentials=(), **kw):
+        from cartouche.snapshot import writeSnapshot
+        path = self._getPath()
+        writeSnapshot(path, credentials)
+        return self._getTargetClass()(path, **kw)
+
+    def test_empty(self):
+        snapshot = self._makeOne()
+        self.assertEqual(len(snapshot), 0)
+        self.assertEqual(snapshot.get('login'), None)
+
+    def test_get(self):
+        from cartouche._compat import u
+        login = u('j\xfcrgen')
+        credentials = [('login%03d' % i, 'UUID%d' % i, 'hash%d' % i,
+                        ('g:%d' % i, 'g:all'))
+                       for i in range(100)]
+        credentials.append((login, 'UUIDJ', None, ()))
+        snapshot = self._makeOne(credentials)
+        self.assertEqual(len(snapshot), 101)
+        self.assertEqual(snapshot.get('login000'),
+                         ('UUID0', 'hash0', ('g:0', 'g:all')))
+        self.assertEqual(snapshot.get('login057'),
+                         ('UUID57', 'hash57', ('g:57', 'g:all')))
+        self.assertEqual(snapshot.get('login099'),
+                         ('UUID99', 'hash99', ('g:99', 'g:all')))
+        self.assertEqual(snapshot.get(login), ('UUIDJ', '', ()))
+        self.assertEqual(snapshot.get('login1000'), None)
+        self.assertEqual(snapshot.get('a', 'default'), 'default')
+        self.assertEqual(snapshot.get('z'), None)
+        self.assertEqual(snapshot.get(None), None)
+
+    def test_get_by_uuid(self):
+        from cartouche._compat import u
+        login = u('j\xfcrgen')
+        # UUID order differs from login order.
+        credentials = [('login%03d' % i, 'UUID%03d' % (99 - i), 'hash%d' % i,
+                        ('g:%d' % i,))
+                       for i in range(100)]
+        credentials.append((login, 'UUIDJ', None, ()))
+        snapshot = self._makeOne(credentials)
+        self.assertEqual(snapshot.get_by_uuid('UUID000'),
+                         ('login099', 'hash99', ('g:99',)))
+        self.assertEqual(snapshot.get_by_uuid('UUID042'),
+                         ('login057', 'hash57', ('g:57',)))
+        self.assertEqual(snapshot.get_by_uuid('UUID099'),
+                         ('login000', 'hash0', ('g:0',)))
+        self.assertEqual(snapshot.get_by_uuid('UUIDJ'), (login, '', ()))
+        self.assertEqual(snapshot.get_by_uuid('UUID100'), None)
+        self.assertEqual(snapshot.get_by_uuid('A', 'default'), 'default')
+        self.assertEqual(snapshot.get_by_uuid(None), None)
+
+    def test_get_by_uuid_empty(self):
+        snapshot = self._makeOne()
+        self.assertEqual(snapshot.get_by_uuid('UUID'), None)
+
+    def test_not_a_snapshot(self):
+        path = self._getPath()
+        with open(path, 'wb') as stream:
+            stream.write(b'bogus data')
+        self.assertRaises(ValueError, self._getTargetClass(), path)
+
+    def test_reload_after_interval(self):
+        from cartouche.snapshot import writeSnapshot
+        now = [1000.0]
+        snapshot = self._makeOne([('login', 'UUID', 'old', ())],
+                                 reload_interval=60,
+                                 timer=lambda: now[0])
+        writeSnapshot(snapshot.path, [('login', 'UUID', 'new', ()),
+                                      ('other', 'UUID2', 'hash', ())])
+
+        now[0] += 30
+        self.assertEqual(snapshot.get('login')[1], 'old')
+        now[0] += 30
+        self.assertEqual(snapshot.get('login')[1], 'new')
+        self.assertEqual(len(snapshot), 2)
+
+    def test_reload_unchanged(self):
+        snapshot = self._makeOne([('login', 'UUID', 'hash', ())])
+        self.assertFalse(snapshot.reload())
+
+    def test_no_reload_interval(self):
+        from cartouche.snapshot import writeSnapshot
+        snapshot = self._makeOne([('login', 'UUID', 'old', ())])
+        writeSnapshot(snapshot.path, [('login', 'UUID', 'new', ())])
+
+        self.assertEqual(snapshot.get('login')[1], 'old')
+        self.assertTrue(snapshot.reload())
+        self.assertEqual(snapshot.get('login')[1], 'new')
+
+
+class Dummy(object):
+    def __init__(self, **kw):
+        self.__dict__.update(kw)
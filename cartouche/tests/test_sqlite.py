@@ -0,0 +1,326 @@
+##############################################################################
+#
+# Copyright (c) 2010 Agendaless Consulting and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+import unittest
+
+
+class _Base(object):
+
+    def setUp(self):
+        import tempfile
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = self.tmpdir + '/registrations.db'
+
+    def tearDown(self):
+        import shutil
+        from cartouche.sqlite import close_database
+        close_database(self.path)
+        shutil.rmtree(self.tmpdir)
+
+    def _makeOne(self, context=None):
+        return self._getTargetClass()(context, self.path)
+
+    def test_class_conforms_to_IRegistrations(self):
+        from zope.interface.verify import verifyClass
+        from cartouche.interfaces import IRegistrations
+        verifyClass(IRegistrations, self._getTargetClass())
+
+    def test_instance_conforms_to_IRegistrations(self):
+        from zope.interface.verify import verifyObject
+        from cartouche.interfaces import IRegistrations
+        verifyObject(IRegistrations, self._makeOne())
+
+    def test_ctor_path_from_settings(self):
+        from pyramid.config import Configurator
+        config = Configurator(settings={'cartouche.sqlite_path': self.path})
+        config.begin()
+        try:
+            adapter = self._getTargetClass()(None)
+        finally:
+            config.end()
+        self.assertEqual(adapter.db.path, self.path)
+
+    def test_get_miss(self):
+        adapter = self._makeOne()
+        self.assertEqual(adapter.get('nonesuch', 'default'), 'default')
+
+    def test_remove_miss(self):
+        adapter = self._makeOne()
+        self.assertRaises(KeyError, adapter.remove, 'nonesuch')
+
+    def test_update_miss(self):
+        adapter = self._makeOne()
+        self.assertRaises(KeyError, adapter.update, 'nonesuch', token='abc')
+
+    def test_update_unknown_field(self):
+        adapter = self._makeOne()
+        self.assertRaises(TypeError, adapter.update, 'nonesuch', bogus=1)
+
+    def test_count_empty(self):
+        adapter = self._makeOne()
+        self.assertEqual(adapter.count(), 0)
+
+
+class PendingRegistrationsTests(_Base, unittest.TestCase):
+
+    def _getTargetClass(self):
+        from cartouche.sqlite import PendingRegistrations
+        return PendingRegistrations
+
+    def test_set_and_get(self):
+        from cartouche.interfaces import IPendingRegistrationInfo
+        adapter = self._makeOne()
+
+        adapter.set('phred@example.com', token='token', created=1.0)
+
+        record = adapter.get('phred@example.com')
+        self.assertTrue(IPendingRegistrationInfo.providedBy(record))
+        self.assertEqual(record.email, 'phred@example.com')
+        self.assertEqual(record.token, 'token')
+        self.assertEqual(record.created, 1.0)
+        self.assertTrue(adapter.get_by_email('phred@example.com') is not None)
+
+    def test_set_defaults_created_to_now(self):
+        from time import time
+        adapter = self._makeOne()
+        before = time()
+
+        adapter.set('phred@example.com', token='token')
+
+        self.assertTrue(adapter.get('phred@example.com').created >= before)
+
+    def test_set_replaces(self):
+        adapter = self._makeOne()
+        adapter.set('phred@example.com', token='old', created=1.0)
+
+        adapter.set('phred@example.com', token='new', created=2.0)
+
+        self.assertEqual(adapter.count(), 1)
+        self.assertEqual(adapter.get('phred@example.com').token, 'new')
+
+    def test_get_by_login_raises(self):
+        adapter = self._makeOne()
+        self.assertRaises(NotImplementedError, adapter.get_by_login, 'login')
+
+    def test_get_by_token_raises(self):
+        adapter = self._makeOne()
+        self.assertRaises(NotImplementedError, adapter.get_by_token, 'token')
+
+    def test_remove(self):
+        adapter = self._makeOne()
+        adapter.set('phred@example.com', token='token')
+
+        adapter.remove('phred@example.com')
+
+        self.assertEqual(adapter.get('phred@example.com'), None)
+
+    def test_expired(self):
+        adapter = self._makeOne()
+        for i in range(4):
+            adapter.set('%d@example.com' % i, token='token', created=float(i))
+
+        self.assertEqual(adapter.expired(2.0),
+                         ['0@example.com', '1@example.com'])
+        self.assertEqual(adapter.expired(3.0, 1), ['0@example.com'])
+
+    def test_page_and_iter(self):
+        adapter = self._makeOne()
+        for email in ('c@example.com', 'a@example.com', 'b@example.com'):
+            adapter.set(email, token='token')
+
+        self.assertEqual([key for key, record in adapter],
+                         ['a@example.com', 'b@example.com', 'c@example.com'])
+        self.assertEqual([key for key, record in adapter.page(size=2)],
+                         ['a@example.com', 'b@example.com'])
+        self.assertEqual([key for key, record
+                            in adapter.page('b@example.com', 2)],
+                         ['c@example.com'])
+        self.assertEqual([key for key, record
+                            in adapter.page(size=1, before='c@example.com')],
+                         ['b@example.com'])
+
+
+class ConfirmedRegistrationsTests(_Base, unittest.TestCase):
+
+    def _getTargetClass(self):
+        from cartouche.sqlite import ConfirmedRegistrations
+        return ConfirmedRegistrations
+
+    def _set(self, adapter, uuid='UUID', email='phred@example.com',
+             login='login', **kw):
+        adapter.set(uuid, email=email, login=login, password='password',
+                    security_question='question', security_answer='answer',
+                    **kw)
+
+    def test_set_and_lookups(self):
+        from cartouche.interfaces import IRegistrationInfo
+        adapter = self._makeOne()
+        self._set(adapter, token='token')
+
+        record = adapter.get('UUID')
+        self.assertTrue(IRegistrationInfo.providedBy(record))
+        self.assertEqual(record.uuid, 'UUID')
+        self.assertEqual(record.login, 'login')
+        self.assertEqual(record.password, 'password')
+        self.assertEqual(record.security_answer, 'answer')
+        self.assertEqual(adapter.get_by_login('login').uuid, 'UUID')
+        self.assertEqual(adapter.get_by_email('phred@example.com').uuid,
+                         'UUID')
+        self.assertEqual(adapter.get_by_token('token').uuid, 'UUID')
+        self.assertEqual(adapter.get_by_login('nonesuch'), None)
+        self.assertEqual(adapter.get_by_token(None), None)
+
+    def test_set_duplicate_login_raises(self):
+        import sqlite3
+        adapter = self._makeOne()
+        self._set(adapter)
+
+        self.assertRaises(sqlite3.IntegrityError, self._set, adapter,
+                          'OTHER', 'other@example.com', 'login')
+        self.assertEqual(adapter.get('UUID').email, 'phred@example.com')
+
+    def test_set_replaces_existing(self):
+        adapter = self._makeOne()
+        self._set(adapter)
+
+        self._set(adapter, login='renamed')
+
+        self.assertEqual(adapter.count(), 1)
+        self.assertEqual(adapter.get_by_login('login'), None)
+        self.assertEqual(adapter.get_by_login('renamed').uuid, 'UUID')
+
+    def test_set_many_is_atomic(self):
+        import sqlite3
+        adapter = self._makeOne()
+        items = [('UUID1', {'email': 'one@example.com', 'login': 'one'}),
+                 ('UUID2', {'email': 'two@example.com', 'login': 'two'}),
+                ]
+
+        self.assertEqual(adapter.set_many(iter(items)), 2)
+        self.assertEqual(adapter.count(), 2)
+
+        clashing = [('UUID3', {'email': 'three@example.com', 'login': 'x'}),
+                    ('UUID4', {'email': 'one@example.com', 'login': 'y'}),
+                   ]
+        self.assertRaises(sqlite3.IntegrityError, adapter.set_many, clashing)
+        self.assertEqual(adapter.get('UUID3'), None)
+
+    def test_update(self):
+        adapter = self._makeOne()
+        self._set(adapter)
+
+        adapter.update('UUID', password=None, token='token')
+
+        record = adapter.get('UUID')
+        self.assertEqual(record.password, None)
+        self.assertEqual(record.token, 'token')
+        self.assertEqual(record.login, 'login')
+
+    def test_get_by_token_expired(self):
+        from time import time
+        adapter = self._makeOne()
+        self._set(adapter, token='token', token_expires=time() - 1)
+
+        self.assertEqual(adapter.get_by_token('token', 'default'), 'default')
+
+    def test_purge_expired_tokens(self):
+        adapter = self._makeOne()
+        for i in range(3):
+            self._set(adapter, 'UUID%d' % i, '%d@example.com' % i,
+                      'login%d' % i, token='token%d' % i,
+                      token_expires=1000.0 * (i + 1))
+
+        self.assertEqual(adapter.purge_expired_tokens(2500, 1), 1)
+        self.assertEqual(adapter.purge_expired_tokens(2500), 1)
+        self.assertEqual(adapter.purge_expired_tokens(2500), 0)
+
+        self.assertEqual(adapter.get('UUID0').token, None)
+        self.assertEqual(adapter.get('UUID2').token, 'token2')
+
+    def test_search_case_insensitive_prefix(self):
+        adapter = self._makeOne()
+        self._set(adapter, 'UUID1', 'phred@example.com', 'Phred')
+        self._set(adapter, 'UUID2', 'bharney@example.com', 'bharney')
+        self._set(adapter, 'UUID3', 'wilma@example.com', 'ph_ilma')
+
+        found = adapter.search('PH')
+        self.assertEqual([key for key, record in found], ['UUID1', 'UUID3'])
+        self.assertEqual([key for key, record in adapter.search('ph_')],
+                         ['UUID3'])
+        self.assertEqual([key for key, record in adapter.search('bharney@')],
+                         ['UUID2'])
+        self.assertEqual(adapter.search(''), [])
+
+    def test_connection_per_thread(self):
+        from threading import Thread
+        adapter = self._makeOne()
+        self._set(adapter)
+        found = []
+        def _lookup():
+            found.append((adapter.db.connection(),
+                          adapter.get_by_login('login').uuid))
+        thread = Thread(target=_lookup)
+        thread.start()
+        thread.join()
+
+        conn, uuid = found[0]
+        self.assertEqual(uuid, 'UUID')
+        self.assertFalse(conn is adapter.db.connection())
+
+    def test_connection_closed_when_thread_exits(self):
+        import gc
+        import sqlite3
+        from threading import Thread
+        adapter = self._makeOne()
+        found = []
+        thread = Thread(target=lambda: found.append(adapter.db.connection()))
+        thread.start()
+        thread.join()
+        gc.collect()
+
+        self.assertRaises(sqlite3.ProgrammingError, found[0].execute,
+                          'SELECT 1')
+        self.assertEqual(len(adapter.db._holders), 0)
+
+    def test_search_uses_nocase_indexes(self):
+        adapter = self._makeOne()
+        conn = adapter.db.connection()
+        executed = []
+        conn.set_trace_callback(executed.append)
+        try:
+            adapter.search('ph')
+        finally:
+            conn.set_trace_callback(None)
+        plan = ' '.join([row[3] for row in conn.execute(
+                            'EXPLAIN QUERY PLAN ' + executed[-1])])
+        self.assertTrue('confirmed_login_nocase' in plan)
+        self.assertTrue('confirmed_email_nocase' in plan)
+        self.assertFalse('SCAN' in plan)
+
+    def test_wal_mode(self):
+        adapter = self._makeOne()
+        mode = adapter.db.connection().execute(
+                    'PRAGMA journal_mode').fetchone()[0]
+        self.assertEqual(mode, 'wal')
+
+
+class Test_get_database(unittest.TestCase):
+
+    def test_shared_until_closed(self):
+        from cartouche.sqlite import close_database
+        from cartouche.sqlite import get_database
+        db = get_database('/nonesuch/shared.db')
+        self.assertTrue(get_database('/nonesuch/shared.db') is db)
+        close_database('/nonesuch/shared.db')
+        self.assertFalse(get_database('/nonesuch/shared.db') is db)
+        close_database('/nonesuch/shared.db')
@@ -76,6 +76,28 @@ class Test_view_url(_Base, unittest.TestCase):
         self.assertEqual(self._callFUT(baz='qux'),
                          'http://other.example.com/?foo=bar&baz=qux')
 
+    def test_w_utility_relative_w_dots_params_fragment(self):
+        self.config.registry.settings['cartouche.view_url'
+                                     ] = '/a/../somewhere.html;p?foo=bar#top'
+        self.assertEqual(
+            self._callFUT(baz='qux'),
+            'http://example.com/somewhere.html;p?foo=bar&baz=qux#top')
+
+    def test_w_utility_scheme_relative(self):
+        self.config.registry.settings['cartouche.view_url'
+                                     ] = '//other.example.com/'
+        self.assertEqual(self._callFUT(baz='qux'),
+                         'http://other.example.com/?baz=qux')
+
+    def test_settings_parsed_once_per_registry(self):
+        from cartouche.util import getURLResolver
+        settings = self.config.registry.settings
+        settings['cartouche.view_url'] = '/somewhere.html'
+        resolver = getURLResolver(self.config.registry)
+        self.assertTrue(getURLResolver(self.config.registry) is resolver)
+        settings['cartouche.view_url'] = '/elsewhere.html'
+        self.assertEqual(self._callFUT(), 'http://example.com/somewhere.html')
+
 
 class Test_uuidRandomToken(unittest.TestCase):
 
@@ -119,6 +141,215 @@ class Test_getRandomToken(_Base, unittest.TestCase):
         self.assertEqual(token, 'RANDOM')
 
 
+class Test_timeOrderedUserId(unittest.TestCase):
+
+    def setUp(self):
+        from cartouche import util
+        self._saved = util._last_userid[:]
+        util._last_userid[:] = [0, 0]
+
+    def tearDown(self):
+        from cartouche import util
+        util._last_userid[:] = self._saved
+
+    def _callFUT(self, timer):
+        from cartouche.util import timeOrderedUserId
+        return timeOrderedUserId(timer)
+
+    def test_provides_IUserIdGenerator(self):
+        from zope.interface.verify import verifyObject
+        from cartouche.interfaces import IUserIdGenerator
+        from cartouche.util import timeOrderedUserId
+        verifyObject(IUserIdGenerator, timeOrderedUserId)
+
+    def test_format(self):
+        from uuid import UUID
+        from uuid import RFC_4122
+        userid = UUID(self._callFUT(lambda: 2000000000.0))
+        self.assertEqual(userid.version, 7)
+        self.assertEqual(userid.variant, RFC_4122)
+        self.assertEqual(userid.int >> 80, 2000000000000)
+
+    def test_ordered_by_time(self):
+        now = [2000000001.0]
+        ids = []
+        for i in range(5):
+            ids.append(self._callFUT(lambda: now[0]))
+            now[0] += 0.001
+        self.assertEqual(sorted(ids), ids)
+
+    def test_ordered_within_millisecond(self):
+        ids = [self._callFUT(lambda: 2000000002.0) for i in range(100)]
+        self.assertEqual(sorted(ids), ids)
+        self.assertEqual(len(set(ids)), 100)
+
+    def test_clock_moves_backward(self):
+        first = self._callFUT(lambda: 2000000003.0)
+        second = self._callFUT(lambda: 2000000000.0)
+        self.assertTrue(second > first)
+
+
+class Test_getNewUserId(_Base, unittest.TestCase):
+
+    def _callFUT(self, request=None):
+        from cartouche.util import getNewUserId
+        if request is None:
+            request = self._makeRequest()
+        return getNewUserId(request)
+
+    def test_wo_utility_wo_setting_uses_token_generator(self):
+        def _tokenGenerator():
+            return 'RANDOM'
+        from cartouche.interfaces import ITokenGenerator
+        self.config.registry.registerUtility(_tokenGenerator, ITokenGenerator)
+        self.assertEqual(self._callFUT(), 'RANDOM')
+
+    def test_w_setting_time_ordered(self):
+        from uuid import UUID
+        self.config.registry.settings['cartouche.userid_generator'] = \
+            'time_ordered'
+        self.assertEqual(UUID(self._callFUT()).version, 7)
+
+    def test_w_setting_random(self):
+        from uuid import UUID
+        self.config.registry.settings['cartouche.userid_generator'] = 'random'
+        self.assertEqual(UUID(self._callFUT()).version, 4)
+
+    def test_w_setting_dotted_name(self):
+        from uuid import UUID
+        self.config.registry.settings['cartouche.userid_generator'] = \
+            'cartouche.util.timeOrderedUserId'
+        self.assertEqual(UUID(self._callFUT()).version, 7)
+
+    def test_w_utility(self):
+        from cartouche.interfaces import IUserIdGenerator
+        self.config.registry.settings['cartouche.userid_generator'] = 'random'
+        self.config.registry.registerUtility(lambda: 'USERID',
+                                             IUserIdGenerator)
+        self.assertEqual(self._callFUT(), 'USERID')
+
+
+class Test_getMailDelivery(_Base, unittest.TestCase):
+
+    def _callFUT(self, request=None):
+        from cartouche.util import getMailDelivery
+        if request is None:
+            request = self._makeRequest()
+        return getMailDelivery(request)
+
+    def test_default(self):
+        from cartouche.util import localhost_mta
+        self.assertTrue(self._callFUT() is localhost_mta)
+
+    def test_w_mail_queue_setting(self):
+        from repoze.sendmail.delivery import QueuedMailDelivery
+        self.config.registry.settings['cartouche.mail_queue'] = '/tmp/mailq'
+        delivery = self._callFUT()
+        self.assertTrue(isinstance(delivery, QueuedMailDelivery))
+        self.assertEqual(delivery.queuePath, '/tmp/mailq')
+
+    def test_w_utility(self):
+        from repoze.sendmail.interfaces import IMailDelivery
+        delivery = DummyMailer()
+        self.config.registry.settings['cartouche.mail_queue'] = '/tmp/mailq'
+        self.config.registry.registerUtility(delivery, IMailDelivery)
+        self.assertTrue(self._callFUT() is delivery)
+
+
+class Test_renderBlankForm(_Base, unittest.TestCase):
+
+    def setUp(self):
+        from cartouche import util
+        super(Test_renderBlankForm, self).setUp()
+        self._saved, util._blank_forms = util._blank_forms, {}
+
+    def tearDown(self):
+        from cartouche import util
+        util._blank_forms = self._saved
+        super(Test_renderBlankForm, self).tearDown()
+
+    def _callFUT(self, request, name, factory, **values):
+        from cartouche.util import renderBlankForm
+        return renderBlankForm(request, name, factory, **values)
+
+    def _makeFactory(self):
+        rendered = self._rendered = []
+        class DummyForm(object):
+            def render(self, appstruct):
+                rendered.append(appstruct)
+                if isinstance(appstruct, dict):
+                    return '<input value="%s"/>' % appstruct['came_from']
+                return '<form/>'
+        return DummyForm
+
+    def test_caches_rendering(self):
+        from colander import null
+        factory = self._makeFactory()
+        request = self._makeRequest()
+        self.assertEqual(self._callFUT(request, 'name', factory), '<form/>')
+        self.assertEqual(self._callFUT(request, 'name', factory), '<form/>')
+        self.assertEqual(self._rendered, [null])
+
+    def test_keyed_by_locale(self):
+        factory = self._makeFactory()
+        request = self._makeRequest()
+        self._callFUT(request, 'name', factory)
+        request = self._makeRequest()
+        request.locale_name = 'de'
+        self._callFUT(request, 'name', factory)
+        self.assertEqual(len(self._rendered), 2)
+
+    def test_substitutes_escaped_values(self):
+        factory = self._makeFactory()
+        request = self._makeRequest()
+        self.assertEqual(
+            self._callFUT(request, 'name', factory,
+                          came_from='http://example.com/?a=1&b="2"'),
+            '<input value="http://example.com/?a=1&amp;b=&quot;2&quot;"/>')
+        self.assertEqual(self._callFUT(request, 'name', factory,
+                                       came_from=None),
+                         '<input value=""/>')
+        self.assertEqual(len(self._rendered), 1)
+
+    def test_w_reload_templates(self):
+        factory = self._makeFactory()
+        self.config.registry.settings['reload_templates'] = True
+        request = self._makeRequest()
+        self._callFUT(request, 'name', factory)
+        self._callFUT(request, 'name', factory)
+        self.assertEqual(len(self._rendered), 2)
+
+    def test_real_form(self):
+        from colander import Schema
+        from colander import SchemaNode
+        from colander import String
+        from deform import Form
+        from deform.widget import HiddenWidget
+        class Login(Schema):
+            came_from = SchemaNode(String(), widget=HiddenWidget())
+        def factory():
+            return Form(Login(), buttons=('login',))
+        request = self._makeRequest()
+        html = self._callFUT(request, 'login', factory, came_from='/a<b')
+        self.assertTrue('value="/a&lt;b"' in html)
+        html = self._callFUT(request, 'login', factory, came_from='/c')
+        self.assertTrue('value="/c"' in html)
+
+
+class Test_getMainTemplate(_Base, unittest.TestCase):
+
+    def _callFUT(self, request):
+        from cartouche.util import getMainTemplate
+        return getMainTemplate(request)
+
+    def test_resolved_once_per_registry(self):
+        mtr = self.config.testing_add_template('templates/main.pt')
+        request = self._makeRequest()
+        self.assertTrue(self._callFUT(request) is mtr.implementation())
+        self.config.testing_add_template('templates/main.pt')
+        self.assertTrue(self._callFUT(request) is mtr.implementation())
+
+
 class Test_randomPassword(unittest.TestCase):
 
     def _callFUT(self):
@@ -347,6 +578,8 @@ class DummyConfirmed:
         return self._records.get(uuid, default)
     def set(self, uuid, **kw):
         self._records[uuid] = Dummy(uuid=uuid, **kw)
+    def update(self, uuid, **changes):
+        self._records[uuid].__dict__.update(changes)
 
 
 class DummyMailer:
@@ -0,0 +1,113 @@
+##############################################################################
+#
+# Copyright (c) 2010 Agendaless Consulting and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+import unittest
+
+
+class Test_useTemplateCache(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+        from chameleon.template import BaseTemplate
+        self._loader = BaseTemplate.loader
+        self._tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        from chameleon.template import BaseTemplate
+        BaseTemplate.loader = self._loader
+        shutil.rmtree(self._tempdir)
+
+    def _callFUT(self, path):
+        from cartouche.warmup import useTemplateCache
+        return useTemplateCache(path)
+
+    def test_creates_directory_and_compiles_into_it(self):
+        import os
+        from chameleon.zpt.template import PageTemplate
+        path = os.path.join(self._tempdir, 'cache')
+        self._callFUT(path)
+        template = PageTemplate('<p>${name}</p>')
+        self.assertEqual(template(name='phred'), '<p>phred</p>')
+        self.assertTrue([x for x in os.listdir(path) if x.endswith('.py')])
+
+
+class Test_templateNames(unittest.TestCase):
+
+    def _callFUT(self, directory):
+        from cartouche.warmup import templateNames
+        return list(templateNames(directory))
+
+    def test_it(self):
+        import os
+        import shutil
+        import tempfile
+        tempdir = tempfile.mkdtemp()
+        try:
+            os.mkdir(os.path.join(tempdir, 'readonly'))
+            for name in ('form.pt', 'textinput.pt', 'README.txt',
+                         os.path.join('readonly', 'textinput.pt')):
+                open(os.path.join(tempdir, name), 'w').close()
+            self.assertEqual(self._callFUT(tempdir),
+                             ['form', 'textinput', 'readonly/textinput'])
+        finally:
+            shutil.rmtree(tempdir)
+
+
+class Test_warmup(unittest.TestCase):
+
+    def setUp(self):
+        from pyramid.config import Configurator
+        import pyramid_chameleon
+        self.config = Configurator(autocommit=True)
+        self.config.begin()
+        self.config.include(pyramid_chameleon)
+
+    def tearDown(self):
+        self.config.end()
+
+    def _callFUT(self, registry):
+        from cartouche.warmup import warmup
+        return warmup(registry)
+
+    def _makeRenderer(self):
+        loaded = self._loaded = []
+        class DummyTemplate(object):
+            def cook_check(self):
+                pass
+        class DummyRenderer(object):
+            def load(self, name):
+                loaded.append(name)
+                return DummyTemplate()
+        return DummyRenderer()
+
+    def test_it(self):
+        from deform import Form
+        from pyramid.renderers import get_renderer
+        from cartouche.registration import deform_templates_dir
+        from cartouche.warmup import templateNames
+        registry = self.config.registry
+        renderer = self._makeRenderer()
+        saved, Form.default_renderer = Form.default_renderer, renderer
+        try:
+            count = self._callFUT(registry)
+        finally:
+            Form.default_renderer = saved
+        self.assertEqual(self._loaded,
+                         list(templateNames(deform_templates_dir)))
+        self.assertTrue('form' in self._loaded)
+        self.assertEqual(count, len(self._loaded) + 8)
+        main = get_renderer('cartouche:templates/main.pt',
+                            registry=registry).implementation()
+        self.assertTrue(main._cooked)
+        self.assertTrue(registry._cartouche_main_template is main)
@@ -48,12 +48,12 @@ class WhoPluginTests(unittest.TestCase):
         from cartouche.whoplugin import WhoPlugin
         return WhoPlugin
 
-    def _makeOne(self, zodb_uri=_marker):
+    def _makeOne(self, zodb_uri=_marker, **kw):
         if zodb_uri is _marker:
             import os
             filename = os.path.join(self._getTempdir(), 'Data.fs')
             zodb_uri = 'file://%s' % filename
-        return self._getTargetClass()(zodb_uri)
+        return self._getTargetClass()(zodb_uri, **kw)
 
     def _populate(self, app):
         from zope.password.password import SSHAPasswordManager
@@ -68,16 +68,22 @@ class WhoPluginTests(unittest.TestCase):
         from cartouche.interfaces import IRegistrations
         pwd_mgr = SSHAPasswordManager()
         encoded = pwd_mgr.encodePassword('password')
+        record = Dummy(uuid='UUID', password=encoded)
         class DummyConfirmed:
             def __init__(self, context):
                 pass
+            def get(self, key, default=None):
+                if key == 'UUID':
+                    return record
+                return default
             def get_by_login(self, login, default=None):
                 if login == 'login':
-                    return Dummy(uuid='UUID', password=encoded)
+                    return record
                 return default
         self.config.registry.registerAdapter(DummyConfirmed,
                                              (None,), IRegistrations,
                                              name='confirmed')
+        return record
 
     def _makeFauxConn(self):
         conn = FauxConnection()
@@ -107,6 +113,11 @@ class WhoPluginTests(unittest.TestCase):
         from repoze.who.interfaces import IAuthenticator
         verifyClass(IAuthenticator, self._getTargetClass())
 
+    def test_class_conforms_to_IMetadataProvider(self):
+        from zope.interface.verify import verifyClass
+        from repoze.who.interfaces import IMetadataProvider
+        verifyClass(IMetadataProvider, self._getTargetClass())
+
     def test_instance_conforms_to_IAuthenticationPlugin(self):
         from zope.interface.verify import verifyObject
         from repoze.who.interfaces import IAuthenticator
@@ -130,6 +141,150 @@ class WhoPluginTests(unittest.TestCase):
         plugin = self._makeOne('file:///dev/null') # Don't fall back!
         self.assertEqual(plugin.authenticate(environ, credentials), 'UUID')
 
+    def test_hit_w_cache_skips_password_check(self):
+        self._registerConfirmed()
+        credentials = {'login': 'login', 'password': 'password'}
+        plugin = self._makeOne('file:///dev/null', cache_size=10)
+        self.assertEqual(plugin.authenticate({}, credentials), 'UUID')
+        checked = []
+        def _check(hashed, password):
+            checked.append(password)
+            return False
+        plugin._pwd_mgr.checkPassword = _check
+        self.assertEqual(plugin.authenticate({}, credentials), 'UUID')
+        self.assertEqual(checked, [])
+        self.assertEqual(plugin._verified.hits, 1)
+
+    def test_miss_w_cache_wrong_password_not_cached(self):
+        self._registerConfirmed()
+        plugin = self._makeOne('file:///dev/null', cache_size=10)
+        self.assertEqual(plugin.authenticate(
+                            {}, {'login': 'login', 'password': 'password'}),
+                         'UUID')
+        self.assertEqual(plugin.authenticate(
+                            {}, {'login': 'login', 'password': 'bogus'}),
+                         None)
+        self.assertEqual(len(plugin._verified), 0)
+
+    def test_w_cache_password_hash_changed(self):
+        from zope.password.password import SSHAPasswordManager
+        record = self._registerConfirmed()
+        credentials = {'login': 'login', 'password': 'password'}
+        plugin = self._makeOne('file:///dev/null', cache_size=10)
+        self.assertEqual(plugin.authenticate({}, credentials), 'UUID')
+        record.password = SSHAPasswordManager().encodePassword('changed')
+        self.assertEqual(plugin.authenticate({}, credentials), None)
+        self.assertEqual(len(plugin._verified), 0)
+
+    def test_hit_w_get_credentials_skips_record(self):
+        from zope.password.password import SSHAPasswordManager
+        from cartouche.interfaces import IRegistrations
+        encoded = SSHAPasswordManager().encodePassword('password')
+        class DummyConfirmed:
+            def __init__(self, context):
+                pass
+            def get_credentials(self, login, default=None):
+                if login == 'login':
+                    return ('UUID', encoded)
+                return default
+            def get_by_login(self, login, default=None):
+                raise AssertionError('record loaded')
+        self.config.registry.registerAdapter(DummyConfirmed,
+                                             (None,), IRegistrations,
+                                             name='confirmed')
+        plugin = self._makeOne('file:///dev/null')
+        self.assertEqual(plugin.authenticate(
+                            {}, {'login': 'login', 'password': 'password'}),
+                         'UUID')
+        self.assertEqual(plugin.authenticate(
+                            {}, {'login': 'other', 'password': 'password'}),
+                         None)
+
+    def test_miss_w_no_password(self):
+        record = self._registerConfirmed()
+        record.password = None
+        credentials = {'login': 'login', 'password': 'password'}
+        plugin = self._makeOne('file:///dev/null')
+        self.assertEqual(plugin.authenticate({}, credentials), None)
+
+    def test_miss_w_blank_password(self):
+        record = self._registerConfirmed()
+        record.password = ''
+        credentials = {'login': 'login', 'password': ''}
+        plugin = self._makeOne('file:///dev/null')
+        self.assertEqual(plugin.authenticate({}, credentials), None)
+
+    def test_w_snapshot(self):
+        from zope.password.password import SSHAPasswordManager
+        encoded = SSHAPasswordManager().encodePassword('password')
+        class DummySnapshot(object):
+            def get(self, login, default=None):
+                if login == 'login':
+                    return ('UUID', encoded, ('g:admin',))
+                return default
+        plugin = self._makeOne(None, snapshot=DummySnapshot())
+        identity = {'login': 'login', 'password': 'password'}
+        self.assertEqual(plugin.authenticate({}, identity), 'UUID')
+        identity = {'login': 'login', 'password': 'bogus'}
+        self.assertEqual(plugin.authenticate({}, identity), None)
+        identity = {'login': 'other', 'password': 'password'}
+        self.assertEqual(plugin.authenticate({}, identity), None)
+        plugin.close()
+
+    def test_add_metadata_w_snapshot(self):
+        from cartouche.whoplugin import CONFIRMED_KEY
+        class DummySnapshot(object):
+            def get_by_uuid(self, uuid, default=None):
+                if uuid == 'UUID':
+                    return ('login', 'hashed', ('g:admin',))
+                return default
+        plugin = self._makeOne(None, snapshot=DummySnapshot())
+        identity = {'repoze.who.userid': 'UUID'}
+        plugin.add_metadata({}, identity)
+        self.assertEqual(identity[CONFIRMED_KEY], True)
+        self.assertEqual(identity['groups'], ('g:admin',))
+        identity = {'repoze.who.userid': 'REMOVED'}
+        plugin.add_metadata({}, identity)
+        self.assertFalse(CONFIRMED_KEY in identity)
+        self.assertFalse('groups' in identity)
+
+    def test_add_metadata_w_configured_adapters(self):
+        from cartouche.interfaces import IGroups
+        from cartouche.whoplugin import CONFIRMED_KEY
+        self._registerConfirmed()
+        class DummyGroups:
+            def __init__(self, context):
+                pass
+            def groups_of(self, uuid):
+                return iter(['g:%s' % uuid])
+        self.config.registry.registerAdapter(DummyGroups, (None,), IGroups)
+        plugin = self._makeOne('file:///dev/null')
+        identity = {'repoze.who.userid': 'UUID'}
+        plugin.add_metadata({}, identity)
+        self.assertEqual(identity[CONFIRMED_KEY], True)
+        self.assertEqual(identity['groups'], ('g:UUID',))
+        identity = {'repoze.who.userid': 'REMOVED'}
+        plugin.add_metadata({}, identity)
+        self.assertFalse(CONFIRMED_KEY in identity)
+        self.assertFalse('groups' in identity)
+
+    def test_add_metadata_w_persistent_context(self):
+        import transaction
+        from cartouche.whoplugin import CONFIRMED_KEY
+        self._makeFilestorage()
+        plugin = self._makeOne()
+        try:
+            identity = {'repoze.who.userid': 'UUID'}
+            plugin.add_metadata({}, identity)
+            self.assertEqual(identity[CONFIRMED_KEY], True)
+            self.assertEqual(identity['groups'], ())
+            identity = {'repoze.who.userid': 'REMOVED'}
+            plugin.add_metadata({}, identity)
+            self.assertFalse(CONFIRMED_KEY in identity)
+        finally:
+            transaction.abort()
+            plugin.close()
+
     def test_miss_w_persistent_context(self):
         from pyramid.threadlocal import manager
         context = self._makeContext(_p_jar=object())
@@ -187,6 +342,28 @@ class WhoPluginTests(unittest.TestCase):
         finally:
             plugin.close()
 
+    def test_plugins_share_db_and_request_connection(self):
+        from cartouche.databases import CONNECTION_KEY
+        self._makeFilestorage()
+        environ = {}
+        credentials = {'login': 'login', 'password': 'password'}
+        plugin = self._makeOne()
+        other = self._makeOne()
+        try:
+            self.assertEqual(plugin.authenticate(environ, credentials), 'UUID')
+            conn = environ[CONNECTION_KEY]
+            self.assertEqual(other.authenticate(environ, credentials), 'UUID')
+            self.assertTrue(environ[CONNECTION_KEY] is conn)
+            self.assertTrue(plugin._getFinder().db is other._getFinder().db)
+            db = plugin._getFinder().db
+            plugin.close()
+            # Still open for the other plugin.
+            self.assertTrue(other._getFinder().db is db)
+            self.assertTrue(db.open() is not None)
+        finally:
+            plugin.close()
+            other.close()
+
 
 class Test_make_plugin(unittest.TestCase):
 
@@ -197,6 +374,46 @@ class Test_make_plugin(unittest.TestCase):
         plugin = make_plugin(URI)
         self.assertTrue(isinstance(plugin, WhoPlugin))
         self.assertEqual(plugin._zodb_uri, URI)
+        self.assertEqual(plugin._verified, None)
+
+    def test_w_cache(self):
+        URI = "file:///tmp/Data.fs"
+        from cartouche.whoplugin import make_plugin
+        plugin = make_plugin(URI, cache_size='100', cache_ttl='30')
+        self.assertEqual(plugin._verified.maxsize, 100)
+        self.assertEqual(plugin._verified.ttl, 30.0)
+
+    def test_w_cache_imports_no_application_stack(self):
+        import subprocess
+        import sys
+        script = ('import sys\n'
+                  'from cartouche.whoplugin import make_plugin\n'
+                  'make_plugin("file:///tmp/Data.fs", cache_size="100")\n'
+                  'print(sorted(set(sys.modules) & set(%r)))'
+                  % (['pyramid', 'cartouche.util', 'ZODB'],))
+        output = subprocess.check_output([sys.executable, '-c', script])
+        self.assertEqual(output.strip(), b'[]')
+
+    def test_w_snapshot(self):
+        import os
+        import shutil
+        from tempfile import mkdtemp
+        from cartouche.snapshot import writeSnapshot
+        from cartouche.whoplugin import make_plugin
+        tempdir = mkdtemp('whoplugintests')
+        try:
+            path = os.path.join(tempdir, 'credentials.snap')
+            writeSnapshot(path, [])
+            plugin = make_plugin(snapshot=path, snapshot_reload='30')
+            self.assertEqual(plugin._zodb_uri, None)
+            self.assertEqual(plugin._snapshot.path, path)
+            self.assertEqual(plugin._snapshot.reload_interval, 30.0)
+        finally:
+            shutil.rmtree(tempdir)
+
+    def test_wo_zodb_uri_or_snapshot(self):
+        from cartouche.whoplugin import make_plugin
+        self.assertRaises(ValueError, make_plugin)
 
 
 class Dummy(object):
@@ -213,3 +430,4 @@ class FauxCartouche(object):
     def __init__(self):
         self.by_uuid = {}
         self.by_login = {}
+        self.user_groups = {}
@@ -15,11 +15,17 @@ from email.message import Message
 from random import choice
 from random import randrange
 from string import digits
+from threading import Lock
+from time import time
+from uuid import UUID
 from uuid import uuid4
 
+from colander import null
+from pyramid.path import DottedNameResolver
+from pyramid.renderers import get_renderer
 from pyramid.url import resource_url
 from repoze.sendmail.delivery import DirectMailDelivery
-from repoze.sendmail.mailer import SMTPMailer
+from repoze.sendmail.delivery import QueuedMailDelivery
 from repoze.sendmail.interfaces import IMailDelivery
 from repoze.who.api import get_api
 from zope.interface import directlyProvides
@@ -29,6 +35,9 @@ from .interfaces import IAutoLogin
 from .interfaces import ICameFromURL
 from .interfaces import IPasswordGenerator
 from .interfaces import ITokenGenerator
+from .interfaces import IUserIdGenerator
+from .mailer import PooledSMTPMailer
+from ._compat import escape
 from ._compat import letters
 from ._compat import url_encode
 from ._compat import parse_qsl
@@ -36,26 +45,136 @@ from ._compat import urljoin
 from ._compat import urlparse
 from ._compat import urlunparse
 
-# By default, deliver e-mail via localhost, port 25.
-localhost_mta = DirectMailDelivery(SMTPMailer())
+# By default, deliver e-mail via localhost, port 25, reusing connections.
+localhost_mta = DirectMailDelivery(PooledSMTPMailer())
 
 
-def _fixup_url(context, request, base_url, **extra_qs):
-    if base_url.startswith('/'):
-        base_url = urljoin(resource_url(context, request), base_url)
-    (sch, netloc, path, parms, qs, frag) = urlparse(base_url)
-    qs_items = parse_qsl(qs) + list(extra_qs.items())
-    qs = url_encode(qs_items, 1)
-    return urlunparse((sch, netloc, path, parms, qs, frag))
+def getMailDelivery(request):
+    """ Return the delivery for outgoing e-mail.
 
+    Prefer a registered 'IMailDelivery' utility;  else, if the
+    'cartouche.mail_queue' setting names a maildir, queue messages there when
+    the transaction commits (see 'cartouche.mailqueue');  else send them via
+    'localhost_mta'.
+    """
+    registry = request.registry
+    delivery = registry.queryUtility(IMailDelivery)
+    if delivery is None:
+        settings = registry.settings or {}
+        queue_path = settings.get('cartouche.mail_queue')
+        if queue_path:
+            delivery = QueuedMailDelivery(queue_path)
+        else:
+            delivery = localhost_mta
+    return delivery
 
-def view_url(context, request, key, default_name, **extra_qs):
-    configured = request.registry.settings.get('cartouche.%s' % key)
-    if configured is None:
+
+_blank_forms = {}
+_SLOT = '__cartouche_slot_%s__'
+
+
+def renderBlankForm(request, name, form_factory, **values):
+    """ Return the HTML of the blank form built by 'form_factory'.
+
+    The rendering is cached per process, keyed on 'name' and the request's
+    locale;  'values' are per-request field values (e.g., 'came_from'),
+    substituted into the cached HTML.  With 'reload_templates' set, the form
+    is rendered afresh each time.
+    """
+    settings = request.registry.settings or {}
+    key = (name, getattr(request, 'locale_name', None))
+    html = _blank_forms.get(key)
+    if html is None or settings.get('reload_templates'):
+        appstruct = dict([(field, _SLOT % field) for field in values])
+        html = form_factory().render(appstruct or null)
+        _blank_forms[key] = html
+    for field, value in values.items():
+        if value is None:
+            value = ''
+        html = html.replace(_SLOT % field, escape(value, True))
+    return html
+
+
+def getMainTemplate(request):
+    """ Return the 'templates/main.pt' template, for its 'main' macro.
+
+    The template is resolved once per registry, rather than on each request.
+    """
+    registry = request.registry
+    template = getattr(registry, '_cartouche_main_template', None)
+    if template is None:
+        renderer = get_renderer('templates/main.pt', registry=registry)
+        template = registry._cartouche_main_template = \
+            renderer.implementation()
+    return template
+
+
+class URLResolver(object):
+    """ Compute the URLs of views, honoring the 'cartouche.*_url' settings.
+
+    Configured URLs are parsed once, when the resolver is created (or when
+    a key is first used);  each call then only joins the application URL
+    and the extra query string.
+    """
+    def __init__(self, settings):
+        self.settings = settings
+        self._compiled = {}
+        for name, value in settings.items():
+            if name.startswith('cartouche.') and name.endswith('_url'):
+                self._compiled[name[len('cartouche.'):]] = self._compile(value)
+
+    def _compile(self, url):
+        # Return '(join, head, query, fragment)', or None if not configured.
+        if url is None:
+            return None
+        (sch, netloc, path, parms, qs, frag) = urlparse(url)
+        join = url.startswith('/')
+        if join and not netloc:
+            # Resolve dot segments, as joining to the site URL would.
+            path = urljoin('/', path)
+        head = urlunparse((sch, netloc, path, parms, '', ''))
+        return (join, head, url_encode(parse_qsl(qs), 1), frag)
+
+    def __call__(self, context, request, key, default_name, **extra_qs):
+        try:
+            compiled = self._compiled[key]
+        except KeyError:
+            compiled = self._compiled[key] = self._compile(
+                                self.settings.get('cartouche.%s' % key))
+        if compiled is None:
+            if extra_qs:
+                return request.resource_url(context, default_name,
+                                            query=extra_qs)
+            return request.resource_url(context, default_name)
+        join, url, query, frag = compiled
+        if join:
+            if url.startswith('//'):  # scheme-relative
+                url = urljoin(request.host_url, url)
+            else:
+                url = request.host_url + url
         if extra_qs:
-            return request.resource_url(context, default_name, query=extra_qs)
-        return request.resource_url(context, default_name)
-    return _fixup_url(context, request, configured, **extra_qs)
+            extra = url_encode(list(extra_qs.items()), 1)
+            query = query and '%s&%s' % (query, extra) or extra
+        if query:
+            url = '%s?%s' % (url, query)
+        if frag:
+            url = '%s#%s' % (url, frag)
+        return url
+
+
+def getURLResolver(registry):
+    """ Return the registry's :class:`URLResolver`, creating it if needed.
+    """
+    resolver = getattr(registry, '_cartouche_url_resolver', None)
+    if resolver is None:
+        resolver = registry._cartouche_url_resolver = URLResolver(
+                                                registry.settings or {})
+    return resolver
+
+
+def view_url(context, request, key, default_name, **extra_qs):
+    return getURLResolver(request.registry)(context, request, key,
+                                            default_name, **extra_qs)
 
 
 def uuidRandomToken():
@@ -69,6 +188,63 @@ def getRandomToken(request):
     return generator()
 
 
+_last_userid = [0, 0]  # (milliseconds, counter) of the last id generated
+_userid_lock = Lock()
+
+
+def timeOrderedUserId(timer=time):
+    """ Return a UUIDv7-style id, ordered by creation time.
+
+    The leading 48 bits hold the time in milliseconds, followed by a 12-bit
+    counter (randomly seeded each millisecond, so that ids made by one
+    process stay ordered) and 62 random bits.  Ids made close together
+    sort close together, and so land in the same BTree buckets.
+    """
+    millis = int(timer() * 1000)
+    with _userid_lock:
+        last_millis, counter = _last_userid
+        if millis <= last_millis:
+            millis, counter = last_millis, counter + 1
+            if counter > 0xfff:
+                millis, counter = millis + 1, 0
+        else:
+            counter = randrange(0x800)
+        _last_userid[:] = [millis, counter]
+    value = ((millis & 0xffffffffffff) << 80 |
+             0x7 << 76 |
+             counter << 64 |
+             0x2 << 62 |
+             randrange(1 << 62))
+    return str(UUID(int=value))
+directlyProvides(timeOrderedUserId, IUserIdGenerator)
+
+
+USERID_GENERATORS = {
+    'random': uuidRandomToken,
+    'time_ordered': timeOrderedUserId,
+}
+
+
+def getNewUserId(request):
+    """ Return an id for a newly-confirmed user.
+
+    Use the 'IUserIdGenerator' utility if registered;  else the generator
+    named by the 'cartouche.userid_generator' setting ('random',
+    'time_ordered', or a dotted name);  else the 'ITokenGenerator' utility.
+    """
+    registry = request.registry
+    generator = registry.queryUtility(IUserIdGenerator)
+    if generator is None:
+        settings = registry.settings or {}
+        name = settings.get('cartouche.userid_generator')
+        if name is None:
+            return getRandomToken(request)
+        generator = USERID_GENERATORS.get(name)
+        if generator is None:
+            generator = DottedNameResolver().resolve(name)
+    return generator()
+
+
 def randomPassword():
     result = []
     for _ in range(randrange(6, 8)):
@@ -114,17 +290,9 @@ def sendGeneratedPassword(request, uuid, confirmed):
                                               default=randomPassword)
     new_password = generator()
     encoded = pwd_mgr.encodePassword(new_password)
-    confirmed.set(uuid,
-                  email=record.email,
-                  login=record.login,
-                  password=encoded,
-                  security_question=record.security_question,
-                  security_answer=record.security_answer,
-                  token=record.token,
-                 )
+    confirmed.update(uuid, password=encoded)
     from_addr = request.registry.settings['cartouche.from_addr']
-    delivery = request.registry.queryUtility(IMailDelivery,
-                                             default=localhost_mta)
+    delivery = getMailDelivery(request)
     login_url = view_url(request.context, request, 'login_url', 'login.html')
     body = PASSWORD_EMAIL % {'password': new_password, 'login_url': login_url}
     message = Message()
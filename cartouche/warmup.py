@@ -0,0 +1,84 @@
+##############################################################################
+#
+# Copyright (c) 2010 Agendaless Consulting and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+""" Compile templates ahead of the first request.
+
+Chameleon compiles each template the first time it is rendered, so the
+first request to each view in a fresh worker is slow.  :func:`warmup`
+compiles the cartouche view templates and the deform widget templates up
+front, and resolves the main template (see
+:func:`cartouche.util.getMainTemplate`).  With the ``cartouche.template_cache``
+setting, the compiled templates are also kept as modules in that directory,
+where later processes load them rather than compiling them again.
+"""
+import os
+
+from deform import Form
+from pyramid.renderers import get_renderer
+from pyramid.request import Request
+
+from cartouche.registration import deform_templates_dir
+from cartouche.registration import templates_dir
+from cartouche.util import getMainTemplate
+
+CACHE_SETTING = 'cartouche.template_cache'
+WARMUP_SETTING = 'cartouche.warmup_templates'
+
+
+def useTemplateCache(path):
+    """ Keep compiled Chameleon templates as modules in the directory 'path'.
+
+    Affects every template compiled afterwards in the process.
+    """
+    from chameleon.loader import ModuleLoader
+    from chameleon.template import BaseTemplate
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    BaseTemplate.loader = ModuleLoader(path)
+
+
+def templateNames(directory):
+    """ Yield the names of the '.pt' files under 'directory', sorted.
+
+    Names are relative to 'directory', without the extension.
+    """
+    for dirpath, dirnames, filenames in os.walk(directory):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            name, ext = os.path.splitext(filename)
+            if ext == '.pt':
+                path = os.path.join(dirpath, name)
+                yield os.path.relpath(path, directory).replace(os.sep, '/')
+
+
+def warmup(registry):
+    """ Compile the cartouche view templates and the deform widget templates.
+
+    'registry' must have 'pyramid_chameleon' included.  Return the number of
+    templates compiled (or loaded from the cache).
+    """
+    count = 0
+    for name in templateNames(templates_dir):
+        renderer = get_renderer('cartouche:templates/%s.pt' % name,
+                                registry=registry)
+        renderer.implementation().cook_check()
+        count += 1
+    for name in templateNames(deform_templates_dir):
+        # Loaded by name, as deform does, so overrides in 'templates_dir'
+        # are the ones compiled.
+        Form.default_renderer.load(name).cook_check()
+        count += 1
+    request = Request.blank('/')
+    request.registry = registry
+    getMainTemplate(request)
+    return count
@@ -11,31 +11,55 @@
 # FITNESS FOR A PARTICULAR PURPOSE
 #
 ##############################################################################
+import hmac
+import os
+from hashlib import sha256
+from threading import Lock
 
-from pyramid.threadlocal import get_current_registry
-from pyramid.threadlocal import get_current_request
 from repoze.who.interfaces import IAuthenticator
-from repoze.zodbconn.finder import PersistentApplicationFinder
+from repoze.who.interfaces import IMetadataProvider
 from zope.interface import implementer
 from zope.password.password import SSHAPasswordManager
 
-from cartouche import appmaker
-from cartouche.interfaces import IRegistrations
-from cartouche.persistence import ConfirmedRegistrations
+from cartouche.lru import LRUCache
+from cartouche.snapshot import CredentialSnapshot
 
-@implementer(IAuthenticator)
+# The database-backed lookup imports Pyramid, ZODB and the storage adapters
+# on first use, keeping snapshot-only processes (e.g. 'cartouche.authcheck')
+# small.
+
+# Set by 'add_metadata' on the identity of a user who is still confirmed.
+CONFIRMED_KEY = 'cartouche.confirmed'
+
+@implementer(IAuthenticator, IMetadataProvider)
 class WhoPlugin(object):
     _finder = None
-    _opened = None
 
-    def __init__(self, zodb_uri):
+    _verified = None
+
+    def __init__(self, zodb_uri, cache_size=0, cache_ttl=None,
+                 snapshot=None):
         self._zodb_uri = zodb_uri
+        # If passed, a 'CredentialSnapshot':  authenticate against it alone,
+        # without opening the database.
+        self._snapshot = snapshot
         self._pwd_mgr = SSHAPasswordManager()
+        self._finder_lock = Lock()
+        if cache_size:
+            # Opt-in cache of verified credentials:  skip rehashing the
+            # password for clients which re-send it on every request
+            # (e.g., basic auth).
+            self._verified = LRUCache(cache_size, cache_ttl)
+            self._digest_key = os.urandom(32)
 
     def _getFinder(self):
-        if self._finder is None:
-            self._finder = PersistentApplicationFinder(self._zodb_uri, appmaker)
-        return self._finder
+        with self._finder_lock:
+            if self._finder is None:
+                from cartouche import appmaker
+                from cartouche.databases import SharedApplicationFinder
+                self._finder = SharedApplicationFinder(self._zodb_uri,
+                                                       appmaker)
+            return self._finder
 
     def authenticate(self, environ, identity):
         """ See IAuthenticator.
@@ -43,27 +67,121 @@ class WhoPlugin(object):
         login = identity.get('login')
         password = identity.get('password')
         if login is not None and password is not None:
-            request = get_current_request()
-            context = getattr(request, 'context', None)
-            registry = get_current_registry()
-            confirmed = registry.queryAdapter(context, IRegistrations,
-                                              name='confirmed')
-            if confirmed is None:
-                if getattr(context, '_p_jar', None) is None:
-                    context = self._opened = self._getFinder()(environ)
-                while context.__parent__ is not None:
-                    context = context.__parent__
-                confirmed = ConfirmedRegistrations(context)
-            record = confirmed.get_by_login(login)
-            if record and self._pwd_mgr.checkPassword(record.password,
-                                                      password):
-                return record.uuid
+            if self._snapshot is not None:
+                return self._authenticateSnapshot(identity, login, password)
+            confirmed = self._getConfirmed(environ)
+            found = self._getCredentials(confirmed, login)
+            if found is not None and found[1]:
+                uuid, hashed = found
+                return self._checkPassword(login, uuid, hashed, password)
+
+    def add_metadata(self, environ, identity):
+        """ See IMetadataProvider.
+
+        Check that the authenticated user (e.g. identified by an 'auth_tkt'
+        cookie) is still confirmed:  if so, mark the identity with
+        'CONFIRMED_KEY', and add the user's groups as 'groups'.
+        """
+        userid = identity.get('repoze.who.userid')
+        if self._snapshot is not None:
+            found = self._snapshot.get_by_uuid(userid)
+            if found is None:
+                return
+            groups = found[2]
+        else:
+            confirmed = self._getConfirmed(environ)
+            if userid is None or confirmed.get(userid) is None:
+                return
+            groups = tuple(self._getGroups(environ).groups_of(userid))
+        identity[CONFIRMED_KEY] = True
+        identity['groups'] = groups
+
+    def _authenticateSnapshot(self, identity, login, password):
+        found = self._snapshot.get(login)
+        if found is not None and found[1]:
+            uuid, hashed, groups = found
+            return self._checkPassword(login, uuid, hashed, password)
+
+    def _getConfirmed(self, environ):
+        from cartouche.interfaces import IRegistrations
+        from cartouche.persistence import ConfirmedRegistrations
+        return self._getAdapter(environ, IRegistrations, 'confirmed',
+                                ConfirmedRegistrations)
+
+    def _getGroups(self, environ):
+        from cartouche.interfaces import IGroups
+        from cartouche.persistence import Groups
+        return self._getAdapter(environ, IGroups, '', Groups)
+
+    def _getAdapter(self, environ, iface, name, factory):
+        from pyramid.threadlocal import get_current_registry
+        from pyramid.threadlocal import get_current_request
+        request = get_current_request()
+        context = getattr(request, 'context', None)
+        registry = get_current_registry()
+        adapter = registry.queryAdapter(context, iface, name=name)
+        if adapter is None:
+            if getattr(context, '_p_jar', None) is None:
+                # Reuses the request's connection, if any;  otherwise
+                # opens one which is closed along with the request.
+                context = self._getFinder()(environ)
+            while context.__parent__ is not None:
+                context = context.__parent__
+            adapter = factory(context)
+        return adapter
+
+    def _getCredentials(self, confirmed, login):
+        get_credentials = getattr(confirmed, 'get_credentials', None)
+        if get_credentials is not None:
+            return get_credentials(login)
+        record = confirmed.get_by_login(login)
+        if record:
+            return record.uuid, record.password
+
+    def _checkPassword(self, login, uuid, hashed, password):
+        if self._verified is None:
+            if self._pwd_mgr.checkPassword(hashed, password):
+                return uuid
+            return None
+        # The digest covers the stored hash, so a changed password
+        # invalidates the cached entry.
+        digest = self._digest(hashed, password)
+        cached = self._verified.get(login)
+        if cached is not None:
+            if hmac.compare_digest(cached[0], digest):
+                return cached[1]
+            self._verified.remove(login)
+        if self._pwd_mgr.checkPassword(hashed, password):
+            self._verified.set(login, (digest, uuid))
+            return uuid
+
+    def _digest(self, hashed, password):
+        if not isinstance(hashed, bytes):
+            hashed = hashed.encode('utf-8')
+        if not isinstance(password, bytes):
+            password = password.encode('utf-8')
+        return hmac.new(self._digest_key, hashed + b'\0' + password,
+                        sha256).digest()
 
     def close(self):
-        """ Close opened database.
+        """ Release our reference to the shared database for our URI.
+
+        The database stays open while the application (or another plugin)
+        still uses it.
         """
-        if self._opened is not None:
-            self._opened._p_jar.db().close()
+        with self._finder_lock:
+            finder = self._finder
+        if finder is not None:
+            finder.close()
 
-def make_plugin(zodb_uri):
-    return WhoPlugin(zodb_uri)
+def make_plugin(zodb_uri=None, cache_size=0, cache_ttl=None,
+                snapshot=None, snapshot_reload=60):
+    if cache_ttl is not None:
+        cache_ttl = float(cache_ttl)
+    if snapshot is not None:
+        if snapshot_reload is not None:
+            snapshot_reload = float(snapshot_reload)
+        snapshot = CredentialSnapshot(snapshot, snapshot_reload)
+    elif zodb_uri is None:
+        raise ValueError('Either zodb_uri or snapshot is required')
+    return WhoPlugin(zodb_uri, int(cache_size), cache_ttl, snapshot)
@@ -72,8 +72,16 @@ setup(name='cartouche',
       entry_points = """\
       [paste.app_factory]
       main = cartouche:main
+      authcheck = cartouche.authcheck:make_app
       [console_scripts]
       add_cartouche_admin = cartouche.scripts.add_cartouche_admin:main
+      reap_cartouche_pending = cartouche.scripts.reap_cartouche_pending:main
+      import_cartouche_users = cartouche.scripts.import_cartouche_users:main
+      export_cartouche_users = cartouche.scripts.export_cartouche_users:main
+      migrate_cartouche = cartouche.scripts.migrate_cartouche:main
+      snapshot_cartouche_credentials = cartouche.scripts.snapshot_cartouche_credentials:main
+      cartouche_mailq = cartouche.scripts.cartouche_mailq:main
+      warmup_cartouche_templates = cartouche.scripts.warmup_cartouche_templates:main
       """,
       extras_require = {
         'testing': ['nose', 'coverage'],